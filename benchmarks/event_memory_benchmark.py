@@ -0,0 +1,45 @@
+"""
+Measures the bytes each queued event costs, for the watchdog (event, event_type) tuples the queue used to hold and
+for EventRecord.
+
+Usage:
+    python -m benchmarks.event_memory_benchmark [--events 200000]
+"""
+import argparse
+import gc
+import queue
+import tracemalloc
+
+from watchdog.events import FileModifiedEvent
+
+from utilities.events import EventRecord, EventType
+
+ROOT = '/home/app/media/public/mofreitas/clientes'
+
+
+def paths(count: int):
+    for index in range(count):
+        yield f"{ROOT}/client-{index % 50}@example.com/budget-{index % 7}/folder-{index % 400}/file-{index}.pdf"
+
+
+def measure(label: str, make, count: int):
+    gc.collect()
+    tracemalloc.start()
+    backlog = queue.Queue()
+    for path in paths(count):
+        backlog.put(make(path))
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<32} {size / count:>8.1f} bytes/event {size / 1024 / 1024:>9.1f} MiB for {count} events")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=200000)
+    args = parser.parse_args()
+    measure('(FileModifiedEvent, str) tuple', lambda path: (FileModifiedEvent(path), 'modified'), args.events)
+    measure('EventRecord', lambda path: EventRecord(EventType.MODIFIED, path), args.events)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,443 @@
+"""
+Load test of the whole sync pipeline against a local stand-in for the storage API that injects faults.
+
+Files are written under a temporary WATCHING_DIR while the daemon machinery of main.py runs: the watchdog Observer,
+the EventHandler, the event worker, task.process_event on the lanes and the backlog. The stand-in answers a fraction
+of the requests with 500s, leaves some hanging past REQUEST_TIMEOUT, resets some connections (before or after
+applying the request, i.e. the reply is lost) and adds log-normal latency to every request. Once the fault window
+is over the faults stop and the harness waits for the pipeline to settle.
+
+Reported: throughput, lag percentiles (file written -> first upload received), requests by status, injected faults,
+parked events and circuit openings, duplicate uploads and the final remote-vs-local consistency.
+
+Usage:
+    python -m benchmarks.load_harness [--files 300] [--rate 50] [--error-rate 0.05] [--hang-rate 0.01]
+                                      [--reset-rate 0.02] [--latency-ms 20] [--latency-sigma 0.5]
+                                      [--fault-seconds 20] [--settle 120] [--seed 1]
+                                      [--engine threaded|async|processes] [--processes 4]
+
+Exits with 1 when the remote tree does not match the local one.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import re
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+API = '/api/v1'
+
+
+class Faults:
+    def __init__(self, error_rate: float, hang_rate: float, reset_rate: float, latency_ms: float,
+                 latency_sigma: float, hang_seconds: float):
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.reset_rate = reset_rate
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.hang_seconds = hang_seconds
+        self.enabled = True
+
+    def latency(self) -> float:
+        if self.latency_ms <= 0:
+            return 0.0
+        return random.lognormvariate(0, self.latency_sigma) * self.latency_ms / 1000
+
+    def pick(self) -> Optional[str]:
+        if not self.enabled:
+            return None
+        draw = random.random()
+        for kind, rate in (('error', self.error_rate), ('hang', self.hang_rate), ('reset', self.reset_rate)):
+            if draw < rate:
+                return kind
+            draw -= rate
+        return None
+
+
+class Storage:
+    """In-memory folders and files, with the paths the real API derives from the folder parents."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.folders: Dict[str, dict] = dict()
+        self.files: Dict[str, dict] = dict()
+        # (folder path, file name) -> monotonic time of the first upload
+        self.received: Dict[Tuple[str, str], float] = dict()
+        self.uploads: Counter = Counter()
+        self.requests: Counter = Counter()
+        self.faults: Counter = Counter()
+
+    def folder_path(self, folder_id: Optional[str]) -> Optional[str]:
+        folder = self.folders.get(folder_id)
+        return folder['path'] if folder else None
+
+    def create_folder(self, data: dict) -> Tuple[int, dict]:
+        with self.lock:
+            if data.get('parent') is None:
+                path = f"mofreitas/clientes/{data['email']}/{data['name']}"
+            else:
+                parent = self.folder_path(data['parent'])
+                if parent is None:
+                    return 400, dict(parent=['Invalid pk.'])
+                path = f"{parent}/{data['name']}"
+            pk = str(next(self.ids))
+            self.folders[pk] = dict(id=pk, name=data['name'], parent=data.get('parent'), budget=data.get('budget'),
+                                    path=path)
+            return 201, self.folders[pk]
+
+    def update_folder(self, pk: str, data: dict) -> Tuple[int, dict]:
+        with self.lock:
+            folder = self.folders.get(pk)
+            if folder is None:
+                return 404, dict()
+            old = folder['path']
+            folder.update({key: value for key, value in data.items() if key in ('name', 'parent', 'budget')})
+            parent = self.folder_path(folder['parent'])
+            folder['path'] = f"{parent}/{folder['name']}" if parent else old.rpartition('/')[0] + '/' + folder['name']
+            for other in self.folders.values():
+                if other['path'].startswith(old + '/'):
+                    other['path'] = folder['path'] + other['path'][len(old):]
+            return 200, folder
+
+    def list_folders(self, query: dict) -> List[dict]:
+        def matches(folder: dict) -> bool:
+            for key, value in query.items():
+                if key in ('page', 'page_size'):
+                    continue
+                if key.endswith('__startswith'):
+                    if not str(folder.get(key[:-len('__startswith')])).startswith(value):
+                        return False
+                elif str(folder.get(key)) != value:
+                    return False
+            return True
+
+        with self.lock:
+            return [folder for folder in self.folders.values() if matches(folder)]
+
+    def upload(self, folder_id: str, file_name: str, size: int) -> Tuple[int, dict]:
+        with self.lock:
+            folder = self.folder_path(folder_id)
+            if folder is None:
+                return 400, dict(folder=['Invalid pk.'])
+            pk = str(next(self.ids))
+            self.files[pk] = dict(id=pk, folder=folder_id, file_name=file_name, size=size)
+            self.received.setdefault((folder, file_name), time.monotonic())
+            self.uploads[(folder, file_name)] += 1
+            return 201, self.files[pk]
+
+    def remote_files(self) -> Counter:
+        with self.lock:
+            return Counter((self.folder_path(file['folder']), file['file_name']) for file in self.files.values())
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: 'FaultyStorageAPI'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch()
+
+    def do_POST(self):
+        self.dispatch()
+
+    def do_PATCH(self):
+        self.dispatch()
+
+    def do_DELETE(self):
+        self.dispatch()
+
+    def reply(self, status: int, content: Optional[dict] = None):
+        body = json.dumps(content).encode() if content is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.storage.requests[(self.command, status)] += 1
+
+    def reset(self):
+        # SO_LINGER with a zero timeout makes close() send a RST instead of a FIN
+        self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        self.close_connection = True
+        self.connection.close()
+        self.server.storage.requests[(self.command, 'reset')] += 1
+
+    def dispatch(self):
+        storage, faults = self.server.storage, self.server.faults
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        url = urlsplit(self.path)
+        if url.path.endswith('/auth/token'):
+            return self.reply(200, dict(access_token='load-harness', expires_in=3600))
+
+        time.sleep(faults.latency())
+        fault = faults.pick()
+        if fault is not None:
+            storage.faults[fault] += 1
+        if fault == 'error':
+            return self.reply(500, dict(detail='Injected error.'))
+        if fault == 'hang':
+            time.sleep(faults.hang_seconds)
+            return self.reset()
+        if fault == 'reset' and random.random() < 0.5:
+            return self.reset()
+
+        status, content = self.route(url.path[len(API):], dict(parse_qsl(url.query)), body)
+        if fault == 'reset':
+            # applied, but the reply is lost
+            return self.reset()
+        self.reply(status, content)
+
+    def route(self, path: str, query: dict, body: bytes) -> Tuple[int, Optional[dict]]:
+        storage = self.server.storage
+        if path in ('', '/'):
+            return 200, dict()
+        if path == '/storages/folder/' and self.command == 'GET':
+            return 200, self.page(storage.list_folders(query), query)
+        if path == '/storages/folder/create_folder_with_email/' and self.command == 'POST':
+            return storage.create_folder(json.loads(body))
+        match = re.fullmatch(r'/storages/folder/(\w+)/', path)
+        if match and self.command == 'PATCH':
+            return storage.update_folder(match.group(1), json.loads(body or b'{}'))
+        if match and self.command == 'DELETE':
+            with storage.lock:
+                storage.folders.pop(match.group(1), None)
+            return 204, None
+        if path == '/storages/file/' and self.command == 'GET':
+            with storage.lock:
+                results = [file for file in storage.files.values() if file['folder'] == query.get('folder')
+                           and Path(file['file_name']).stem == query.get('file_name', Path(file['file_name']).stem)]
+            return 200, self.page(results, query)
+        if path == '/storages/file/' and self.command == 'POST':
+            fields, file_name, size = self.multipart(body)
+            return storage.upload(fields.get('folder'), file_name, size)
+        match = re.fullmatch(r'/storages/file/(\w+)/update_file_name/', path)
+        if match and self.command == 'PATCH':
+            with storage.lock:
+                file = storage.files.get(match.group(1))
+                if file is None:
+                    return 404, dict()
+                file['file_name'] = json.loads(body)['file_name']
+            return 200, file
+        match = re.fullmatch(r'/storages/file/(\w+)/', path)
+        if match and self.command == 'DELETE':
+            with storage.lock:
+                storage.files.pop(match.group(1), None)
+            return 204, None
+        return 404, dict(detail='Not found.')
+
+    def page(self, results: List[dict], query: dict) -> dict:
+        size, number = int(query.get('page_size', 100)), int(query.get('page', 1))
+        following = None
+        if number * size < len(results):
+            following = f"http://{self.headers['Host']}{urlsplit(self.path).path}?" + '&'.join(
+                f"{key}={value}" for key, value in {**query, 'page': number + 1}.items())
+        return dict(count=len(results), next=following, results=results[(number - 1) * size:number * size])
+
+    def multipart(self, body: bytes) -> Tuple[dict, Optional[str], int]:
+        head = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode()
+        message = BytesParser(policy=HTTP).parsebytes(head + body)
+        fields, file_name, size = dict(), None, 0
+        for part in message.iter_parts():
+            payload = part.get_payload(decode=True) or b''
+            if part.get_filename():
+                file_name, size = part.get_filename(), len(payload)
+            else:
+                fields[part.get_param('name', header='content-disposition')] = payload.decode()
+        return fields, file_name, size
+
+
+class FaultyStorageAPI(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, faults: Faults):
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.faults = faults
+        self.storage = Storage()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def configure(args, api: FaultyStorageAPI, workdir: Path) -> Path:
+    """Points the settings at the stand-in; must run before anything imports settings."""
+    watching = workdir.joinpath('mofreitas')
+    watching.joinpath('clientes').mkdir(parents=True)
+    os.environ.update({
+        'FILE_FINDER_URL': api.url + API,
+        'FILE_FINDER_TOKEN_URL': api.url + '/auth/token',
+        'FILE_FINDER_TOKEN_CACHE_FILE': '',
+        'FILE_FINDER_WATCHING_DIR': str(watching),
+        'FILE_FINDER_DATA_DIR': str(workdir.joinpath('data')),
+        'FILE_FINDER_REQUEST_TIMEOUT': str(args.timeout),
+        'FILE_FINDER_BREAKER_RESET_TIMEOUT': '2',
+        'FILE_FINDER_BREAKER_MAX_RESET_TIMEOUT': '10',
+        'FILE_FINDER_BACKLOG_DRAIN_RATE': '50',
+        'FILE_FINDER_DELAY_FOR_SCAN': str(args.scan_delay),
+        'FILE_FINDER_TRACE_SAMPLE_RATE': '0',
+    })
+    return watching
+
+
+def write_files(watching: Path, count: int, rate: float) -> Dict[Tuple[str, str], float]:
+    """
+    Writes ``count`` files spread over users, budgets and subfolders, one in four directly in its budget folder, and
+    returns when each one was closed.
+    """
+    written: Dict[Tuple[str, str], float] = dict()
+    for index in range(count):
+        budget = watching.joinpath('clientes', f"user{index % 3}@example.com", f"budget-{index % 5}")
+        folder = budget if index % 4 == 0 else budget.joinpath('docs', f"sub-{index % 7}")
+        folder.mkdir(parents=True, exist_ok=True)
+        path = folder.joinpath(f"file-{index}.pdf")
+        path.write_bytes(os.urandom(random.randint(1024, 64 * 1024)))
+        written[(str(folder.relative_to(watching.parent)), path.name)] = time.monotonic()
+        time.sleep(1 / rate if rate > 0 else 0)
+    return written
+
+
+def run(args) -> int:
+    random.seed(args.seed)
+    faults = Faults(args.error_rate, args.hang_rate, args.reset_rate, args.latency_ms, args.latency_sigma,
+                    hang_seconds=args.timeout + 1)
+    api = FaultyStorageAPI(faults)
+    threading.Thread(target=api.serve_forever, name='storage-api', daemon=True).start()
+    workdir = Path(tempfile.mkdtemp(prefix='load-harness-'))
+    watching = configure(args, api, workdir)
+
+    import logging
+    import main as daemon
+    from watchdog.observers import Observer
+    from utilities import task
+    from utilities.backlog import backlog
+    from utilities.breaker import breaker
+    from utilities.handler import EventHandler
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+
+    if args.engine == 'async':
+        from utilities.async_engine import AsyncEngine
+        events = AsyncEngine(concurrency=args.concurrency, max_events=args.concurrency * 5)
+        events.start()
+        backlog.start(events.submit)
+    elif args.engine == 'processes':
+        from utilities.shards import ShardPool
+        # the workers inherit the environment set by configure(); they log nothing unless --verbose
+        quiet = None if args.verbose else dict(version=1, root=dict(level='CRITICAL'))
+        events = ShardPool(args.processes, interval=5, logging_config=quiet)
+        events.start()
+    else:
+        events = daemon.event_queue
+        backlog.start(task.submit_event)
+        threading.Thread(target=daemon.worker, daemon=True).start()
+    handler = EventHandler(events, daemon.delayed_scan_queue, daemon.directories_in_queue,
+                           prefetch=args.engine != 'processes')
+    threading.Thread(target=daemon.delayed_scan_worker, args=(handler,), daemon=True).start()
+    observer = Observer()
+    observer.schedule(handler, path=str(watching), recursive=True)
+    observer.start()
+
+    print(f"{args.engine.capitalize()} engine writing {args.files} files at {args.rate}/s into {watching}, faults for {args.fault_seconds}s: "
+          f"{args.error_rate:.0%} errors, {args.hang_rate:.0%} hangs, {args.reset_rate:.0%} resets, "
+          f"~{args.latency_ms:.0f} ms latency.")
+    start = time.monotonic()
+    threading.Timer(args.fault_seconds, lambda: setattr(faults, 'enabled', False)).start()
+    written = write_files(watching, args.files, args.rate)
+    while time.monotonic() - start < args.fault_seconds:
+        time.sleep(0.5)
+    faults.enabled = False
+    print(f"Faults stopped after {time.monotonic() - start:.1f}s, waiting up to {args.settle}s to settle.")
+
+    deadline = time.monotonic() + args.settle
+    while time.monotonic() < deadline:
+        received = api.storage.received
+        if all(key in received for key in written) and not len(backlog) and not events.qsize():
+            break
+        time.sleep(0.5)
+    # let the delayed rescans and in-flight uploads finish before comparing
+    time.sleep(args.scan_delay + 2)
+    observer.stop()
+    parked = events.parked_total if args.engine == 'processes' else backlog.parked_total
+    if args.engine == 'processes':
+        events.stop()
+
+    storage = api.storage
+    lags = [storage.received[key] - at for key, at in written.items() if key in storage.received]
+    last = max(storage.received.values(), default=start)
+    remote = storage.remote_files()
+    missing = [key for key in written if key not in remote]
+    duplicated = {key: count for key, count in remote.items() if count > 1}
+    extra = [key for key in remote if key not in written]
+    folder_paths = Counter(folder['path'] for folder in storage.folders.values())
+    duplicated_folders = {path: count for path, count in folder_paths.items() if count > 1}
+    mb = sum(file['size'] for file in storage.files.values()) / 1024 / 1024
+
+    print(f"\nThroughput: {len(lags)} files in {last - start:.1f}s, {len(lags) / max(last - start, 1e-9):.1f} files/s, "
+          f"{mb / max(last - start, 1e-9):.2f} MB/s uploaded.")
+    print(f"Lag (written -> uploaded): p50 {percentile(lags, .5):.2f}s, p90 {percentile(lags, .9):.2f}s, "
+          f"p99 {percentile(lags, .99):.2f}s, max {max(lags, default=float('nan')):.2f}s.")
+    print(f"Requests: {sum(storage.requests.values())}, " +
+          ', '.join(f"{method} {status}: {count}" for (method, status), count in sorted(storage.requests.items(),
+                                                                                       key=str)))
+    print(f"Injected faults: {dict(storage.faults) or 'none'}.")
+    print(f"Retries: {parked} events parked and replayed, circuit opened {breaker.opened} times, "
+          f"{sum(storage.uploads.values()) - len(storage.uploads)} repeated uploads.")
+    print(f"Consistency: {len(written)} local files, {sum(remote.values())} remote; {len(missing)} missing, "
+          f"{len(duplicated)} duplicated, {len(extra)} unexpected; {len(duplicated_folders)} duplicated folders.")
+    for key in missing[:10]:
+        print(f"  missing {key[0]}/{key[1]}")
+    for path in list(duplicated_folders)[:10]:
+        print(f"  duplicated folder {path}")
+    consistent = not missing and not extra and not duplicated_folders
+    print('CONSISTENT' if consistent else 'INCONSISTENT')
+    return 0 if consistent else 1
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=300)
+    parser.add_argument('--rate', type=float, default=50, help="files written per second, 0 writes them at once")
+    parser.add_argument('--error-rate', type=float, default=0.05, help="fraction of requests answered with 500")
+    parser.add_argument('--hang-rate', type=float, default=0.01, help="fraction of requests left hanging")
+    parser.add_argument('--reset-rate', type=float, default=0.02, help="fraction of connections reset")
+    parser.add_argument('--latency-ms', type=float, default=20, help="median latency added to every request")
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help="spread of the log-normal latency")
+    parser.add_argument('--fault-seconds', type=float, default=20, help="faults stop after this many seconds")
+    parser.add_argument('--settle', type=float, default=120, help="seconds to wait for the pipeline to catch up")
+    parser.add_argument('--timeout', type=int, default=2, help="REQUEST_TIMEOUT of the client")
+    parser.add_argument('--scan-delay', type=int, default=5, help="DELAY_FOR_SCAN of the client")
+    parser.add_argument('--engine', choices=('threaded', 'async', 'processes'), default='threaded')
+    parser.add_argument('--processes', type=int, default=4, help="worker processes of the processes engine")
+    parser.add_argument('--concurrency', type=int, default=100, help="requests in flight of the async engine")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--verbose', action='store_true', help="keep the daemon logs")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(run(parse_args()))
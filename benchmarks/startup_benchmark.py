@@ -0,0 +1,134 @@
+"""
+Time-to-first-watch and time-to-first-sync of 'main.py watch', started against the storage API stand-in of the load
+harness with a slow connection check and token endpoint, a large manifest to load and a tree of many directories.
+
+A probe file is written shortly after the daemon is spawned, while it is still starting: it is only synced when the
+observer was armed before it was written. Reported, in seconds since the spawn: when the daemon logged its observer as
+started, when the stand-in received the upload of the probe, and the milestones the daemon logs ('Startup: ...').
+
+Usage:
+    python -m benchmarks.startup_benchmark [--directories 2000] [--manifest 200000] [--check-delay 2]
+                                           [--token-delay 1] [--probe-after 0.5] [--runs 3] [--timeout 30]
+"""
+import argparse
+import json
+import os
+import re
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from benchmarks.load_harness import API, Faults, FaultyStorageAPI, Handler, configure
+
+OBSERVER_STARTED = re.compile(r"Observer '\w+' started in")
+MILESTONE = re.compile(r"Startup: '(\w+)' reached after ([\d.]+)s")
+
+
+class SlowHandler(Handler):
+    """Answers the token requests and the connection check of the daemon late, like a backend waking up."""
+
+    def dispatch(self):
+        path = self.path.partition('?')[0]
+        if path.endswith('/auth/token'):
+            time.sleep(self.server.token_delay)
+        elif path.rstrip('/') == API:
+            time.sleep(self.server.check_delay)
+        super().dispatch()
+
+
+def make_tree(tenant: Path, directories: int) -> Path:
+    for index in range(directories):
+        tenant.joinpath(f"budget-{index % 20}", f"folder-{index // 20}").mkdir(parents=True, exist_ok=True)
+    return tenant.joinpath('budget-0', 'folder-0')
+
+
+def write_manifest(path: Path, tenant: Path, entries: int):
+    files = {str(tenant.joinpath('old', f"file-{index}.pdf")): [1024, index, index, f"{index:064x}"]
+             for index in range(entries)}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(dict(files=files, bytes_saved=0, uploads_skipped=0)))
+
+
+def run_once(args, api: FaultyStorageAPI, probe_dir: Path, run: int) -> Dict[str, Optional[float]]:
+    seen: Dict[str, float] = dict()
+    started = time.monotonic()
+    daemon = subprocess.Popen([sys.executable, 'main.py', 'watch'], cwd=Path(__file__).resolve().parent.parent,
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+
+    def read():
+        for line in daemon.stdout:
+            if 'observer' not in seen and OBSERVER_STARTED.search(line):
+                seen['observer'] = time.monotonic() - started
+            match = MILESTONE.search(line)
+            if match:
+                seen.setdefault(f"daemon:{match.group(1)}", float(match.group(2)))
+
+    threading.Thread(target=read, daemon=True).start()
+    time.sleep(args.probe_after)
+    probe = probe_dir.joinpath(f"probe-{run}.pdf")
+    probe.write_bytes(os.urandom(4096))
+    written = time.monotonic() - started
+
+    deadline = started + args.timeout
+    synced = None
+    while time.monotonic() < deadline and synced is None:
+        at = next((at for (_, name), at in list(api.storage.received.items()) if name == probe.name), None)
+        synced = at - started if at is not None else None
+        time.sleep(0.05)
+    daemon.send_signal(signal.SIGINT)
+    try:
+        daemon.wait(10)
+    except subprocess.TimeoutExpired:
+        daemon.kill()
+    return dict(probe_written=written, observer=seen.get('observer'), probe_synced=synced,
+                **{name: value for name, value in seen.items() if name.startswith('daemon:')})
+
+
+def run(args) -> int:
+    api = FaultyStorageAPI(Faults(0, 0, 0, 0, 0.5, 0))
+    api.faults.enabled = False
+    api.RequestHandlerClass = SlowHandler
+    api.token_delay, api.check_delay = args.token_delay, args.check_delay
+    threading.Thread(target=api.serve_forever, name='storage-api', daemon=True).start()
+    workdir = Path(tempfile.mkdtemp(prefix='startup-benchmark-'))
+    watching = configure(argparse.Namespace(timeout=10, scan_delay=60), api, workdir)
+    os.environ.update({'FILE_FINDER_STATUS_ADDRESS': '', 'FILE_FINDER_CONTROL_SOCKET': '',
+                       'FILE_FINDER_FULL_SCAN_ON_STARTUP': 'False'})
+    tenant = watching.joinpath('clientes', 'user@example.com')
+    probe_dir = make_tree(tenant, args.directories)
+    write_manifest(workdir.joinpath('data', 'manifest.json'), tenant, args.manifest)
+    print(f"{args.directories} directories, {args.manifest} manifest entries, connection check answered after "
+          f"{args.check_delay}s, token after {args.token_delay}s, probe written {args.probe_after}s after the spawn.")
+
+    results = [run_once(args, api, probe_dir, run) for run in range(args.runs)]
+    names = sorted({name for result in results for name in result})
+    print(f"\nSeconds since the spawn, median of {args.runs} runs (missed: the probe was never synced):")
+    for name in names:
+        values = [result.get(name) for result in results]
+        found = [value for value in values if value is not None]
+        median = f"{statistics.median(found):.2f}" if found else '-'
+        missed = f", missed {len(values) - len(found)}" if len(found) < len(values) else ''
+        print(f"  {name:24} {median}{missed}")
+    return 0 if all(result['probe_synced'] is not None for result in results) else 1
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--directories', type=int, default=2000, help="directories the observer watches")
+    parser.add_argument('--manifest', type=int, default=200000, help="entries of the manifest of the previous run")
+    parser.add_argument('--check-delay', type=float, default=2, help="seconds before the connection check answers")
+    parser.add_argument('--token-delay', type=float, default=1, help="seconds before the token endpoint answers")
+    parser.add_argument('--probe-after', type=float, default=0.5, help="seconds after the spawn the probe is written")
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--timeout', type=float, default=30, help="seconds to wait for the probe to be synced")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    sys.exit(run(parse_args()))
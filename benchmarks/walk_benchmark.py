@@ -0,0 +1,69 @@
+"""
+Compares the files/sec of the original os.walk based scan with the scandir TreeWalker.
+
+Usage:
+    python -m benchmarks.walk_benchmark [PATH] [--workers 1 4 8 16]
+
+Without PATH a synthetic tree is generated in a temporary directory.
+"""
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from utilities.walker import TreeWalker
+
+
+def make_tree(root: Path, budgets: int = 20, folders: int = 10, files: int = 50) -> int:
+    count = 0
+    for budget in range(budgets):
+        for folder in range(folders):
+            directory = root.joinpath(f"budget-{budget}", f"folder-{folder}", "docs")
+            directory.mkdir(parents=True)
+            for index in range(files):
+                directory.joinpath(f"file-{index}.pdf").touch()
+                count += 1
+    return count
+
+
+def os_walk_scan(directory) -> int:
+    """The scan loop of EventHandler.scan_directory before the TreeWalker."""
+    count = 0
+    for root, dirs, files in os.walk(directory):
+        for file in files:
+            path = Path(os.path.join(root, file))
+            if not path.__str__().endswith('tmp') and not path.__str__().startswith('syncthing'):
+                count += 1
+    return count
+
+
+def walker_scan(directory, workers: int) -> int:
+    return sum(1 for _ in TreeWalker(workers=workers).walk(directory))
+
+
+def measure(label: str, fn, *args):
+    start = time.perf_counter()
+    count = fn(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<24} {count:>9} files {elapsed:>8.3f}s {count / elapsed:>12.0f} files/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', nargs='?')
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 4, 8, 16])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.path
+        if path is None:
+            path = tmp
+            print(f"Generated {make_tree(Path(tmp))} files in {tmp}")
+        measure('os.walk', os_walk_scan, path)
+        for workers in args.workers:
+            measure(f'TreeWalker({workers})', walker_scan, path, workers)
+
+
+if __name__ == '__main__':
+    main()
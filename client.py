@@ -1,10 +1,160 @@
-from requests_auth import OAuth2ClientCredentials, OAuth2, JsonTokenFileCache
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+import requests
+from requests.auth import AuthBase
+
 import settings
 
-OAuth2.token_cache = JsonTokenFileCache('./cache.json')
+logger = logging.getLogger(__name__)
+
+# Seconds before the first retry of a failed background refresh, doubled after every failure up to the ceiling.
+RETRY_FLOOR = 5
+RETRY_CEILING = 300
+
+
+class TokenManager(AuthBase):
+    """
+    OAuth2 client-credentials authentication that keeps the access token in memory.
+
+    The token is refreshed by a background timer ``refresh_margin`` seconds before it expires, or after 80% of its
+    lifetime for tokens shorter than that, so requests never pay for the token fetch. A failed background refresh is
+    retried with an exponential backoff. Refreshes are single-flight: concurrent callers wait for the refresh in progress and
+    reuse its token. A request answered with 401 is retried once with a fresh token. The token can optionally be
+    persisted to ``cache_file`` so a restart can start with a still valid token.
+    """
+
+    def __init__(self, client_id: str, client_secret: str, token_url: str, refresh_margin: int = 60,
+                 cache_file: Optional[Union[str, Path]] = None, timeout: int = 30):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.token_url = token_url
+        self.refresh_margin = refresh_margin
+        self.cache_file = Path(cache_file) if cache_file else None
+        self.timeout = timeout
+        self._token: Optional[str] = None
+        self._expires_at: float = 0.0
+        self._refresh_lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._retry_delay: float = 0.0
+        self._load()
+
+    def __call__(self, r: requests.PreparedRequest) -> requests.PreparedRequest:
+        r.headers['Authorization'] = f"Bearer {self.get_token()}"
+        r.register_hook('response', self.handle_401)
+        return r
+
+    def is_valid(self) -> bool:
+        return self._token is not None and time.time() < self._expires_at
+
+    def get_token(self) -> str:
+        token = self._token
+        if token is not None and time.time() < self._expires_at:
+            return token
+        return self.refresh()
+
+    def refresh(self, stale: Optional[str] = None) -> str:
+        """
+        Fetches a new token unless another thread already replaced the current one while we waited for the lock.
+
+        Args:
+            stale (Optional[str]): The token the caller wants replaced even if it has not expired yet.
+
+        Returns:
+            str: A valid access token.
+        """
+        with self._refresh_lock:
+            if self.is_valid() and (stale is None or self._token != stale):
+                return self._token
+            token, expires_in = self.request_new_token()
+            self._token = token
+            self._expires_at = time.time() + expires_in
+            self._retry_delay = 0.0
+            self._schedule_refresh(self.refresh_delay(expires_in))
+            self._save()
+            logger.info(f"OAuth token refreshed, valid for {expires_in} seconds.")
+            return token
+
+    def request_new_token(self) -> Tuple[str, int]:
+        response = requests.post(self.token_url, data={'grant_type': 'client_credentials'},
+                                 auth=(self.client_id, self.client_secret), timeout=self.timeout)
+        response.raise_for_status()
+        content = response.json()
+        return content['access_token'], int(content.get('expires_in', 3600))
+
+    def handle_401(self, r: requests.Response, **kwargs) -> requests.Response:
+        if r.status_code != 401:
+            return r
+        sent: str = r.request.headers.get('Authorization', '')
+        logger.info(f"Request to '{r.request.url}' answered with 401, retrying with a new token.")
+        token = self.refresh(stale=sent[len('Bearer '):])
+        # Consume content and release the original connection so it can be reused.
+        _ = r.content
+        r.close()
+        prep = r.request.copy()
+        prep.headers['Authorization'] = f"Bearer {token}"
+        prep.deregister_hook('response', self.handle_401)
+        _r = r.connection.send(prep, **kwargs)
+        _r.history.append(r)
+        _r.request = prep
+        return _r
+
+    def refresh_delay(self, expires_in: float) -> float:
+        """Seconds until the background refresh of a token valid for ``expires_in`` seconds."""
+        return max(expires_in * 0.8, expires_in - self.refresh_margin)
+
+    def _schedule_refresh(self, delay: float):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(max(delay, 1), self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self):
+        stale = self._token
+        try:
+            self.refresh(stale=stale)
+        except Exception as error:
+            self._retry_delay = min(max(self._retry_delay * 2, RETRY_FLOOR), RETRY_CEILING)
+            logger.error(f"Background token refresh failed, retrying in {self._retry_delay:.0f}s: {error}")
+            self._schedule_refresh(self._retry_delay)
+
+    def _load(self):
+        if self.cache_file is None or not self.cache_file.is_file():
+            return
+        try:
+            content = json.loads(self.cache_file.read_text())
+            token, expires_at = content['access_token'], float(content['expires_at'])
+        except (ValueError, KeyError, TypeError) as error:
+            logger.info(f"Ignoring token cache '{self.cache_file}': {error}")
+            return
+        remaining = expires_at - time.time()
+        if remaining > self.refresh_margin:
+            self._token, self._expires_at = token, expires_at
+            self._schedule_refresh(self.refresh_delay(remaining))
+            logger.info(f"Warm-started OAuth token from '{self.cache_file}'.")
+
+    def _save(self):
+        if self.cache_file is None:
+            return
+        try:
+            tmp = self.cache_file.with_suffix('.tmp')
+            with os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as file:
+                json.dump(dict(access_token=self._token, expires_at=self._expires_at), file)
+            os.replace(tmp, self.cache_file)
+        except OSError as error:
+            logger.error(f"Unable to persist the token cache '{self.cache_file}': {error}")
+
 
-oauth = OAuth2ClientCredentials(
+oauth = TokenManager(
     client_id=settings.CLIENT_ID,
     client_secret=settings.CLIENT_SECRET,
     token_url=settings.TOKEN_URL,
+    refresh_margin=settings.TOKEN_REFRESH_MARGIN,
+    cache_file=settings.for_shard(settings.TOKEN_CACHE_FILE) or None,
 )
@@ -1,15 +1,30 @@
+import argparse
+import functools
+import json
 import logging.config
 import queue
+import sys
 import threading
 import time
-from typing import Tuple
+from typing import List
 
-from watchdog.events import FileSystemEvent
 from watchdog.observers import Observer
 
 import settings
-from utilities import task, http_requests as http
+from utilities import batch, control, diagnostics, status, task, lanes, http_requests as http
+from utilities.backlog import backlog
+from utilities.breaker import breaker
+from utilities.cache import folder_cache
+from utilities.events import EventRecord
 from utilities.handler import EventHandler
+from utilities.leases import leases, OwnedEvents
+from utilities.manifest import manifest
+from utilities.metrics import metrics
+from utilities.poller import IndexedObserver
+from utilities.roots import roots, resolve
+from utilities.startup import startup
+from utilities.status import sync_status
+from utilities.walker import ScanCheckpoint
 
 # Logger Configuration
 logging.config.dictConfig(settings.LOGGER)
@@ -27,11 +42,10 @@ sentinel = object()
 # Worker functions
 def worker():
     while True:
-        event_tuple: Tuple[FileSystemEvent, str] = event_queue.get()
-        if event_tuple is sentinel:
+        event: EventRecord = event_queue.get()
+        if event is sentinel:
             break
-        event, event_type = event_tuple
-        task.process_event(event, event_type)
+        task.dispatch_event(event)
 
 
 def delayed_scan_worker(event_handler):
@@ -44,25 +58,201 @@ def delayed_scan_worker(event_handler):
         directories_in_queue.remove(directory)
 
 
+def full_scan(event_handler):
+    for root in roots:
+        checkpoint = ScanCheckpoint.for_root(root.path)
+        # an unfinished checkpoint means the previous run stopped in the middle of a full scan
+        if settings.FULL_SCAN_ON_STARTUP or checkpoint.unfinished:
+            event_handler.scan_directory(root.path, checkpoint=checkpoint)
+
+
+def rescan_shard(event_handler: EventHandler, shard: int):
+    """A shard taken over from another watcher is rescanned for what changed while no watcher held it."""
+    for root in roots:
+        for tenant in leases.tenants(root.tenants_dir, shard):
+            event_handler.add_to_dir_queue(tenant)
+
+
+def warm_up():
+    if http.test_connection():
+        startup.reached('connected')
+
+
+def register_gauges(event_handler: EventHandler):
+    """Sizes dumped by SIGUSR1, see utilities.diagnostics."""
+    diagnostics.register_gauge('event_queue', event_queue.qsize)
+    diagnostics.register_gauge('delayed_scan_queue', delayed_scan_queue.qsize)
+    diagnostics.register_gauge('directories_in_queue', lambda: len(directories_in_queue))
+    diagnostics.register_gauge('metadata_lane', lanes.metadata_lane.qsize)
+    diagnostics.register_gauge('upload_lane', lanes.upload_lane.qsize)
+    diagnostics.register_gauge('backlog', lambda: len(backlog))
+    diagnostics.register_gauge('breaker', lambda: breaker.state)
+    diagnostics.register_gauge('folder_cache', folder_cache.sizes)
+    diagnostics.register_gauge('manifest', lambda: len(manifest.files))
+    diagnostics.register_gauge('parse_path_cache', lambda: event_handler.parse_path.cache_info()._asdict())
+    diagnostics.register_gauge('is_valid_path_cache', lambda: EventHandler.is_valid_path.cache_info()._asdict())
+    diagnostics.register_gauge('seen_budgets', lambda: len(event_handler.seen_budgets))
+    diagnostics.register_gauge('threads', threading.active_count)
+    diagnostics.register_gauge('roots', metrics.snapshot)
+    diagnostics.register_gauge('paused_tenants', control.pauses.status)
+    diagnostics.register_gauge('sync_status', sync_status.summary)
+    diagnostics.register_gauge('startup', startup.status)
+
+
+def run_sync(path: str, workers: int) -> int:
+    root = resolve(path)
+    if not root.is_dir():
+        logger.error(f"'{root}' is not a directory.")
+        return 2
+    if not http.test_connection():
+        return 2
+    logger.info(f"SYNCING: {root} with {workers} workers")
+    report = batch.sync_tree(root, workers=workers)
+    logger.info(report.summary())
+    return 1 if report.failed or report.folders_failed else 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Watches WATCHING_DIR and mirrors it to the storage API.")
+    commands = parser.add_subparsers(dest='command')
+    watch = commands.add_parser('watch', help="watch WATCHING_DIR until interrupted (default)")
+    watch.add_argument('--engine', choices=('threaded', 'async', 'processes'), default=settings.ENGINE,
+                       help="process the events with the worker thread and lanes, on an asyncio loop, or in worker "
+                            "processes sharded by tenant")
+    watch.add_argument('--processes', type=int, default=settings.PROCESSES,
+                       help="worker processes of the 'processes' engine")
+    watch.add_argument('--observer', choices=('native', 'polling', 'lazy'), default=settings.OBSERVER,
+                       help="filesystem events from the OS, from polling an index of the tree (network mounts), or "
+                            "from the OS on the active budgets and polling elsewhere (very large trees)")
+    sync = commands.add_parser('sync', help="synchronise a subtree once and exit, non-zero when anything failed")
+    sync.add_argument('path', help="directory to synchronise, relative to a watch root, e.g. clientes/<email>/<budget>")
+    sync.add_argument('--workers', type=int, default=settings.BATCH_WORKERS)
+    control = commands.add_parser('control', help="read or change the settings of the running daemon",
+                                  description="get | set NAME VALUE | pause TENANT | resume TENANT | rescan PATH | "
+                                              "status")
+    control.add_argument('action', choices=('get', 'set', 'pause', 'resume', 'rescan', 'status'))
+    control.add_argument('arguments', nargs='*')
+    return parser.parse_args()
+
+
+def run_control(action: str, arguments: List[str]) -> int:
+    names = dict(set=('name', 'value'), pause=('tenant',), resume=('tenant',), rescan=('path',)).get(action, ())
+    if len(arguments) != len(names):
+        print(f"'{action}' takes {len(names)} arguments: {' '.join(names).upper() or 'none'}", file=sys.stderr)
+        return 2
+    if not settings.CONTROL_SOCKET:
+        print("CONTROL_SOCKET is disabled.", file=sys.stderr)
+        return 2
+    try:
+        response = control.request(settings.CONTROL_SOCKET, dict(command=action, **dict(zip(names, arguments))))
+    except OSError as error:
+        print(f"No daemon answers on '{settings.CONTROL_SOCKET}': {error}", file=sys.stderr)
+        return 2
+    print(json.dumps(response, indent=2))
+    return 0 if response.get('ok') else 1
+
+
 # Main
 if __name__ == "__main__":
-    http.test_connection()
+    args = parse_args()
+    if args.command == 'sync':
+        sys.exit(run_sync(args.path, args.workers))
+    if args.command == 'control':
+        sys.exit(run_control(args.action, args.arguments))
 
-    event_handler_instance = EventHandler(event_queue, delayed_scan_queue, directories_in_queue)
+    # state of the previous run, read while the observer is armed; the uploads wait for it
+    manifest.start_loading()
+
+    engine = getattr(args, 'engine', settings.ENGINE)
+    if engine == 'async':
+        # imported here so the threaded engine does not need aiohttp
+        from utilities.async_engine import AsyncEngine
+        async_engine = AsyncEngine(concurrency=settings.ASYNC_CONCURRENCY, max_events=settings.ASYNC_MAX_EVENTS,
+                                   upload_workers=settings.UPLOAD_WORKERS)
+        async_engine.start()
+        events = async_engine
+        dispatch = async_engine.submit
+        diagnostics.register_gauge('async_engine', async_engine.qsize)
+    elif engine == 'processes':
+        from utilities.shards import ShardPool
+        # the workers own the lanes, the backlog and the budget prefetches; this process only watches and routes
+        shard_pool = ShardPool(args.processes, max_pending=settings.SHARD_MAX_PENDING,
+                               interval=settings.SHARD_MONITOR_INTERVAL)
+        shard_pool.start()
+        events = shard_pool
+        dispatch = None
+        # the events are synced in the worker processes, this one cannot tell when they are done
+        sync_status.enabled = False
+        shard_pool.register_gauges()
+    else:
+        events = event_queue
+        dispatch = task.submit_event
+
+    if settings.LEASES:
+        # this watcher only processes the tenants it holds leases on, the other watchers take the rest
+        events = OwnedEvents(events, leases)
+        if dispatch is not None:
+            dispatch = leases.owned(dispatch)
+        diagnostics.register_gauge('leases', leases.status)
+
+    event_handler_instance = EventHandler(events, delayed_scan_queue, directories_in_queue,
+                                          prefetch=settings.PREFETCH_BUDGETS and engine != 'processes')
+
+    if settings.LEASES:
+        leases.on_acquire.append(functools.partial(rescan_shard, event_handler_instance))
+        leases.start()
+
+    # Observer, armed before anything else: the events seen meanwhile wait in the queue of the engine
+    # one observer thread and one handler for every root, the roots share the engine, lanes and caches
+    observer_mode = getattr(args, 'observer', settings.OBSERVER)
+    if observer_mode == 'polling':
+        observer = IndexedObserver(interval=settings.POLL_INTERVAL)
+        diagnostics.register_gauge('poller', observer.status)
+    elif observer_mode == 'lazy':
+        # imported here, inotify is only there on Linux
+        from utilities.watches import LazyObserver
+        observer = LazyObserver(interval=settings.POLL_INTERVAL, idle_seconds=settings.WATCH_IDLE_SECONDS)
+        diagnostics.register_gauge('watches', observer.status)
+    else:
+        observer = Observer()
+    for root in roots:
+        observer.schedule(event_handler_instance, path=root.path, recursive=True)
+        logger.info(f"WATCHING DIR: {root.path} ({root.name})")
+    # a recursive native observer adds a watch for every directory here
+    observer_started = time.monotonic()
+    observer.start()
+    logger.info(f"Observer '{observer_mode}' started in {time.monotonic() - observer_started:.2f}s.")
+    startup.reached('first_watch')
+
+    # Connection check and OAuth token, the first requests wait for the token instead of the events
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+    # Replays the events parked while the storage API was down
+    if dispatch is not None:
+        backlog.start(dispatch)
+
+    # Stack, gauge and profile dumps on SIGUSR1/SIGUSR2
+    register_gauges(event_handler_instance)
+    diagnostics.install_signal_handlers()
+
+    # Live tuning, pauses and rescans through 'main.py control'
+    controller = control.Control(event_handler_instance)
+    if settings.CONTROL_SOCKET:
+        controller.serve(settings.CONTROL_SOCKET)
+
+    # Pending events, lag and failures per path on 'http://<STATUS_ADDRESS>/summary'
+    status_server = status.serve(settings.STATUS_ADDRESS) if settings.STATUS_ADDRESS else None
 
     # Threads
     worker_thread = threading.Thread(target=worker, daemon=True)
     delayed_scan_thread = threading.Thread(target=delayed_scan_worker, args=(event_handler_instance,), daemon=True)
+    full_scan_thread = threading.Thread(target=full_scan, args=(event_handler_instance,), daemon=True)
 
     # Start Threads
-    worker_thread.start()
+    if engine == 'threaded':
+        worker_thread.start()
     delayed_scan_thread.start()
-
-    # Observer
-    observer = Observer()
-    observer.schedule(event_handler_instance, path=settings.WATCHING_DIR, recursive=True)
-    logger.info(f"WATCHING DIR: {settings.WATCHING_DIR}")
-    observer.start()
+    full_scan_thread.start()
 
     # Main loop
     try:
@@ -76,8 +266,20 @@ if __name__ == "__main__":
     delayed_scan_queue.put(sentinel)
 
     # Wait for threads to finish
-    worker_thread.join()
+    if engine == 'async':
+        async_engine.stop()
+    elif engine == 'processes':
+        shard_pool.stop()
+    else:
+        worker_thread.join()
     delayed_scan_thread.join()
 
+    # Let the lanes finish what is already queued, metadata first as it feeds the upload lane
+    lanes.metadata_lane.shutdown()
+    lanes.upload_lane.shutdown()
+
     # Wait for observer to finish
     observer.join()
+    controller.close()
+    if status_server is not None:
+        status_server.shutdown()
@@ -1,6 +1,8 @@
 from pathlib import Path
 from dotenv import load_dotenv
+import json
 import os
+import socket
 
 import logging
 
@@ -35,10 +37,74 @@ DOT_ENV_PATH = BASE_DIR / '.dev.env' if not PRODUCTION else None
 
 load_dotenv(DOT_ENV_PATH)
 
+# Index of a worker process of the 'processes' engine, set by utilities/shards.py; empty in the watcher process.
+SHARD = os.environ.get(parse_env("SHARD"), "")
+
+
+def for_shard(path):
+    """Worker processes keep their own state files, e.g. 'manifest-2.json', as they never share a tenant."""
+    if not SHARD or not path:
+        return path
+    path = Path(path)
+    return path.with_name(f"{path.stem}-{SHARD}{path.suffix}")
+
+
 NUM_WORKER_THREADS = int(os.environ.get(parse_env("NUM_WORKER_THREADS"), 4))
 
+# Workers for folder lookups, folder creation, renames and deletes.
+METADATA_WORKERS = int(os.environ.get(parse_env("METADATA_WORKERS"), NUM_WORKER_THREADS))
+
+# Workers for file uploads.
+UPLOAD_WORKERS = int(os.environ.get(parse_env("UPLOAD_WORKERS"), 2))
+
+# Upload bandwidth in MB per second, 0 means unlimited.
+UPLOAD_RATE_LIMIT = mega_bytes_to_bits(int(os.environ.get(parse_env("UPLOAD_RATE_LIMIT_MB"), 0)))
+
+# Jobs each lane accepts before submitting blocks.
+LANE_MAX_PENDING = int(os.environ.get(parse_env("LANE_MAX_PENDING"), 1000))
+
+# Connections kept open to the storage API, shared by every lane, prefetch and watch root.
+HTTP_POOL_SIZE = int(os.environ.get(parse_env("HTTP_POOL_SIZE"), METADATA_WORKERS + UPLOAD_WORKERS + 4))
+
+# 'threaded' (event worker and lanes), 'async' (asyncio and aiohttp, see utilities/async_engine.py) or 'processes'
+# (worker processes running the threaded engine, one per tenant shard, see utilities/shards.py).
+ENGINE = os.environ.get(parse_env("ENGINE"), "threaded")
+
+# Events processed at once and HTTP requests in flight in the async engine.
+ASYNC_MAX_EVENTS = int(os.environ.get(parse_env("ASYNC_MAX_EVENTS"), 500))
+
+ASYNC_CONCURRENCY = int(os.environ.get(parse_env("ASYNC_CONCURRENCY"), 100))
+
+# Worker processes of the 'processes' engine, and the events each one accepts before the watcher blocks.
+PROCESSES = int(os.environ.get(parse_env("PROCESSES"), 4))
+
+SHARD_MAX_PENDING = int(os.environ.get(parse_env("SHARD_MAX_PENDING"), 10000))
+
+# Seconds between the health checks and throughput reports of the worker processes.
+SHARD_MONITOR_INTERVAL = int(os.environ.get(parse_env("SHARD_MONITOR_INTERVAL"), 30))
+
 DELAY_FOR_SCAN = int(os.environ.get(parse_env("DELAY_FOR_SCAN"), 20))
 
+# Threads scanning directories concurrently during a rescan.
+SCAN_WORKERS = int(os.environ.get(parse_env("SCAN_WORKERS"), 8))
+
+# Files a rescan may have found but not yet queued.
+SCAN_MAX_PENDING = int(os.environ.get(parse_env("SCAN_MAX_PENDING"), 10000))
+
+# A full scan of WATCHING_DIR saves its progress every SCAN_CHECKPOINT_EVERY files.
+SCAN_CHECKPOINT_EVERY = int(os.environ.get(parse_env("SCAN_CHECKPOINT_EVERY"), 1000))
+
+# Seconds a completely scanned subtree is not scanned again.
+SCAN_FRESHNESS = int(os.environ.get(parse_env("SCAN_FRESHNESS"), 6 * 60 * 60))
+
+FULL_SCAN_ON_STARTUP = str_to_bool(os.environ.get(parse_env("FULL_SCAN_ON_STARTUP"), False))
+
+# Entries kept by each of the path parsing/validation caches of the event handler.
+PATH_CACHE_SIZE = int(os.environ.get(parse_env("PATH_CACHE_SIZE"), 65536))
+
+# Parallel workers of the one-shot 'sync' command.
+BATCH_WORKERS = int(os.environ.get(parse_env("BATCH_WORKERS"), 4))
+
 SLEEP_DURATION = int(os.environ.get(parse_env("DELAY_FOR_SCAN"), 0.5))
 
 KEY_PATH = os.environ.get(parse_env("KEY_WORD"), "mofreitas")
@@ -57,16 +123,137 @@ TOKEN_URL = os.environ.get(parse_env("TOKEN_URL"), "http://localhost:8000/auth/t
 
 logger.info(f"TOKEN_URL: {TOKEN_URL}")
 
+# Seconds before expiry at which the OAuth token is refreshed in the background.
+TOKEN_REFRESH_MARGIN = int(os.environ.get(parse_env("TOKEN_REFRESH_MARGIN"), 60))
+
+# Optional warm-start copy of the token. An empty value disables persistence.
+TOKEN_CACHE_FILE = os.environ.get(parse_env("TOKEN_CACHE_FILE"), BASE_DIR / 'cache.json')
+
 URL = os.environ.get(parse_env("URL"), "http://127.0.0.1:8000/api/v1")
 
+# Seconds a request to the storage API may wait for the connection or for data.
+REQUEST_TIMEOUT = int(os.environ.get(parse_env("REQUEST_TIMEOUT"), 30))
+
+# Consecutive connection errors, timeouts or 5xx answers that open the circuit breaker.
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get(parse_env("BREAKER_FAILURE_THRESHOLD"), 5))
+
+# Seconds before the first probe of an open circuit, doubled after every failed probe up to the maximum.
+BREAKER_RESET_TIMEOUT = int(os.environ.get(parse_env("BREAKER_RESET_TIMEOUT"), 30))
+
+BREAKER_MAX_RESET_TIMEOUT = int(os.environ.get(parse_env("BREAKER_MAX_RESET_TIMEOUT"), 300))
+
 WATCHING_DIR = os.environ.get(parse_env("WATCHING_DIR"), BASE_DIR / '/home/app/media/public/mofreitas')
 
 WATCHING_DIR = Path(WATCHING_DIR).resolve()
 
+# Several watched directories served by one daemon, as a JSON list of {"path", "keyword", "reference", "name"}; the
+# keyword defaults to the name of the directory and the reference to '<keyword>/clientes/'. When empty, WATCHING_DIR,
+# KEY_WORD and PATH_REFERENCE describe the only root. See utilities/roots.py.
+WATCH_ROOTS = json.loads(os.environ.get(parse_env("WATCH_ROOTS"), "[]")) or [
+    dict(path=WATCHING_DIR, keyword=KEY_PATH, reference=PATH_REFERENCE)]
+
+# 'native' (inotify and the like, through watchdog), 'polling' (a persistent index of the tree polled for changes,
+# for NFS or SMB mounts where no events fire, see utilities/poller.py) or 'lazy' (inotify down to the budgets and on
+# the active budgets, polling below the others, for trees too large to watch whole, see utilities/watches.py).
+OBSERVER = os.environ.get(parse_env("OBSERVER"), "native")
+
+# Seconds between two polls of the 'polling' observer.
+POLL_INTERVAL = float(os.environ.get(parse_env("POLL_INTERVAL"), 2))
+
+# A directory changed in the last POLL_HOT_SECONDS is polled, files included, at every poll. The others are checked
+# every POLL_COLD_EVERY polls and their files every POLL_VERIFY_EVERY polls.
+POLL_HOT_SECONDS = int(os.environ.get(parse_env("POLL_HOT_SECONDS"), 300))
+
+POLL_COLD_EVERY = int(os.environ.get(parse_env("POLL_COLD_EVERY"), 15))
+
+POLL_VERIFY_EVERY = int(os.environ.get(parse_env("POLL_VERIFY_EVERY"), 150))
+
+# Seconds between two polls checking every directory, which find the files moved far from where they were.
+POLL_SWEEP_INTERVAL = float(os.environ.get(parse_env("POLL_SWEEP_INTERVAL"), 600))
+
+# Seconds without events after which the 'lazy' observer removes the watches below a budget.
+WATCH_IDLE_SECONDS = int(os.environ.get(parse_env("WATCH_IDLE_SECONDS"), 600))
+
+# Partition the tenants between several watchers sharing WATCHING_DIR through lease files, see utilities/leases.py.
+LEASES = str_to_bool(os.environ.get(parse_env("LEASES"), False))
+
+# Shared by every watcher, outside of WATCHING_DIR so the lease files raise no events.
+LEASE_DIR = Path(os.environ.get(parse_env("LEASE_DIR"), WATCHING_DIR.parent.joinpath('.file_finder_leases')))
+
+# Unique per watcher; a watcher restarting under the same name takes its leases back at once.
+NODE_NAME = os.environ.get(parse_env("NODE_NAME"), socket.gethostname())
+
+# Tenant shards the leases are taken on, the same value on every watcher.
+LEASE_SHARDS = int(os.environ.get(parse_env("LEASE_SHARDS"), 64))
+
+# Seconds a lease lasts without being renewed, and seconds between renewals.
+LEASE_TTL = int(os.environ.get(parse_env("LEASE_TTL"), 30))
+
+LEASE_INTERVAL = int(os.environ.get(parse_env("LEASE_INTERVAL"), 5))
+
+# Unix socket of the control interface (utilities/control.py, 'main.py control'), e.g. 'data/control.sock', empty
+# disables it. Its commands are not authenticated: the socket is made readable and writable by its owner only.
+CONTROL_SOCKET = os.environ.get(parse_env("CONTROL_SOCKET"), "")
+
 LOG_DIR = BASE_DIR.joinpath('logs')
 
 LOG_DIR.mkdir(exist_ok=True, mode=0o777)
 
+DATA_DIR = Path(os.environ.get(parse_env("DATA_DIR"), BASE_DIR.joinpath('data')))
+
+DATA_DIR.mkdir(exist_ok=True, mode=0o777)
+
+# 'host:port' of the read-only sync status API (utilities/status.py), e.g. '127.0.0.1:8765', empty disables it.
+STATUS_ADDRESS = os.environ.get(parse_env("STATUS_ADDRESS"), "")
+
+# Seconds folder ids from lookups and budget prefetches are trusted.
+FOLDER_CACHE_TTL = int(os.environ.get(parse_env("FOLDER_CACHE_TTL"), 600))
+
+# Prefetch the remote folders of a budget when the watcher sees its first event.
+PREFETCH_BUDGETS = str_to_bool(os.environ.get(parse_env("PREFETCH_BUDGETS"), True))
+
+# Query parameter filtering /storages/folder/ by path prefix.
+PREFETCH_FILTER = os.environ.get(parse_env("PREFETCH_FILTER"), "path__startswith")
+
+# Pages of a listing fetched ahead concurrently, 0 follows the 'next' links one at a time.
+LISTING_PREFETCH = int(os.environ.get(parse_env("LISTING_PREFETCH"), 2))
+
+# Seconds a folder reported missing (or failing to be created) is not looked up again.
+NEGATIVE_CACHE_TTL = int(os.environ.get(parse_env("NEGATIVE_CACHE_TTL"), 30))
+
+# Seconds a folder deleted by the watcher is protected from being created again by in-flight events.
+TOMBSTONE_TTL = int(os.environ.get(parse_env("TOMBSTONE_TTL"), 120))
+
+FOLDER_CACHE_SIZE = int(os.environ.get(parse_env("FOLDER_CACHE_SIZE"), 100000))
+
+# Local record of the last successful upload of every synced file.
+MANIFEST_FILE = os.environ.get(parse_env("MANIFEST_FILE"), DATA_DIR.joinpath('manifest.json'))
+
+MANIFEST_SAVE_EVERY = int(os.environ.get(parse_env("MANIFEST_SAVE_EVERY"), 100))
+
+# Events parked while the storage API is down, replayed once it recovers.
+BACKLOG_FILE = os.environ.get(parse_env("BACKLOG_FILE"), DATA_DIR.joinpath('backlog.jsonl'))
+
+# Parked events replayed per second after a recovery, 0 means unlimited.
+BACKLOG_DRAIN_RATE = int(os.environ.get(parse_env("BACKLOG_DRAIN_RATE"), 5))
+
+HASH_WORKERS = int(os.environ.get(parse_env("HASH_WORKERS"), 2))
+
+HASH_CHUNK_SIZE = mega_bytes_to_bits(int(os.environ.get(parse_env("HASH_CHUNK_SIZE_MB"), 1)))
+
+# Fraction of the events traced end to end, 0 disables tracing.
+TRACE_SAMPLE_RATE = float(os.environ.get(parse_env("TRACE_SAMPLE_RATE"), 0.01))
+
+TRACE_FILE = os.environ.get(parse_env("TRACE_FILE"), LOG_DIR.joinpath('traces.jsonl'))
+
+# The trace file is rotated once it grows past this size.
+TRACE_MAX_BYTES = mega_bytes_to_bits(int(os.environ.get(parse_env("TRACE_MAX_MB"), 50)))
+
+# Seconds a profile started with SIGUSR2 runs, and milliseconds between its samples.
+PROFILE_SECONDS = int(os.environ.get(parse_env("PROFILE_SECONDS"), 30))
+
+PROFILE_INTERVAL = int(os.environ.get(parse_env("PROFILE_INTERVAL_MS"), 5)) / 1000
+
 LOGGER = {
     "version": 1,
     "formatters": {
@@ -83,7 +270,7 @@ LOGGER = {
         },
         "file": {
             "class": "logging.handlers.RotatingFileHandler",
-            "filename": LOG_DIR.joinpath('file_finder.log'),
+            "filename": for_shard(LOG_DIR.joinpath('file_finder.log')),
             "level": "DEBUG",
             "maxBytes": 1048574,
             "backupCount": 3,
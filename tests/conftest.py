@@ -0,0 +1,81 @@
+"""
+The settings are read from the environment when they are imported, so they are pointed at a temporary tree and at the
+storage API stand-in of the load harness before any module of the client is imported.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from urllib.parse import parse_qsl, urlsplit
+
+import pytest
+
+from benchmarks.load_harness import API, Faults, FaultyStorageAPI, Handler, configure
+
+api = FaultyStorageAPI(Faults(0, 0, 0, 0, 0.5, 0))
+api.faults.enabled = False
+threading.Thread(target=api.serve_forever, name='storage-api', daemon=True).start()
+workdir = Path(tempfile.mkdtemp(prefix='file-finder-tests-'))
+watching = configure(argparse.Namespace(timeout=2, scan_delay=1), api, workdir)
+os.environ.update({
+    'FILE_FINDER_STATUS_ADDRESS': '',
+    'FILE_FINDER_CONTROL_SOCKET': '',
+    'FILE_FINDER_LEASE_DIR': str(workdir.joinpath('leases')),
+})
+
+
+@pytest.fixture(autouse=True)
+def breaker():
+    from utilities.breaker import breaker, CLOSED
+    breaker.state, breaker.failures = CLOSED, 0
+    yield breaker
+    breaker.state, breaker.failures = CLOSED, 0
+
+
+@pytest.fixture
+def storage():
+    """The stand-in emptied, and the folder cache with it."""
+    from utilities.cache import folder_cache
+    with api.storage.lock:
+        for table in (api.storage.folders, api.storage.files, api.storage.received, api.storage.uploads,
+                      api.storage.requests):
+            table.clear()
+    for table in (folder_cache.found, folder_cache.listed, folder_cache.missing, folder_cache.failed,
+                  folder_cache.tombstones):
+        table.clear()
+    return api.storage
+
+
+@pytest.fixture
+def lose_reply(monkeypatch):
+    """``lose_reply('POST')``: the next POST is applied by the stand-in, which then resets the connection."""
+    methods = list()
+    dispatch = Handler.dispatch
+
+    def lossy(handler: Handler):
+        if handler.command not in methods:
+            return dispatch(handler)
+        methods.remove(handler.command)
+        body = handler.rfile.read(int(handler.headers.get('Content-Length') or 0))
+        url = urlsplit(handler.path)
+        handler.route(url.path[len(API):], dict(parse_qsl(url.query)), body)
+        handler.reset()
+
+    monkeypatch.setattr(Handler, 'dispatch', lossy)
+    return methods.append
+
+
+@pytest.fixture
+def tenant(storage) -> Path:
+    """The local folder of a tenant, 'clientes/<email>' under the watch root."""
+    path = watching.joinpath('clientes', 'user@example.com')
+    path.mkdir(parents=True)
+    yield path
+    shutil.rmtree(path)
+
+
+def remote_folders(storage) -> list:
+    with storage.lock:
+        return sorted(folder['path'] for folder in storage.folders.values())
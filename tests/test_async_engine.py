@@ -0,0 +1,48 @@
+import time
+
+import pytest
+
+from tests.conftest import remote_folders
+from utilities.async_engine import AsyncEngine
+from utilities.events import EventRecord, EventType
+
+REMOTE = 'mofreitas/clientes/user@example.com'
+
+
+@pytest.fixture
+def engine():
+    engine = AsyncEngine(concurrency=4, max_events=10)
+    engine.start()
+    yield engine
+    engine.stop()
+
+
+def wait_processed(engine: AsyncEngine, count: int, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while engine.processed < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert engine.processed == count
+
+
+def test_file_in_a_new_folder_is_uploaded_from_the_file(tenant, storage, engine):
+    folder = tenant.joinpath('budget-6', 'docs')
+    folder.mkdir(parents=True)
+    folder.joinpath('contract.pdf').write_bytes(b'%PDF' * 1000)
+
+    engine.put(EventRecord(EventType.CREATED, str(folder.joinpath('contract.pdf'))))
+    wait_processed(engine, 1)
+    assert remote_folders(storage) == [f"{REMOTE}/budget-6", f"{REMOTE}/budget-6/docs"]
+    assert list(storage.uploads) == [(f"{REMOTE}/budget-6/docs", 'contract.pdf')]
+
+
+def test_deleted_folder_is_buried_like_by_the_event_worker(tenant, storage, engine):
+    folder = tenant.joinpath('budget-7', 'docs')
+    folder.mkdir(parents=True)
+    engine.put(EventRecord(EventType.CREATED, str(folder), is_directory=True))
+    wait_processed(engine, 1)
+    folder.rmdir()
+    engine.put(EventRecord(EventType.DELETED, str(folder), is_directory=True))
+    engine.put(EventRecord(EventType.CREATED, str(folder), is_directory=True))
+    wait_processed(engine, 3)
+
+    assert remote_folders(storage) == [f"{REMOTE}/budget-7"]
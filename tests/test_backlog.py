@@ -0,0 +1,69 @@
+import requests
+
+from utilities.backlog import Backlog
+from utilities.breaker import OPEN, CLOSED
+from utilities.events import EventRecord, EventType
+
+
+def events(count: int) -> list:
+    return [EventRecord(EventType.CREATED, f"/watch/clientes/user@example.com/budget/file-{index}.pdf")
+            for index in range(count)]
+
+
+def replay(backlog: Backlog) -> list:
+    dispatched = list()
+    backlog._dispatch = lambda event: dispatched.append(event.src_path)
+    backlog.drain()
+    return dispatched
+
+
+def test_guard_parks_events_failing_on_an_outage(tmp_path, breaker):
+    backlog = Backlog(tmp_path.joinpath('backlog.jsonl'), rate=0)
+    down, refused = events(2)
+
+    def unavailable():
+        breaker.mark_outage()
+        raise requests.ConnectionError('refused')
+
+    assert backlog.guard(down, unavailable) is False
+    # a rejected request is an answer, the event is not parked
+    assert backlog.guard(refused, lambda: False) is False
+    assert len(backlog) == 1
+    assert Backlog(tmp_path.joinpath('backlog.jsonl'), rate=0).size == 1
+
+
+def test_drain_replays_in_order(tmp_path):
+    backlog = Backlog(tmp_path.joinpath('backlog.jsonl'), rate=0)
+    parked = events(5)
+    for event in parked:
+        backlog.park(event)
+    assert backlog.should_park()
+
+    assert replay(backlog) == [event.src_path for event in parked]
+    assert len(backlog) == 0
+    assert not backlog.path.exists() and not backlog.draining_path.exists()
+    assert not backlog.should_park()
+
+
+def test_drain_stops_when_the_circuit_opens_again(tmp_path, breaker):
+    backlog = Backlog(tmp_path.joinpath('backlog.jsonl'), rate=0)
+    first, second, third, newer = events(4)
+    for event in (first, second, third):
+        backlog.park(event)
+
+    def fail_after_first(event):
+        dispatched.append(event.src_path)
+        breaker.state = OPEN
+
+    dispatched = list()
+    backlog._dispatch = fail_after_first
+    backlog.drain()
+    assert dispatched == [first.src_path]
+    assert len(backlog) == 2
+
+    # parked after the interrupted drain, so replayed after the events that were already parked
+    backlog.park(newer)
+    breaker.state = CLOSED
+    assert replay(backlog) == [second.src_path, third.src_path]
+    assert replay(backlog) == [newer.src_path]
+    assert len(backlog) == 0
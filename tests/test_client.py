@@ -0,0 +1,58 @@
+import time
+
+import pytest
+import requests
+
+from client import RETRY_CEILING, RETRY_FLOOR, TokenManager
+
+
+@pytest.fixture
+def manager(monkeypatch, tmp_path):
+    """A TokenManager whose timer only records its delays, and whose token endpoint is ``manager.answers``."""
+    manager = TokenManager('id', 'secret', 'http://token.invalid/', refresh_margin=60,
+                           cache_file=tmp_path.joinpath('token.json'))
+    manager.delays, manager.answers = list(), list()
+
+    def request_new_token():
+        answer = manager.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    monkeypatch.setattr(manager, '_schedule_refresh', manager.delays.append)
+    monkeypatch.setattr(manager, 'request_new_token', request_new_token)
+    return manager
+
+
+def test_refresh_is_scheduled_ahead_of_expiry(manager):
+    manager.answers.extend([('long', 3600), ('short', 30)])
+
+    assert manager.get_token() == 'long'
+    assert manager.get_token() == 'long'
+    assert manager.refresh(stale='long') == 'short'
+    # the margin for the long token, 80% of the lifetime of a token shorter than the margin
+    assert manager.delays == [3540, 24]
+
+
+def test_failed_background_refresh_backs_off(manager):
+    manager.answers.append(('first', 3600))
+    manager.get_token()
+    manager.answers.extend([requests.ConnectionError('down')] * 8 + [('second', 3600)])
+
+    for _ in range(9):
+        manager._background_refresh()
+
+    assert manager.delays[1:] == [RETRY_FLOOR, 10, 20, 40, 80, 160, RETRY_CEILING, RETRY_CEILING, 3540]
+    assert manager.get_token() == 'second'
+
+
+def test_restart_starts_with_the_cached_token(manager, tmp_path):
+    manager.answers.append(('cached', 3600))
+    manager.get_token()
+
+    restarted = TokenManager('id', 'secret', 'http://token.invalid/', refresh_margin=60,
+                             cache_file=tmp_path.joinpath('token.json'))
+    restarted._timer.cancel()
+
+    assert restarted.is_valid() and restarted.get_token() == 'cached'
+    assert restarted._expires_at == pytest.approx(time.time() + 3600, abs=5)
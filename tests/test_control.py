@@ -0,0 +1,35 @@
+import stat
+
+import settings
+from tests.conftest import watching
+from utilities.control import Control, pauses, request
+from utilities.events import EventRecord, EventType
+
+
+class Handler:
+    def __init__(self):
+        self.released = list()
+
+    def add_to_event_queue(self, event):
+        self.released.append(event)
+
+
+def test_socket_tunes_the_daemon_and_holds_a_paused_tenant(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'DELAY_FOR_SCAN', settings.DELAY_FOR_SCAN)
+    handler, path = Handler(), tmp_path.joinpath('control.sock')
+    control = Control(handler)
+    control.serve(path)
+    try:
+        assert stat.S_IMODE(path.stat().st_mode) == 0o600
+        assert request(path, dict(command='set', name='scan_delay', value=3)) == dict(ok=True, values=dict(
+            scan_delay=3.0))
+        assert not request(path, dict(command='set', name='scan_delay', value=-1))['ok']
+
+        assert request(path, dict(command='pause', tenant='user@example.com'))['ok']
+        event = EventRecord(EventType.CREATED, str(watching.joinpath('clientes', 'user@example.com', 'b', 'f.pdf')))
+        assert pauses.hold(event)
+        assert request(path, dict(command='resume', tenant='user@example.com'))['released'] == 1
+        assert handler.released == [event]
+    finally:
+        control.close()
+    assert not path.exists()
@@ -0,0 +1,32 @@
+from utilities import files, folders
+from utilities.manifest import manifest
+
+REMOTE = 'mofreitas/clientes/user@example.com'
+
+
+def test_file_stored_before_its_reply_was_lost_is_not_uploaded_again(tenant, storage, lose_reply):
+    budget = tenant.joinpath('budget-10')
+    budget.mkdir()
+    budget.joinpath('contract.pdf').write_bytes(b'%PDF')
+    assert files.resolve_folder(budget.joinpath('contract.pdf'))
+    lose_reply('POST')
+
+    assert not files.create_file(budget.joinpath('contract.pdf'))
+    assert files.create_file(budget.joinpath('contract.pdf'))
+    assert storage.uploads == {(f"{REMOTE}/budget-10", 'contract.pdf'): 1}
+
+
+def test_files_the_server_holds_already_are_not_uploaded_again_with_an_empty_manifest(tenant, storage):
+    budget = tenant.joinpath('budget-11')
+    budget.mkdir()
+    budget.joinpath('contract.pdf').write_bytes(b'%PDF')
+    budget.joinpath('invoice.pdf').write_bytes(b'%PDF')
+    assert folders.on_folder_created(src_path=budget)
+    # uploaded before the manifest existed
+    _, stored = storage.upload(folders.find_folder(budget), 'contract.pdf', 4)
+    storage.uploads.clear()
+
+    assert files.create_file(budget.joinpath('contract.pdf'))
+    assert files.create_file(budget.joinpath('invoice.pdf'))
+    assert storage.uploads == {(f"{REMOTE}/budget-11", 'invoice.pdf'): 1}
+    assert manifest.files[str(budget.joinpath('contract.pdf'))].pk == stored['id']
@@ -0,0 +1,128 @@
+
+import pytest
+import requests
+
+from tests.conftest import remote_folders
+from utilities import files, folders
+from utilities.manifest import manifest
+
+REMOTE = 'mofreitas/clientes/user@example.com'
+
+
+def test_budget_folder_is_created_once(tenant, storage):
+    budget = tenant.joinpath('budget-1')
+    budget.mkdir()
+
+    assert folders.on_folder_created(src_path=budget)
+    assert folders.on_folder_created(src_path=budget)
+    assert remote_folders(storage) == [f"{REMOTE}/budget-1"]
+
+
+def test_file_directly_in_a_new_budget_is_uploaded(tenant, storage):
+    budget = tenant.joinpath('budget-2')
+    budget.mkdir()
+    budget.joinpath('contract.pdf').write_bytes(b'%PDF')
+
+    assert files.create_file(budget.joinpath('contract.pdf'))
+    assert remote_folders(storage) == [f"{REMOTE}/budget-2"]
+    assert list(storage.uploads) == [(f"{REMOTE}/budget-2", 'contract.pdf')]
+
+
+def test_deep_folder_creates_its_missing_ancestors(tenant, storage):
+    deep = tenant.joinpath('budget-3', 'docs', 'signed')
+    deep.mkdir(parents=True)
+
+    assert folders.on_folder_created(src_path=deep)
+    assert remote_folders(storage) == [f"{REMOTE}/budget-3", f"{REMOTE}/budget-3/docs",
+                                       f"{REMOTE}/budget-3/docs/signed"]
+
+
+def test_deleted_folder_is_not_created_again_by_late_events(tenant, storage):
+    folder = tenant.joinpath('budget-4', 'docs')
+    folder.mkdir(parents=True)
+    assert folders.on_folder_created(src_path=folder)
+    assert folders.on_folder_deleted(src_path=folder)
+    folder.rmdir()
+
+    assert not folders.on_folder_created(src_path=folder)
+    assert remote_folders(storage) == [f"{REMOTE}/budget-4"]
+
+
+def test_deleted_folder_created_again_locally_is_created_again(tenant, storage):
+    folder = tenant.joinpath('budget-5', 'docs')
+    folder.mkdir(parents=True)
+    assert folders.on_folder_created(src_path=folder)
+    assert folders.on_folder_deleted(src_path=folder)
+    folder.rmdir()
+    folder.joinpath('signed').mkdir(parents=True)
+    folder.joinpath('signed', 'contract.pdf').write_bytes(b'%PDF')
+
+    assert files.create_file(folder.joinpath('signed', 'contract.pdf'))
+    assert remote_folders(storage) == [f"{REMOTE}/budget-5", f"{REMOTE}/budget-5/docs",
+                                       f"{REMOTE}/budget-5/docs/signed"]
+    assert list(storage.uploads) == [(f"{REMOTE}/budget-5/docs/signed", 'contract.pdf')]
+
+
+def test_folder_created_before_its_reply_was_lost_is_looked_up_before_created_again(tenant, storage, lose_reply):
+    folder = tenant.joinpath('budget-9', 'docs')
+    folder.mkdir(parents=True)
+    assert folders.on_folder_created(src_path=folder.parent)
+    # the listing of the budget says every folder it does not hold is missing
+    folders.prefetch_budget(folder.parent)
+    lose_reply('POST')
+
+    with pytest.raises(requests.RequestException):
+        folders.on_folder_created(src_path=folder)
+    assert folders.on_folder_created(src_path=folder)
+    assert remote_folders(storage) == [f"{REMOTE}/budget-9", f"{REMOTE}/budget-9/docs"]
+
+
+def remote_folder(storage, path: str) -> dict:
+    with storage.lock:
+        return next(folder for folder in storage.folders.values() if folder['path'] == path)
+
+
+def test_renamed_folder_is_patched_once_and_keeps_its_budget(tenant, storage):
+    draft, final = tenant.joinpath('budget-12', 'draft'), tenant.joinpath('budget-12', 'final')
+    draft.mkdir(parents=True)
+    assert folders.on_folder_created(src_path=draft)
+    draft.rename(final)
+    storage.requests.clear()
+
+    assert folders.on_folder_updated(src_path=draft, dest_path=final)
+    assert remote_folders(storage) == [f"{REMOTE}/budget-12", f"{REMOTE}/budget-12/final"]
+    assert remote_folder(storage, f"{REMOTE}/budget-12/final")['budget'] == 'budget-12'
+    assert storage.requests[('PATCH', 200)] == 1
+
+
+def test_folder_moved_within_its_budget_keeps_its_files_synced(tenant, storage):
+    source, destination = tenant.joinpath('budget-13', 'a', 'docs'), tenant.joinpath('budget-13', 'b', 'docs')
+    source.mkdir(parents=True)
+    destination.parent.mkdir()
+    source.joinpath('contract.pdf').write_bytes(b'%PDF')
+    assert files.create_file(source.joinpath('contract.pdf'))
+    assert folders.on_folder_created(src_path=destination.parent)
+    source.rename(destination)
+
+    assert folders.on_folder_updated(src_path=source, dest_path=destination)
+    assert remote_folders(storage) == [f"{REMOTE}/budget-13", f"{REMOTE}/budget-13/a", f"{REMOTE}/budget-13/b",
+                                       f"{REMOTE}/budget-13/b/docs"]
+    assert remote_folder(storage, f"{REMOTE}/budget-13/b/docs")['budget'] == 'budget-13'
+    # the manifest followed the folder: the file is neither listed nor uploaded again at its new path
+    assert str(destination.joinpath('contract.pdf')) in manifest.files
+    assert str(source.joinpath('contract.pdf')) not in manifest.files
+    assert manifest.is_seeded(destination)
+    assert files.create_file(destination.joinpath('contract.pdf'))
+    assert storage.uploads == {(f"{REMOTE}/budget-13/a/docs", 'contract.pdf'): 1}
+
+
+def test_folder_moved_to_another_budget_takes_that_budget(tenant, storage):
+    source, destination = tenant.joinpath('budget-14', 'docs'), tenant.joinpath('budget-15', 'docs')
+    source.mkdir(parents=True)
+    destination.parent.mkdir()
+    assert folders.on_folder_created(src_path=source)
+    source.rename(destination)
+
+    assert folders.on_folder_updated(src_path=source, dest_path=destination)
+    assert remote_folders(storage) == [f"{REMOTE}/budget-14", f"{REMOTE}/budget-15", f"{REMOTE}/budget-15/docs"]
+    assert remote_folder(storage, f"{REMOTE}/budget-15/docs")['budget'] == 'budget-15'
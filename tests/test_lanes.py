@@ -0,0 +1,60 @@
+import threading
+import time
+
+from tests.conftest import remote_folders
+from utilities import task
+from utilities.events import EventRecord, EventType
+from utilities.lanes import Lane, RateLimiter
+
+REMOTE = 'mofreitas/clientes/user@example.com'
+
+
+def test_ordered_jobs_of_a_key_run_one_at_a_time_in_order():
+    lane = Lane('test', workers=4)
+    ran = {'a': list(), 'b': list()}
+    running = {'a': 0, 'b': 0}
+    overlapped = list()
+    lock = threading.Lock()
+
+    def job(key: str, index: int):
+        with lock:
+            running[key] += 1
+            overlapped.append(running[key] > 1)
+        # later jobs are faster, they would overtake the earlier ones on a plain lane
+        time.sleep(0.002 * (20 - index))
+        with lock:
+            running[key] -= 1
+            ran[key].append(index)
+
+    futures = [lane.submit_ordered(key, job, key, index) for index in range(20) for key in ('a', 'b')]
+    for future in futures:
+        future.result(timeout=10)
+    lane.shutdown()
+
+    assert ran == {'a': list(range(20)), 'b': list(range(20))}
+    assert not any(overlapped)
+
+
+def test_create_move_and_delete_of_a_folder_are_applied_in_order(tenant, storage):
+    created, renamed = tenant.joinpath('budget-1', 'draft'), tenant.joinpath('budget-1', 'final')
+    created.mkdir(parents=True)
+    events = [EventRecord(EventType.CREATED, str(created), is_directory=True),
+              EventRecord(EventType.MOVED, str(created), is_directory=True, dest_path=str(renamed)),
+              EventRecord(EventType.DELETED, str(renamed), is_directory=True)]
+    created.rename(renamed)
+    renamed.rmdir()
+
+    futures = [task.submit_event(event) for event in events]
+
+    assert [future.result(timeout=10) for future in futures] == [True, True, True]
+    assert remote_folders(storage) == [f"{REMOTE}/budget-1"]
+
+
+def test_rate_limiter_holds_the_average_rate():
+    limiter = RateLimiter(rate=1000)
+    started = time.monotonic()
+    # the first second of budget is available at once, the rest is paid for
+    for _ in range(5):
+        limiter.acquire(500)
+
+    assert 1.3 < time.monotonic() - started < 2
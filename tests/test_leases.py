@@ -0,0 +1,52 @@
+import time
+from types import SimpleNamespace
+
+from utilities import leases as leases_module
+from utilities.leases import Leases
+
+
+def leases(tmp_path, node: str) -> Leases:
+    tmp_path.joinpath('nodes').mkdir(exist_ok=True)
+    return Leases(tmp_path, node, shards=4, ttl=30, interval=5)
+
+
+def test_released_shards_are_claimed_by_another_node_on_its_next_tick(tmp_path):
+    first, second = leases(tmp_path, 'first'), leases(tmp_path, 'second')
+    first.tick()
+    assert sorted(first.held) == [0, 1, 2, 3]
+
+    # all the leases are valid, the new node waits for the first one to rebalance
+    second.tick()
+    assert sorted(second.held) == []
+
+    first.tick()
+    assert sorted(first.held) == [0, 1]
+    assert not first.lease_path(2).exists() and not first.lease_path(3).exists()
+
+    second.tick()
+    assert sorted(second.held) == [2, 3]
+
+
+def test_node_paused_while_renewing_does_not_overwrite_the_new_holder(tmp_path, monkeypatch):
+    clock = [time.time()]
+    monkeypatch.setattr(leases_module, 'time', SimpleNamespace(time=lambda: clock[0], sleep=time.sleep))
+    first, second = leases(tmp_path, 'first'), leases(tmp_path, 'second')
+    first.tick()
+    read = leases_module.read_json
+    stalled = list()
+
+    def paused(path):
+        content = read(path)
+        if path == first.lease_path(0) and not stalled:
+            # the first node stalls for longer than the ttl right after reading its lease
+            stalled.append(path)
+            clock[0] += 31
+            second.tick()
+        return content
+
+    monkeypatch.setattr(leases_module, 'read_json', paused)
+    first.tick()
+
+    assert sorted(second.held) == [0, 1, 2, 3]
+    assert sorted(first.held) == []
+    assert all(read(second.lease_path(shard))['node'] == 'second' for shard in range(4))
@@ -0,0 +1,36 @@
+from utilities import files
+from utilities.manifest import Manifest
+
+REMOTE = 'mofreitas/clientes/user@example.com'
+
+
+def test_unchanged_content_is_uploaded_once(tenant, storage):
+    budget = tenant.joinpath('budget-16')
+    budget.mkdir()
+    contract = budget.joinpath('contract.pdf')
+    contract.write_bytes(b'%PDF-1')
+
+    assert files.create_file(contract)
+    assert files.create_file(contract)
+    contract.write_bytes(b'%PDF-2')
+    assert files.create_file(contract)
+
+    assert storage.uploads == {(f"{REMOTE}/budget-16", 'contract.pdf'): 2}
+
+
+def test_saved_fingerprints_are_reused_without_reading_the_files_again(tmp_path, monkeypatch):
+    contract = tmp_path.joinpath('contract.pdf')
+    contract.write_bytes(b'%PDF')
+    manifest = Manifest(tmp_path.joinpath('manifest.json'))
+    fingerprint = manifest.fingerprint(contract)
+    manifest.record(contract, fingerprint._replace(pk='7'))
+    manifest.save()
+
+    restarted = Manifest(tmp_path.joinpath('manifest.json'))
+
+    def unexpected(path):
+        raise AssertionError(f"'{path}' was read again")
+
+    monkeypatch.setattr(restarted, 'hash_file', unexpected)
+    assert restarted.fingerprint(contract).pk == '7'
+    assert restarted.is_unchanged(contract, fingerprint)
@@ -0,0 +1,67 @@
+import time
+
+from watchdog.events import FileDeletedEvent, FileMovedEvent
+
+from utilities.poller import PollIndex
+
+
+class Recorder:
+    def __init__(self):
+        self.events = list()
+
+    def dispatch(self, event):
+        self.events.append(event)
+
+
+def indexed_tree(tmp_path, **kwargs) -> PollIndex:
+    """'tree/budget-<n>/folder-<m>' with a file in every folder, indexed, nothing polled yet."""
+    root = tmp_path.joinpath('tree')
+    for budget in range(10):
+        for folder in range(10):
+            directory = root.joinpath(f"budget-{budget}", f"folder-{folder}")
+            directory.mkdir(parents=True)
+            directory.joinpath('file.pdf').write_bytes(b'%PDF')
+    # no cold directory is due in the polls of the tests
+    index = PollIndex(root, tmp_path.joinpath('poll.json'), cold_every=10 ** 9, verify_every=10 ** 9, **kwargs)
+    index.build()
+    for state in index.dirs.values():
+        state.phase = 1
+    return index
+
+
+def test_deletion_checks_the_directories_around_it_only(tmp_path):
+    index = indexed_tree(tmp_path)
+    folder = tmp_path.joinpath('tree', 'budget-3', 'folder-3')
+    index.heat(str(folder), time.time())
+    folder.joinpath('file.pdf').unlink()
+    recorder = Recorder()
+
+    report = index.poll(0, recorder)
+
+    assert [(type(event), event.src_path) for event in recorder.events] == [
+        (FileDeletedEvent, str(folder.joinpath('file.pdf')))]
+    # the folder, its budget and the root, hot, then the other folders of the budget; not the 111 directories
+    assert report['checked'] == 12
+
+
+def test_file_moved_to_a_cold_sibling_folder_is_a_move(tmp_path):
+    index = indexed_tree(tmp_path)
+    source = tmp_path.joinpath('tree', 'budget-3', 'folder-3')
+    destination = tmp_path.joinpath('tree', 'budget-3', 'folder-4', 'moved.pdf')
+    index.heat(str(source), time.time())
+    source.joinpath('file.pdf').rename(destination)
+    recorder = Recorder()
+
+    index.poll(0, recorder)
+
+    assert [(type(event), event.src_path, event.dest_path) for event in recorder.events] == [
+        (FileMovedEvent, str(source.joinpath('file.pdf')), str(destination))]
+
+
+def test_sweep_checks_every_directory_once_its_interval_passed(tmp_path):
+    index = indexed_tree(tmp_path, sweep_interval=3600)
+    assert index.poll(0, Recorder())['checked'] == 0
+
+    index.swept_at -= 3600
+    assert index.poll(1, Recorder())['checked'] == len(index.dirs)
+    assert index.poll(2, Recorder())['checked'] == 0
@@ -0,0 +1,61 @@
+from tests.conftest import watching
+from utilities.events import EventRecord, EventType
+from utilities.funtions import tenant_key
+from utilities.shards import ShardPool, shard_of
+
+
+def path_of(email: str, name: str) -> str:
+    return str(watching.joinpath('clientes', email, 'budget', name))
+
+
+def test_tenant_key_is_the_tenant_folder_of_the_path():
+    assert tenant_key(path_of('user@example.com', 'contract.pdf')) == 'clientes/user@example.com'
+    assert tenant_key(str(watching.joinpath('clientes', 'user@example.com'))) == 'clientes/user@example.com'
+    assert tenant_key(str(watching.joinpath('clientes'))) == ''
+    assert tenant_key(str(watching.joinpath('elsewhere', 'file.pdf'))) == ''
+
+
+def test_shard_of_sends_every_path_of_a_tenant_to_one_shard():
+    shards = {shard_of(path_of(f"user-{tenant}@example.com", f"file-{index}.pdf"), 4)
+              for tenant in range(20) for index in range(3)}
+    assert shards == {0, 1, 2, 3}
+    for tenant in range(20):
+        assert len({shard_of(path_of(f"user-{tenant}@example.com", f"file-{index}.pdf"), 4)
+                    for index in range(10)}) == 1
+
+
+def test_pool_routes_the_events_of_a_tenant_to_its_worker_in_order():
+    pool = ShardPool(shards=3)
+    sent = [EventRecord(EventType.CREATED, path_of(f"user-{index % 5}@example.com", f"file-{index}.pdf"))
+            for index in range(30)]
+    for event in sent:
+        pool.put(event)
+
+    for index, inbox in enumerate(pool.inboxes):
+        expected = [event.src_path for event in sent if shard_of(event.src_path, 3) == index]
+        received = [EventRecord.unpack(inbox.get(timeout=5)).src_path for _ in expected]
+        assert received == expected
+        assert inbox.empty()
+
+
+def test_restarted_worker_has_nothing_pending(monkeypatch):
+    pool = ShardPool(shards=2)
+
+    class Started:
+        pid = None
+
+        def __init__(self, **kwargs):
+            pass
+
+        def start(self):
+            pass
+
+    monkeypatch.setattr(pool._context, 'Process', Started)
+    for field, value in (('received', 7), ('processed', 3), ('failed', 1)):
+        pool.stats.set(1, field, value)
+    assert pool.qsize() == 3
+
+    pool._spawn(1)
+
+    assert pool.qsize() == 0
+    assert pool.stats.read(1)['processed'] == 3
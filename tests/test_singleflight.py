@@ -0,0 +1,59 @@
+import threading
+
+import pytest
+
+from utilities.singleflight import SingleFlight
+
+
+def run_concurrently(flights: SingleFlight, fn, callers: int) -> list:
+    results = list()
+
+    def call():
+        try:
+            results.append(flights.do('key', fn))
+        except Exception as error:
+            results.append(error)
+
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results
+
+
+def test_concurrent_calls_of_a_key_share_one_call():
+    flights, release, calls = SingleFlight(), threading.Event(), list()
+
+    def lookup():
+        calls.append(1)
+        release.wait(10)
+        return 'folder-pk'
+
+    threading.Timer(0.2, release.set).start()
+    assert run_concurrently(flights, lookup, 5) == ['folder-pk'] * 5
+    assert len(calls) == 1 and flights.shared == 4
+    assert not flights.in_flight('key')
+
+
+def test_waiters_receive_the_error_of_the_shared_call():
+    flights, release = SingleFlight(), threading.Event()
+
+    def failing():
+        release.wait(10)
+        raise ValueError('refused')
+
+    threading.Timer(0.2, release.set).start()
+    results = run_concurrently(flights, failing, 3)
+    assert [type(result) for result in results] == [ValueError] * 3
+
+
+def test_a_call_made_again_by_its_owner_runs_directly():
+    flights = SingleFlight()
+
+    def recursive(depth: int) -> int:
+        return depth if depth == 3 else flights.do('key', recursive, depth + 1)
+
+    assert flights.do('key', recursive, 0) == 3
+    with pytest.raises(ZeroDivisionError):
+        flights.do('key', lambda: 1 / 0)
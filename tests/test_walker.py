@@ -0,0 +1,54 @@
+from pathlib import Path
+
+from utilities.walker import ScanCheckpoint, TreeWalker
+
+
+def make_tree(root: Path) -> set:
+    """Files at every level, so a directory is often still scanned while its subdirectories are."""
+    paths = set()
+    for top in range(4):
+        for sub in range(3):
+            directory = root.joinpath(f"a{top}", f"b{sub}")
+            directory.mkdir(parents=True)
+            for index in range(25):
+                for parent in (directory, directory.parent):
+                    path = parent.joinpath(f"file-{len(paths)}.pdf")
+                    path.write_bytes(b'')
+                    paths.add(str(path))
+    return paths
+
+
+def test_resumed_walk_emits_every_file_once_and_completes_the_root(tmp_path):
+    root = tmp_path.joinpath('tree')
+    paths = make_tree(root)
+    state = tmp_path.joinpath('scan.json')
+    walker = TreeWalker(workers=4, max_pending=20)
+
+    first = list()
+    for entry in walker.walk(root, ScanCheckpoint(root, state, every=10)):
+        first.append(entry.path)
+        if len(first) == 300:
+            break
+    checkpoint = ScanCheckpoint(root, state, every=10)
+    assert checkpoint.unfinished
+    resumed = [entry.path for entry in walker.walk(root, checkpoint)]
+
+    assert len(resumed) == len(set(resumed))
+    assert set(first) | set(resumed) == paths
+    checkpoint = ScanCheckpoint(root, state, every=10)
+    assert not checkpoint.unfinished and checkpoint.is_fresh(str(root))
+
+
+def test_frontier_holding_a_directory_and_its_subdirectory_walks_it_once(tmp_path):
+    root = tmp_path.joinpath('tree')
+    paths = make_tree(root)
+    state = tmp_path.joinpath('scan.json')
+    top, nested = root.joinpath('a2'), root.joinpath('a2', 'b1')
+    ScanCheckpoint(root, state).save([str(nested), str(top)], None)
+
+    checkpoint = ScanCheckpoint(root, state, every=10)
+    assert checkpoint.frontier == [str(top)]
+    resumed = [entry.path for entry in TreeWalker(workers=4, max_pending=20).walk(root, checkpoint)]
+
+    assert sorted(resumed) == sorted(path for path in paths if path.startswith(f"{top}/"))
+    assert not ScanCheckpoint(root, state).unfinished
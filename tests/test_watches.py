@@ -0,0 +1,46 @@
+import errno
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+from watchdog.observers.inotify_c import InotifyEvent
+
+from utilities.watches import InotifyWatches, LazyRoot
+
+
+def test_removed_watch_reports_nothing_more(tmp_path):
+    watches = InotifyWatches(os.fsencode(tmp_path))
+    watched = tmp_path.joinpath('watched')
+    watched.mkdir()
+    watches.add_watch(os.fsencode(watched))
+    watches.remove_watch(os.fsencode(watched))
+    watched.joinpath('unseen.pdf').write_bytes(b'%PDF')
+    tmp_path.joinpath('seen.pdf').write_bytes(b'%PDF')
+
+    paths = [os.fsdecode(event.src_path) for event in watches.read_events()]
+    watches.close()
+    assert str(tmp_path.joinpath('seen.pdf')) in paths
+    assert str(watched.joinpath('unseen.pdf')) not in paths
+
+
+def test_watchdog_lacking_what_the_adapter_uses_fails_at_start(tmp_path, monkeypatch):
+    monkeypatch.delattr(InotifyEvent, 'cookie')
+
+    with pytest.raises(RuntimeError, match='InotifyEvent.cookie'):
+        InotifyWatches(os.fsencode(tmp_path))
+
+
+def test_reader_exits_quietly_when_the_observer_closes_its_descriptor():
+    stopping = threading.Event()
+
+    class Closed:
+        def read_events(self):
+            # the observer stopped while this thread was about to read
+            stopping.set()
+            raise OSError(errno.EBADF, os.strerror(errno.EBADF))
+
+    LazyRoot.read(SimpleNamespace(inotify=Closed()), stopping)
+
+    with pytest.raises(OSError):
+        LazyRoot.read(SimpleNamespace(inotify=Closed()), threading.Event())
@@ -0,0 +1,99 @@
+"""
+Summarises the spans written by utilities.tracing.
+
+Usage:
+    python -m tools.trace_report [TRACE_FILE ...] [--top 15]
+
+Shows the call paths where the traced events spent the most time, the slowest events end to end (including uploads
+finishing on the upload lane after the event itself) and the average number of HTTP calls per event type.
+"""
+import argparse
+import json
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+import settings
+
+
+def load(paths: List[Path]) -> Iterator[dict]:
+    for path in paths:
+        if not path.is_file():
+            continue
+        with path.open() as file:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def event_kind(root: dict) -> str:
+    return f"{root.get('type', '?').lower()} {'folder' if root.get('directory') else 'file'}"
+
+
+def call_paths(spans: Dict[str, dict]) -> Iterator[Tuple[Tuple[str, ...], dict]]:
+    """Yields every span with the names of its ancestors, e.g. ('event', 'files.create_file', 'http GET')."""
+    for span in spans.values():
+        names, node = list(), span
+        while node is not None:
+            name = node['name']
+            names.append(f"http {node.get('method')}" if name == 'http' else name)
+            node = spans.get(node.get('parent'))
+        yield tuple(reversed(names)), span
+
+
+def report(paths: List[Path], top: int):
+    traces: Dict[str, Dict[str, dict]] = defaultdict(dict)
+    for span in load(paths):
+        traces[span['trace']][span['span']] = span
+    roots = {trace: next((span for span in spans.values() if span.get('parent') is None), None)
+             for trace, spans in traces.items()}
+    roots = {trace: root for trace, root in roots.items() if root is not None}
+    if not roots:
+        print(f"No traced events in {', '.join(map(str, paths))}.")
+        return
+    print(f"{len(roots)} traced events, {sum(len(spans) for spans in traces.values())} spans.\n")
+
+    stats: Dict[Tuple[str, ...], List[float]] = defaultdict(list)
+    for trace in roots:
+        for names, span in call_paths(traces[trace]):
+            stats[names].append(span.get('duration') or 0.0)
+    print("Slowest call paths (total time):")
+    print(f"{'total s':>9} {'calls':>7} {'avg ms':>9} {'max ms':>9}  path")
+    for names, durations in sorted(stats.items(), key=lambda item: -sum(item[1]))[:top]:
+        print(f"{sum(durations):9.2f} {len(durations):7d} {sum(durations) / len(durations) * 1000:9.1f} "
+              f"{max(durations) * 1000:9.1f}  {' > '.join(names)}")
+
+    print("\nSlowest events (end to end):")
+    elapsed = dict()
+    for trace, root in roots.items():
+        end = max(span['start'] + (span.get('duration') or 0.0) for span in traces[trace].values())
+        elapsed[trace] = end - root['start']
+    for trace in sorted(elapsed, key=lambda key: -elapsed[key])[:top]:
+        root = roots[trace]
+        children = [span for span in traces[trace].values() if span.get('parent') == root['span']]
+        slowest = max(children, key=lambda span: span.get('duration') or 0.0, default=None)
+        step = f", slowest step {slowest['name']} {slowest['duration'] * 1000:.1f} ms" if slowest else ""
+        print(f"{elapsed[trace] * 1000:9.1f} ms  {event_kind(root)}  {root.get('path')}{step}")
+
+    print("\nHTTP calls per event type:")
+    calls: Dict[str, List[int]] = defaultdict(list)
+    for trace, root in roots.items():
+        calls[event_kind(root)].append(sum(1 for span in traces[trace].values() if span['name'] == 'http'))
+    for kind, counts in sorted(calls.items()):
+        print(f"{kind:>18}: {sum(counts) / len(counts):6.2f} avg, {max(counts):4d} max over {len(counts)} events")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    default = Path(settings.TRACE_FILE)
+    parser.add_argument('paths', nargs='*', type=Path,
+                        default=[default.with_suffix(default.suffix + '.1'), default])
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+    report(args.paths, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Optional, Tuple
+
+import aiohttp
+import requests
+
+import settings
+from utilities import files, task
+from utilities.async_http import AsyncClient
+from utilities.backlog import backlog
+from utilities.breaker import breaker, Unavailable
+from utilities.events import EventRecord, EventType
+from utilities.http_requests import clear_failure, last_failure
+from utilities.lanes import upload_limiter
+from utilities.manifest import manifest, Fingerprint
+from utilities.metrics import metrics
+from utilities.singleflight import AsyncSingleFlight
+from utilities.status import sync_status
+
+logger = logging.getLogger(__name__)
+
+# Sentinel object for termination
+sentinel = object()
+
+
+class AsyncEngine:
+    """
+    Processes the events on an asyncio loop running in its own thread, instead of the event worker and the lanes.
+
+    The watchdog thread hands events over with ``put``, through ``call_soon_threadsafe``. Each event is a coroutine
+    and at most ``max_events`` of them run at once. File uploads are sent by aiohttp, streamed from the file, at most
+    ``upload_workers`` at once.
+
+    Everything else, the folder of an upload included, runs the functions of the threaded engine on a pool of
+    ``concurrency`` threads, so both engines share one implementation of the folder cache, the budget prefetches,
+    the tombstones, the failure reasons and the parking of events in the backlog.
+    """
+
+    def __init__(self, concurrency: int = 100, max_events: int = 500, upload_workers: int = 2):
+        self.concurrency = concurrency
+        self.max_events = max_events
+        self.upload_workers = upload_workers
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.client: Optional[AsyncClient] = None
+        self.upload_slots: Optional[asyncio.Semaphore] = None
+        self.flights = AsyncSingleFlight()
+        self.processed = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._ready = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # Thread side
+
+    def start(self):
+        self._thread = threading.Thread(target=asyncio.run, args=(self.run(),), name='async-engine', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def put(self, event: EventRecord):
+        """Called from the watchdog and scan threads, like ``Queue.put`` for the threaded engine."""
+        if backlog.should_park():
+            backlog.park(event)
+            return
+        self.submit(event)
+
+    def submit(self, event: EventRecord):
+        """Queues the event without checking the backlog, used to replay parked events."""
+        self.loop.call_soon_threadsafe(self._queue.put_nowait, event)
+
+    def qsize(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stop(self):
+        """Lets the queued and running events finish, then stops the loop."""
+        self.loop.call_soon_threadsafe(self._queue.put_nowait, sentinel)
+        self._thread.join()
+
+    # Loop side
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop.set_default_executor(ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='async'))
+        self._queue = asyncio.Queue()
+        slots = asyncio.Semaphore(self.max_events)
+        self.upload_slots = asyncio.Semaphore(self.upload_workers)
+        running = set()
+        async with AsyncClient(concurrency=self.concurrency, timeout=settings.REQUEST_TIMEOUT) as self.client:
+            self._ready.set()
+            logger.info(f"Async engine started: {self.max_events} events and {self.concurrency} requests at once.")
+            while True:
+                event = await self._queue.get()
+                if event is sentinel:
+                    break
+                await slots.acquire()
+                job = asyncio.create_task(self.handle(event))
+                running.add(job)
+                job.add_done_callback(running.discard)
+                job.add_done_callback(lambda _: slots.release())
+            if running:
+                await asyncio.wait(running)
+
+    async def handle(self, event: EventRecord):
+        try:
+            if event.is_directory or event.event_type not in (EventType.CREATED, EventType.MODIFIED):
+                # parks the event when the storage API is down, and records its result, like the event worker
+                await asyncio.to_thread(task.run_event, event)
+            else:
+                await self.sync_file(event)
+        except Exception as error:
+            logger.error(f"Processing {event} failed: {error!r}")
+        finally:
+            self.processed += 1
+
+    async def sync_file(self, event: EventRecord):
+        try:
+            result, reason = await self.create_file(Path(event.src_path))
+        except Unavailable as error:
+            logger.warning(f"The storage API is unavailable ({error}), parking {event}.")
+            backlog.park(event)
+            return
+        except Exception as error:
+            sync_status.finished(event.src_path, False, f"{type(error).__name__}: {error}")
+            raise
+        metrics.add(event.src_path, 'succeeded' if result else 'failed')
+        logger.info(f"Event '{event.event_type.name.lower()}' for {event.src_path} "
+                    f"{'succeeded' if result else 'failed'}.")
+        sync_status.finished(event.src_path, result, reason)
+
+    # Files
+
+    async def create_file(self, file_path: Path) -> Tuple[bool, Optional[str]]:
+        """
+        Returns:
+            Tuple[bool, Optional[str]]: Whether the file is uploaded, and the reason when it is not.
+
+        Raises:
+            Unavailable: The storage API is down, the event is to be parked.
+        """
+        if not await asyncio.to_thread(file_path.is_file):
+            logger.error(f"The path {file_path} does not point to a file.")
+            return False, None
+        # hash the file while the folder is being resolved
+        pending_fingerprint = manifest.fingerprint_async(file_path)
+        folder_pk, reason = await asyncio.to_thread(run_threaded, files.resolve_folder, file_path)
+        if not folder_pk:
+            return False, reason
+        fingerprint: Fingerprint = await asyncio.wrap_future(pending_fingerprint)
+        # the created and modified events of a new file share an upload only when both hashed its whole content
+        fingerprint = await asyncio.to_thread(manifest.refresh, file_path, fingerprint)
+        return await self.flights.do(('upload', file_path.__str__(), fingerprint.digest), self.upload_file, file_path,
+                                     folder_pk, fingerprint)
+
+    async def upload_file(self, file_path: Path, folder_pk: str,
+                          fingerprint: Fingerprint) -> Tuple[bool, Optional[str]]:
+        await asyncio.to_thread(run_threaded, files.seed_folder, file_path.parent, folder_pk)
+        # waits for the manifest of the previous run while it loads
+        if await asyncio.to_thread(files.skip_unchanged, file_path, fingerprint):
+            return True, None
+        stored, _ = await asyncio.to_thread(run_threaded, files.stored_already, file_path, folder_pk, fingerprint)
+        if stored:
+            return True, None
+        mime_type, _ = mimetypes.guess_type(file_path.name)
+        opened = list()
+
+        def form() -> aiohttp.FormData:
+            # streamed from the file, which is opened again for the retry after a 401
+            file = file_path.open('rb')
+            opened.append(file)
+            data = aiohttp.FormData()
+            data.add_field('folder', folder_pk)
+            data.add_field('file', file, filename=file_path.name, content_type=mime_type or 'application/octet-stream')
+            return data
+
+        async with self.upload_slots:
+            if upload_limiter.rate > 0:
+                await asyncio.to_thread(upload_limiter.acquire, fingerprint.size)
+            try:
+                status, content = await self.client.request('POST', '/storages/file/', data=form)
+            except Unavailable:
+                files.unconfirmed.put(file_path.__str__(), fingerprint.digest)
+                raise
+            finally:
+                for file in opened:
+                    file.close()
+        if status != 201:
+            logger.error(f"Failed to upload file {file_path.name} to the folder with ID {folder_pk}. "
+                         f"Server responded with status code: {status}")
+            return False, f"POST /storages/file/: HTTP {status} {(content or '').__str__()[:200]}"
+        logger.info(f"File {file_path.name} was successfully uploaded to the folder with ID {folder_pk}.")
+        pk = content.get('id') if isinstance(content, dict) else None
+        files.record_upload(file_path, fingerprint, str(pk) if pk is not None else None)
+        return True, None
+
+
+def run_threaded(fn: Callable, *args) -> Tuple[Any, Optional[str]]:
+    """
+    Runs a function of the threaded engine, on a worker thread, like ``backlog.guard`` runs it for the event worker.
+
+    Returns:
+        Tuple[Any, Optional[str]]: Its result, and the reason of the last request that failed.
+
+    Raises:
+        Unavailable: The storage API went down meanwhile, the event is to be parked.
+    """
+    clear_failure()
+    breaker.clear_outage()
+    try:
+        result = fn(*args)
+    except requests.RequestException as error:
+        if not breaker.saw_outage():
+            raise
+        raise Unavailable(f"{fn.__name__} failed, the storage API is down: {error!r}") from error
+    if not result and breaker.saw_outage():
+        raise Unavailable(f"{fn.__name__} failed, the storage API is down.")
+    return result, last_failure()
@@ -0,0 +1,92 @@
+import asyncio
+import json
+import logging
+from typing import Any, Optional, Tuple
+from urllib import parse
+
+import aiohttp
+
+import settings
+from client import oauth
+from utilities.breaker import breaker, is_outage_status, CircuitOpenError, Unavailable
+from utilities.http_requests import ends_with_slash, normalize_relative_url
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncClient:
+    """
+    aiohttp counterpart of ``http_requests`` for the asyncio engine.
+
+    At most ``concurrency`` requests are in flight; the others wait on a semaphore, not on a thread. Requests go
+    through the same circuit breaker and OAuth token as the threaded client, and outages are raised as
+    ``Unavailable`` instead of being returned, so the engine can park the event that needed them.
+    """
+
+    def __init__(self, concurrency: int = 100, timeout: int = 30):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    async def __aenter__(self) -> 'AsyncClient':
+        self._slots = asyncio.Semaphore(self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.timeout, sock_read=self.timeout)
+        self.session = aiohttp.ClientSession(timeout=timeout, connector=aiohttp.TCPConnector(limit=self.concurrency))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def request(self, method: str, relative_url: str, pk: Optional[str] = None, params: Optional[dict] = None,
+                      **kwargs) -> Tuple[int, Any]:
+        """
+        Args:
+            method (str): The HTTP method.
+            relative_url (str): The endpoint, e.g. '/storages/folder/'.
+            pk (Optional[str]): Appended to the url, e.g. for a PATCH or a DELETE.
+            params (Optional[dict]): The query string.
+            **kwargs: Passed on to aiohttp. ``data`` may be a callable building the body, e.g. a ``FormData``,
+                which aiohttp can only send once, so the request can be retried after a 401.
+
+        Returns:
+            Tuple[int, Any]: The status and the decoded JSON body, or None when the body is not JSON.
+
+        Raises:
+            Unavailable: The server could not be reached, timed out or answered with an outage status.
+        """
+        url = parse.urljoin(ends_with_slash(settings.URL), normalize_relative_url(relative_url))
+        if pk:
+            url += ends_with_slash(pk.__str__())
+        if params:
+            params = {key: value.__str__() for key, value in params.items() if value is not None}
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit open, not sending {method} {url}.")
+        try:
+            async with self._slots:
+                status, content = await self.send(method, url, params, **kwargs)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            breaker.record_failure()
+            raise Unavailable(f"{method} {url} failed: {error!r}") from error
+        outage = is_outage_status(status)
+        breaker.record(outage)
+        if outage:
+            raise Unavailable(f"{method} {url} answered {status}.")
+        return status, content
+
+    async def send(self, method: str, url: str, params: Optional[dict], data: Any = None,
+                   **kwargs) -> Tuple[int, Any]:
+        token = oauth.get_token() if oauth.is_valid() else await asyncio.to_thread(oauth.get_token)
+        for attempt in range(2):
+            body = data() if callable(data) else data
+            headers = {'Authorization': f"Bearer {token}"}
+            async with self.session.request(method, url, params=params, data=body, headers=headers,
+                                            **kwargs) as response:
+                content = await response.read()
+                if response.status == 401 and attempt == 0:
+                    logger.info(f"Request to '{url}' answered with 401, retrying with a new token.")
+                    token = await asyncio.to_thread(oauth.refresh, token)
+                    continue
+                if content and response.content_type == 'application/json':
+                    return response.status, json.loads(content)
+                return response.status, None
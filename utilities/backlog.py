@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+import requests
+
+import settings
+from utilities.breaker import breaker
+from utilities.cache import folder_cache
+from utilities.events import EventRecord
+from utilities.http_requests import send, ends_with_slash
+from utilities.lanes import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+def count_lines(path: Path) -> int:
+    if not path.is_file():
+        return 0
+    with path.open('rb') as file:
+        return sum(1 for _ in file)
+
+
+class Backlog:
+    """
+    Durable queue of the events parked while the storage API is down.
+
+    Events are appended to ``path`` as JSON lines while the circuit is open, and also while older events are still
+    parked so they keep their order. A background thread probes the API when the circuit allows it and, once it is
+    closed again, drains the backlog at ``rate`` events per second so the recovering server is not stampeded.
+
+    Draining first moves the file aside (``.draining``); events dispatched before a crash may run again on restart,
+    which the folder lookups and the manifest make harmless.
+    """
+
+    def __init__(self, path: Union[str, Path], rate: float):
+        self.path = Path(path)
+        self.draining_path = self.path.with_suffix('.draining')
+        self.limiter = RateLimiter(rate)
+        self.size = count_lines(self.path) + count_lines(self.draining_path)
+        self.parked_total = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._dispatch: Optional[Callable[[EventRecord], object]] = None
+        if self.size:
+            logger.info(f"{self.size} events are parked in '{self.path}'.")
+
+    def __len__(self) -> int:
+        return self.size
+
+    def should_park(self) -> bool:
+        return not breaker.is_closed or self.size > 0
+
+    def park(self, event: EventRecord):
+        line = json.dumps(event.to_dict())
+        with self._lock:
+            with self.path.open('a') as file:
+                file.write(line + '\n')
+            self.size += 1
+            self.parked_total += 1
+        logger.debug(f"Parked {event}, {self.size} events parked.")
+        self._wakeup.set()
+
+    def guard(self, event: EventRecord, fn: Callable, *args, **kwargs):
+        """Runs ``fn`` and parks ``event`` when it failed because the storage API was unavailable."""
+        breaker.clear_outage()
+        try:
+            result = fn(*args, **kwargs)
+        except requests.RequestException:
+            if not breaker.saw_outage():
+                raise
+            result = False
+        if not result and breaker.saw_outage():
+            logger.warning(f"The storage API is unavailable, parking {event}.")
+            self.park(event)
+        return result
+
+    def start(self, dispatch: Callable[[EventRecord], object]):
+        """
+        Args:
+            dispatch (Callable[[EventRecord], object]): Processes a drained event, bypassing ``should_park``.
+        """
+        self._dispatch = dispatch
+        breaker.listeners.append(self._wakeup.set)
+        threading.Thread(target=self._run, name='backlog', daemon=True).start()
+
+    def _run(self):
+        while True:
+            if not self.size:
+                self._wakeup.wait()
+                self._wakeup.clear()
+            elif breaker.is_closed:
+                self.drain()
+            else:
+                time.sleep(max(breaker.retry_at - time.monotonic(), 1.0))
+                self.probe()
+
+    @staticmethod
+    def probe():
+        try:
+            send('GET', ends_with_slash(settings.URL))
+        except requests.RequestException as error:
+            logger.debug(f"Probe failed: {error}")
+
+    def drain(self):
+        with self._lock:
+            if not self.draining_path.exists():
+                if not self.path.exists():
+                    self.size = 0
+                    return
+                os.replace(self.path, self.draining_path)
+        logger.info(f"Draining {self.size} parked events.")
+        # folders whose creation failed during the outage must be tried again
+        folder_cache.failed.clear()
+        with self.draining_path.open() as file:
+            lines = iter(file)
+            for line in lines:
+                if not breaker.is_closed:
+                    self._keep([line, *lines])
+                    logger.info(f"The circuit opened again, {self.size} events stay parked.")
+                    return
+                self.limiter.acquire(1)
+                try:
+                    self._dispatch(EventRecord.from_dict(json.loads(line)))
+                except (ValueError, KeyError) as error:
+                    logger.error(f"Dropping unreadable parked event {line!r}: {error}")
+                with self._lock:
+                    self.size -= 1
+        os.remove(self.draining_path)
+        logger.info("Parked events drained.")
+
+    def _keep(self, lines):
+        """Rewrites the draining file with the events not dispatched yet, they are drained before newer ones."""
+        tmp = self.draining_path.with_suffix('.tmp')
+        tmp.write_text(''.join(lines))
+        os.replace(tmp, self.draining_path)
+
+
+backlog = Backlog(settings.for_shard(settings.BACKLOG_FILE), rate=settings.BACKLOG_DRAIN_RATE)
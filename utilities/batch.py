@@ -0,0 +1,97 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, NamedTuple
+
+from utilities import files, folders
+from utilities.manifest import manifest
+from utilities.walker import walker
+
+logger = logging.getLogger(__name__)
+
+
+class BatchReport(NamedTuple):
+    files: int
+    unchanged: int
+    uploaded: int
+    failed: int
+    folders_created: int
+    folders_failed: int
+    bytes_uploaded: int
+    elapsed: float
+
+    def summary(self) -> str:
+        rate = self.files / self.elapsed if self.elapsed else 0.0
+        throughput = self.bytes_uploaded / self.elapsed / 1024 / 1024 if self.elapsed else 0.0
+        return (f"{self.files} files in {self.elapsed:.1f}s ({rate:.1f} files/s): {self.uploaded} uploaded "
+                f"({self.bytes_uploaded / 1024 / 1024:.1f} MB, {throughput:.2f} MB/s), {self.unchanged} unchanged, "
+                f"{self.failed} failed; {self.folders_created} folders created, {self.folders_failed} failed.")
+
+
+def is_unchanged(entry: os.DirEntry) -> bool:
+    """Files whose size, mtime and inode match the manifest are skipped without hashing or asking the server."""
+    known = manifest.files.get(entry.path)
+    if known is None:
+        return False
+    stat = entry.stat(follow_symlinks=False)
+    return (known.size, known.mtime_ns, known.inode) == (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+def create_folders(directories: List[Path], workers: int) -> Dict[Path, bool]:
+    """Creates the folders level by level, so parents always exist before their children are created."""
+    results: Dict[Path, bool] = dict()
+    levels: Dict[int, List[Path]] = dict()
+    for directory in directories:
+        levels.setdefault(len(directory.parts), list()).append(directory)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch-folders') as executor:
+        for depth in sorted(levels):
+            pending = [directory for directory in levels[depth] if not folders.find_folder(directory)]
+            for directory, created in zip(pending, executor.map(folders.on_folder_created, pending)):
+                results[directory] = bool(created)
+    return results
+
+
+def sync_tree(root: Path, workers: int) -> BatchReport:
+    """
+    One-shot synchronisation of a subtree such as ``clientes/<email>/<budget>``, without the observer or the delay
+    queues: missing folders are created top-down and then the new or changed files are uploaded by ``workers``
+    threads.
+    """
+    start = time.perf_counter()
+    manifest.wait_loaded()
+    skipped_before, saved_before = manifest.uploads_skipped, manifest.bytes_saved
+    pending: List[Path] = list()
+    sizes: Dict[Path, int] = dict()
+    total = unchanged = 0
+    for entry in walker.walk(root):
+        total += 1
+        if is_unchanged(entry):
+            unchanged += 1
+            continue
+        path = Path(entry.path)
+        pending.append(path)
+        sizes[path] = entry.stat(follow_symlinks=False).st_size
+    logger.info(f"Found {total} files under '{root}', {len(pending)} new or changed.")
+
+    created = create_folders(sorted({path.parent for path in pending}), workers)
+    failed_folders = {directory for directory, success in created.items() if not success}
+    uploadable = [path for path in pending if path.parent not in failed_folders]
+
+    failed = len(pending) - len(uploadable)
+    uploaded = bytes_uploaded = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch-upload') as executor:
+        for path, success in zip(uploadable, executor.map(files.create_file, uploadable)):
+            if success:
+                uploaded += 1
+                bytes_uploaded += sizes[path]
+            else:
+                failed += 1
+    manifest.save()
+
+    skipped = manifest.uploads_skipped - skipped_before
+    return BatchReport(files=total, unchanged=unchanged + skipped, uploaded=uploaded - skipped, failed=failed,
+                       folders_created=len(created) - len(failed_folders), folders_failed=len(failed_folders),
+                       bytes_uploaded=bytes_uploaded - (manifest.bytes_saved - saved_before),
+                       elapsed=time.perf_counter() - start)
@@ -0,0 +1,123 @@
+import logging
+import threading
+import time
+from typing import Callable, List, Optional
+
+import requests
+from requests import Response
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class Unavailable(requests.ConnectionError):
+    """The storage API could not be reached or answered with an outage status."""
+
+
+class CircuitOpenError(Unavailable):
+    """Raised instead of sending a request while the storage API is considered down."""
+
+
+def is_outage_status(status: int) -> bool:
+    return status >= 500 or status == 429
+
+
+def is_outage(response: Optional[Response] = None, error: Optional[BaseException] = None) -> bool:
+    """Connection errors, timeouts, 5xx and 429 answers mean the server is unavailable; anything else is an answer."""
+    if error is not None:
+        if isinstance(error, requests.HTTPError):
+            response = error.response
+        else:
+            return isinstance(error, (requests.ConnectionError, requests.Timeout))
+    return response is not None and is_outage_status(response.status_code)
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a server that keeps failing.
+
+    After ``failure_threshold`` consecutive outages the circuit opens and requests are refused with
+    ``CircuitOpenError``. Once ``reset_timeout`` seconds have passed a single half-open probe is let through: a success
+    closes the circuit, a failure opens it again for twice as long, up to ``max_reset_timeout``. Listeners are called
+    when the circuit closes again.
+
+    Each thread can also tell whether its own requests hit an outage since it called ``clear_outage``, which is how
+    callers that only get a boolean result tell "the server was down" from "the request was rejected".
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30, max_reset_timeout: float = 300):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.retry_at = 0.0
+        self.listeners: List[Callable[[], None]] = list()
+        self._timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def is_closed(self) -> bool:
+        return self.state == CLOSED
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() >= self.retry_at:
+                self.state = HALF_OPEN
+                logger.info("Circuit half-open, probing the storage API.")
+                return True
+        self.mark_outage()
+        return False
+
+    def record(self, outage: bool):
+        if outage:
+            self.record_failure()
+        else:
+            self.record_success()
+
+    def record_success(self):
+        with self._lock:
+            recovered = self.state != CLOSED
+            self.state = CLOSED
+            self.failures = 0
+            self._timeout = self.reset_timeout
+        if recovered:
+            logger.info("Circuit closed, the storage API is reachable again.")
+            for listener in self.listeners:
+                listener()
+
+    def record_failure(self):
+        self.mark_outage()
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN:
+                self._timeout = min(self._timeout * 2, self.max_reset_timeout)
+            elif self.state == OPEN or self.failures < self.failure_threshold:
+                return
+            self.state = OPEN
+            self.opened += 1
+            self.retry_at = time.monotonic() + self._timeout
+        logger.error(f"Circuit opened after {self.failures} consecutive failures, next probe in {self._timeout}s.")
+
+    def mark_outage(self):
+        self._local.outage = True
+
+    def clear_outage(self):
+        self._local.outage = False
+
+    def saw_outage(self) -> bool:
+        return getattr(self._local, 'outage', False)
+
+
+breaker = CircuitBreaker(failure_threshold=settings.BREAKER_FAILURE_THRESHOLD,
+                         reset_timeout=settings.BREAKER_RESET_TIMEOUT,
+                         max_reset_timeout=settings.BREAKER_MAX_RESET_TIMEOUT)
@@ -0,0 +1,181 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Iterator, Optional, Tuple, Union
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+
+_absent = object()
+
+
+def ancestors(path: str) -> Iterator[str]:
+    """Yields the path itself and then each of its parents, e.g. 'a/b/c', 'a/b', 'a'."""
+    while path:
+        yield path
+        path = path.rpartition('/')[0]
+
+
+class TTLCache:
+    """A bounded mapping whose entries expire ``ttl`` seconds after being stored, oldest entries are evicted first."""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, Tuple[float, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        if entry[0] < time.monotonic():
+            self.discard(key)
+            return default
+        return entry[1]
+
+    def discard(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def discard_tree(self, key: str):
+        """Discards the key and every key below it. Walks all entries, so it is meant for rare operations."""
+        prefix = key + '/'
+        with self._lock:
+            for stored in [stored for stored in self._entries if stored == key or stored.startswith(prefix)]:
+                del self._entries[stored]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key, _absent) is not _absent
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class TTLSet(TTLCache):
+    """A bounded set of keys that expire ``ttl`` seconds after being added."""
+
+    def add(self, key: str):
+        self.put(key, True)
+
+
+class FolderCache:
+    """
+    Local knowledge about remote folders, keyed by the path after the keyword (e.g. 'mofreitas/clientes/...').
+
+    - found: folder ids from lookups, creations and budget prefetches.
+    - listed: budgets whose whole folder subtree was prefetched; a path below them that is not found is missing.
+    - missing: paths the server reported as absent, so repeated events do not look them up again.
+    - failed: paths whose creation failed, so they are not retried on every event.
+    - tombstones: folders deleted by us, so events still in flight for them do not create them again.
+    """
+
+    def __init__(self, ttl: float, negative_ttl: float, tombstone_ttl: float, max_entries: int):
+        # bumped by every invalidation, so a lookup that raced with a create cannot mark the new folder missing
+        self.generation = 0
+        self.found = TTLCache(ttl, max_entries)
+        self.listed = TTLSet(ttl, max_entries)
+        self.missing = TTLSet(negative_ttl, max_entries)
+        self.failed = TTLSet(negative_ttl, max_entries)
+        self.tombstones = TTLSet(tombstone_ttl, max_entries)
+
+    def resolve(self, path: Union[str, Path]) -> Tuple[bool, Optional[str]]:
+        """
+        Returns:
+            Tuple[bool, Optional[str]]: Whether the cache knows the answer, and the folder id when the folder exists.
+        """
+        key = path.__str__()
+        if self.is_buried(key):
+            return True, None
+        pk = self.found.get(key)
+        if pk is not None:
+            return True, pk
+        if key in self.missing or any(parent in self.listed for parent in ancestors(key)):
+            return True, None
+        return False, None
+
+    def put(self, path: Union[str, Path], pk: str):
+        self.found.put(path.__str__(), pk)
+
+    def forget_tree(self, path: Union[str, Path]):
+        """
+        Must be called when a folder is moved or renamed: the ids cached under its old path are stale, and the listing
+        of its budget no longer tells where its subfolders are.
+        """
+        self.found.discard_tree(path.__str__())
+        for key in ancestors(path.__str__()):
+            self.listed.discard(key)
+
+    def mark_listed(self, path: Union[str, Path], generation: int):
+        if generation == self.generation:
+            self.listed.add(path.__str__())
+
+    def is_missing(self, path: Union[str, Path]) -> bool:
+        return path.__str__() in self.missing
+
+    def mark_missing(self, path: Union[str, Path], generation: int):
+        """
+        Args:
+            path (Union[str, Path]): The path the server reported as absent.
+            generation (int): The value of ``generation`` read before the lookup was sent.
+        """
+        if generation == self.generation:
+            self.missing.add(path.__str__())
+
+    def has_failed(self, path: Union[str, Path]) -> bool:
+        return path.__str__() in self.failed
+
+    def mark_failed(self, path: Union[str, Path]):
+        self.failed.add(path.__str__())
+
+    def invalidate(self, path: Union[str, Path]):
+        """Must be called when a folder is created: the path and its parents are no longer missing."""
+        self.generation += 1
+        for key in ancestors(path.__str__()):
+            self.missing.discard(key)
+            self.failed.discard(key)
+
+    def mark_uncertain(self, path: Union[str, Path]):
+        """
+        Must be called when a folder may have been created without its id being known, e.g. when the reply to its
+        creation was lost: neither a negative entry nor the listing of its budget may say it is missing any more.
+        """
+        self.forget_tree(path)
+        self.invalidate(path)
+
+    def bury(self, path: Union[str, Path]):
+        self.tombstones.add(path.__str__())
+        self.missing.add(path.__str__())
+        self.forget_tree(path)
+
+    def is_buried(self, path: Union[str, Path]) -> bool:
+        return any(key in self.tombstones for key in ancestors(path.__str__()))
+
+    def unbury(self, path: Union[str, Path]):
+        """Must be called when a deleted folder exists again locally: it, and its parents, may be created again."""
+        for key in ancestors(path.__str__()):
+            self.tombstones.discard(key)
+        self.invalidate(path)
+
+    def sizes(self) -> dict:
+        return dict(found=len(self.found), listed=len(self.listed), missing=len(self.missing), failed=len(self.failed),
+                    tombstones=len(self.tombstones))
+
+
+folder_cache = FolderCache(ttl=settings.FOLDER_CACHE_TTL, negative_ttl=settings.NEGATIVE_CACHE_TTL,
+                           tombstone_ttl=settings.TOMBSTONE_TTL, max_entries=settings.FOLDER_CACHE_SIZE)
@@ -0,0 +1,190 @@
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple, Union
+
+import settings
+from utilities import diagnostics, lanes
+from utilities.backlog import backlog
+from utilities.events import EventRecord
+from utilities.funtions import tenant_key
+from utilities.roots import resolve, roots
+
+logger = logging.getLogger(__name__)
+
+
+class TenantPauses:
+    """
+    Events of paused tenants, held in memory in the order they were seen and handed back when the tenant is resumed.
+    Held events are not persisted: after a restart the tenant is not paused anymore and a rescan finds its changes.
+    """
+
+    def __init__(self):
+        self.held: Dict[str, List[EventRecord]] = dict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def tenant_of(path: str) -> str:
+        """The '<email>' of 'clientes/<email>'."""
+        return tenant_key(path).rpartition('/')[2]
+
+    def hold(self, record: EventRecord) -> bool:
+        """True when the event belongs to a paused tenant, which keeps it."""
+        if not self.held:
+            return False
+        tenant = self.tenant_of(record.src_path)
+        with self._lock:
+            events = self.held.get(tenant)
+            if events is None:
+                return False
+            events.append(record)
+            return True
+
+    def pause(self, tenant: str):
+        with self._lock:
+            self.held.setdefault(tenant, list())
+        logger.info(f"Paused tenant '{tenant}'.")
+
+    def resume(self, tenant: str, release: Callable[[EventRecord], None]) -> int:
+        with self._lock:
+            events = self.held.pop(tenant, None)
+        if events is None:
+            raise ValueError(f"Tenant '{tenant}' is not paused.")
+        for record in events:
+            release(record)
+        logger.info(f"Resumed tenant '{tenant}', released {len(events)} held events.")
+        return len(events)
+
+    def status(self) -> Dict[str, int]:
+        with self._lock:
+            return {tenant: len(events) for tenant, events in self.held.items()}
+
+
+pauses = TenantPauses()
+
+
+def set_log_level(value: str):
+    level = logging.getLevelName(str(value).upper())
+    if not isinstance(level, int):
+        raise ValueError(f"Unknown log level '{value}'.")
+    for name in settings.LOGGER['loggers']:
+        logging.getLogger(name).setLevel(level)
+
+
+def non_negative(value) -> float:
+    value = float(value)
+    if value < 0:
+        raise ValueError(f"{value} is negative.")
+    return value
+
+
+# name -> (getter, setter) of the values the control socket reads and changes while the daemon runs
+TUNABLES: Dict[str, Tuple[Callable[[], object], Callable[[str], None]]] = {
+    'metadata_workers': (lambda: lanes.metadata_lane.workers, lambda value: lanes.metadata_lane.resize(int(value))),
+    'upload_workers': (lambda: lanes.upload_lane.workers, lambda value: lanes.upload_lane.resize(int(value))),
+    'scan_delay': (lambda: settings.DELAY_FOR_SCAN,
+                   lambda value: setattr(settings, 'DELAY_FOR_SCAN', non_negative(value))),
+    'upload_rate_mb': (lambda: lanes.upload_limiter.rate / settings.mega_bytes_to_bits(1),
+                       lambda value: lanes.upload_limiter.set_rate(int(non_negative(value)
+                                                                       * settings.mega_bytes_to_bits(1)))),
+    'backlog_drain_rate': (lambda: backlog.limiter.rate,
+                           lambda value: backlog.limiter.set_rate(non_negative(value))),
+    'log_level': (lambda: logging.getLevelName(logging.getLogger('utilities').getEffectiveLevel()), set_log_level),
+}
+
+
+class Control:
+    """
+    Commands of the control socket, one JSON object per line, e.g. ``{"command": "set", "name": "upload_workers",
+    "value": 4}``. Each one is answered by a JSON line holding ``ok`` and either its result or an ``error``.
+
+    - ``get``: the ``TUNABLES`` values.
+    - ``set`` ``name`` ``value``: changes a tunable, e.g. the workers of a lane or the upload rate in MB/s.
+    - ``pause`` / ``resume`` ``tenant``: holds the events of a tenant ('<email>'), then hands them back in order.
+    - ``rescan`` ``path``: scans a subtree now, a relative path is taken under the watch roots.
+    - ``status``: the gauges of the diagnostics dump.
+
+    With the 'processes' engine the lanes and the rates changed here are the watcher's, not the workers'.
+    """
+
+    def __init__(self, event_handler):
+        self.event_handler = event_handler
+        self.server = None
+
+    def execute(self, request: dict) -> dict:
+        command = request['command']
+        if command == 'get':
+            return dict(values={name: getter() for name, (getter, _) in TUNABLES.items()})
+        if command == 'set':
+            name = request['name']
+            if name not in TUNABLES:
+                raise ValueError(f"Unknown setting '{name}', one of {', '.join(TUNABLES)}.")
+            getter, setter = TUNABLES[name]
+            setter(request['value'])
+            logger.info(f"Set '{name}' to {getter()!r} through the control socket.")
+            return dict(values={name: getter()})
+        if command == 'pause':
+            pauses.pause(request['tenant'])
+            return dict(paused=pauses.status())
+        if command == 'resume':
+            released = pauses.resume(request['tenant'], self.event_handler.add_to_event_queue)
+            return dict(released=released, paused=pauses.status())
+        if command == 'rescan':
+            path = resolve(request['path'])
+            if not path.is_dir() or not any(path == root.path or root.path in path.parents for root in roots):
+                raise ValueError(f"'{path}' is not a directory under a watch root.")
+            threading.Thread(target=self.event_handler.scan_directory, args=(path,), name='rescan',
+                             daemon=True).start()
+            return dict(rescanning=os.fspath(path))
+        if command == 'status':
+            return dict(gauges=diagnostics.read_gauges(), paused=pauses.status())
+        raise ValueError(f"Unknown command '{command}'.")
+
+    def serve(self, path: Union[str, Path]):
+        path = Path(path)
+        if path.is_socket():
+            # left by a previous run; a running daemon would still answer on it
+            try:
+                request(path, dict(command='get'), timeout=1)
+                raise RuntimeError(f"Another daemon answers on '{path}'.")
+            except OSError:
+                path.unlink()
+        self.server = ControlServer(os.fspath(path), ControlRequestHandler)
+        self.server.control = self
+        os.chmod(path, 0o600)
+        threading.Thread(target=self.server.serve_forever, name='control', daemon=True).start()
+        logger.info(f"Control socket listening on '{path}'.")
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            Path(self.server.server_address).unlink(missing_ok=True)
+
+
+class ControlServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class ControlRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = dict(ok=True, **self.server.control.execute(json.loads(line)))
+            except (ValueError, KeyError, TypeError) as error:
+                response = dict(ok=False, error=f"{type(error).__name__}: {error}")
+            self.wfile.write((json.dumps(response, default=str) + '\n').encode())
+
+
+def request(path: Union[str, Path], content: dict, timeout: float = 10) -> dict:
+    """Sends a command to the control socket of a running daemon and returns its answer."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(timeout)
+        connection.connect(os.fspath(path))
+        connection.sendall((json.dumps(content) + '\n').encode())
+        with connection.makefile('rb') as file:
+            return json.loads(file.readline())
@@ -1,15 +1,32 @@
-import logging.config
+import logging
 from functools import wraps
 from pathlib import Path
 from typing import Union
 
-import settings
+from utilities import tracing
 from utilities.funtions import get_budget_name, get_email
+from utilities.roots import root_for
 
-logging.config.dictConfig(settings.LOGGER)
 logger = logging.getLogger(__name__)
 
 
+def is_valid_folder_input(path: str) -> bool:
+    reference: str = root_for(path).reference
+    if reference not in path:
+        logger.error(f"The provided path '{path}' is deemed invalid! It must include the requisite reference: "
+                     f"{reference}.")
+        return False
+    email = get_email(path)
+    budget = get_budget_name(path)
+    if not email:
+        logger.error(f"User email not found in path: {path}!")
+        return False
+    if not budget:
+        logger.error(f"User budget not found in path: {path}!")
+        return False
+    return True
+
+
 def validate_on_folder_input(func):
     @wraps(func)
     def wrapper(src_path: Union[str, Path], *args, **kwargs):
@@ -18,19 +35,24 @@ def validate_on_folder_input(func):
         if dest_path:
             paths.append(dest_path.__str__())
 
-        for path in paths:
-            if settings.PATH_REFERENCE not in path:
-                logger.error(f"The provided path '{path}' is deemed invalid! It must include the requisite reference: "
-                             f"{settings.PATH_REFERENCE}.")
-                return False
-            email = get_email(path)
-            budget = get_budget_name(path)
-            if not email:
-                logger.error(f"User email not found in path: {path}!")
-                return False
-            if not budget:
-                logger.error(f"User budget not found in path: {path}!")
-                return False
+        with tracing.span('validate_path'):
+            valid = all(is_valid_folder_input(path) for path in paths)
+        if not valid:
+            return False
         return func(src_path, *args, **kwargs)
 
     return wrapper
+
+
+def traced(func):
+    """Records a tracing span for every call made while an event is traced, named e.g. 'folders.find_folder'."""
+    name = f"{func.__module__.rpartition('.')[2]}.{func.__name__}"
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if tracing.current() is None:
+            return func(*args, **kwargs)
+        with tracing.span(name):
+            return func(*args, **kwargs)
+
+    return wrapper
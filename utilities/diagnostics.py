@@ -0,0 +1,174 @@
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+# name -> callable returning a JSON-serialisable value, e.g. the size of a queue
+gauges: Dict[str, Callable[[], object]] = dict()
+
+
+def register_gauge(name: str, fn: Callable[[], object]):
+    gauges[name] = fn
+
+
+def output_path(kind: str, suffix: str) -> Path:
+    return settings.LOG_DIR.joinpath(f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.{suffix}")
+
+
+def dump_stacks() -> Path:
+    """Writes the current stack of every thread, named, to LOG_DIR."""
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    lines = list()
+    for ident, frame in sys._current_frames().items():
+        lines.append(f"Thread {names.get(ident, '?')} ({ident}):")
+        lines.extend(line.rstrip('\n') for line in traceback.format_stack(frame))
+        lines.append('')
+    path = output_path('stacks', 'txt')
+    path.write_text('\n'.join(lines))
+    logger.info(f"Dumped the stacks of {len(names)} threads to '{path}'.")
+    return path
+
+
+def read_gauges() -> Dict[str, object]:
+    values = dict()
+    for name, fn in gauges.items():
+        try:
+            values[name] = fn()
+        except Exception as error:
+            values[name] = f"error: {error}"
+    return values
+
+
+def dump_gauges() -> Path:
+    """Writes the registered gauges (queue, lane, cache and backlog sizes) to LOG_DIR."""
+    path = output_path('gauges', 'json')
+    path.write_text(json.dumps(read_gauges(), indent=2, default=str))
+    logger.info(f"Dumped {len(gauges)} gauges to '{path}'.")
+    return path
+
+
+# stacks ending in these files are threads waiting for work, left out of the profile summary
+IDLE_FILES = {'threading.py', 'queue.py'}
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of every thread ``interval`` seconds apart, for a fixed duration.
+
+    Unlike cProfile, which only sees the thread that enabled it, sampling covers the worker, lane and observer threads
+    of the running daemon, and costs nothing while it is not running. The samples are written to LOG_DIR as collapsed
+    stacks (the input of flamegraph tools) plus a summary of the functions seen most often.
+    """
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float) -> bool:
+        if self.running:
+            return False
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(seconds,), name='profiler', daemon=True)
+        self._thread.start()
+        logger.info(f"Profiling all threads for {seconds}s.")
+        return True
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, seconds: float):
+        own = threading.get_ident()
+        stacks: Counter = Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline and not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = list()
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append((os.path.basename(code.co_filename), code.co_name, code.co_firstlineno))
+                    frame = frame.f_back
+                # collapse numbered threads of a pool, e.g. 'metadata-lane-3' becomes 'metadata-lane'
+                stacks[(names.get(ident, '?').rstrip('0123456789').rstrip('-_'), tuple(reversed(stack)))] += 1
+            samples += 1
+        self.write(stacks, samples)
+
+    def write(self, stacks: Counter, samples: int):
+        folded = output_path('profile', 'folded')
+        with folded.open('w') as file:
+            for (thread, stack), count in stacks.most_common():
+                frames = ';'.join(f"{name} ({filename}:{line})" for filename, name, line in stack)
+                file.write(f"{thread};{frames} {count}\n")
+
+        own: Counter = Counter()
+        inclusive: Counter = Counter()
+        idle = 0
+        for (_, stack), count in stacks.items():
+            if not stack or stack[-1][0] in IDLE_FILES:
+                idle += count
+                continue
+            own[stack[-1]] += count
+            for frame in set(stack):
+                inclusive[frame] += count
+        total = sum(stacks.values()) - idle or 1
+        lines = [f"{samples} samples every {self.interval * 1000:.0f} ms, {total} busy and {idle} idle thread stacks.",
+                 '',
+                 'Most frequent leaf functions (own time):']
+        lines.extend(f"{count / total:7.1%}  {name} ({filename}:{line})"
+                     for (filename, name, line), count in own.most_common(30))
+        lines.extend(['', 'Most frequent functions anywhere on the stack (inclusive time):'])
+        lines.extend(f"{count / total:7.1%}  {name} ({filename}:{line})"
+                     for (filename, name, line), count in inclusive.most_common(30))
+        summary = output_path('profile', 'txt')
+        summary.write_text('\n'.join(lines) + '\n')
+        logger.info(f"Profile of {samples} samples written to '{summary}' and '{folded}'.")
+
+
+profiler = SamplingProfiler(interval=settings.PROFILE_INTERVAL)
+
+
+def toggle_profile(seconds: Optional[float] = None):
+    if profiler.running:
+        profiler.stop()
+    else:
+        profiler.start(settings.PROFILE_SECONDS if seconds is None else seconds)
+
+
+def install_signal_handlers():
+    """
+    SIGUSR1 dumps the thread stacks and the gauges, SIGUSR2 starts a profile of PROFILE_SECONDS, or stops the one
+    running early. The work runs on a separate thread, so the main loop is only interrupted for a moment.
+    """
+    if not hasattr(signal, 'SIGUSR1'):
+        return
+
+    def on_dump(signum, frame):
+        threading.Thread(target=lambda: (dump_stacks(), dump_gauges()), name='diagnostics', daemon=True).start()
+
+    def on_profile(signum, frame):
+        threading.Thread(target=toggle_profile, name='diagnostics', daemon=True).start()
+
+    signal.signal(signal.SIGUSR1, on_dump)
+    signal.signal(signal.SIGUSR2, on_profile)
+    logger.info(f"Diagnostics: 'kill -USR1 {os.getpid()}' dumps stacks and gauges, 'kill -USR2 {os.getpid()}' "
+                f"profiles for {settings.PROFILE_SECONDS}s.")
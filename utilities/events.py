@@ -0,0 +1,75 @@
+import os
+import sys
+import time
+from enum import IntEnum
+from typing import Optional
+
+from watchdog.events import FileSystemEvent
+
+
+class EventType(IntEnum):
+    CREATED = 1
+    MODIFIED = 2
+    MOVED = 3
+    DELETED = 4
+
+
+def split_path(path: Optional[str]):
+    """Splits a path into an interned directory, shared by every event of that directory, and a name."""
+    if not path:
+        return None, None
+    directory, name = os.path.split(path)
+    return sys.intern(directory), name
+
+
+class EventRecord:
+    """
+    Compact queued event. A watchdog event keeps a per-instance ``__dict__`` and full path strings; the record uses
+    slots, an enum for the type and interned directory prefixes, which keeps a large backlog small.
+    """
+    __slots__ = ('event_type', 'is_directory', 'src_dir', 'src_name', 'dest_dir', 'dest_name', 'queued_at')
+
+    def __init__(self, event_type: EventType, src_path: str, is_directory: bool = False,
+                 dest_path: Optional[str] = None, queued_at: Optional[float] = None):
+        self.event_type = event_type
+        self.is_directory = is_directory
+        self.src_dir, self.src_name = split_path(src_path)
+        self.dest_dir, self.dest_name = split_path(dest_path)
+        self.queued_at = time.time() if queued_at is None else queued_at
+
+    @classmethod
+    def from_event(cls, event: FileSystemEvent, event_type: EventType) -> 'EventRecord':
+        src_path = os.fsdecode(event.src_path)
+        dest_path = getattr(event, 'dest_path', None)
+        return cls(event_type, src_path, event.is_directory, os.fsdecode(dest_path) if dest_path else None)
+
+    def to_dict(self) -> dict:
+        return dict(type=self.event_type.name, src=self.src_path, dir=self.is_directory, dest=self.dest_path,
+                    at=self.queued_at)
+
+    @classmethod
+    def from_dict(cls, content: dict) -> 'EventRecord':
+        return cls(EventType[content['type']], content['src'], content.get('dir', False), content.get('dest'),
+                   content.get('at'))
+
+    def pack(self) -> tuple:
+        """Plain tuple sent to the worker processes, its pickle is less than half the size of the record's."""
+        return self.event_type.value, self.src_path, self.is_directory, self.dest_path, self.queued_at
+
+    @classmethod
+    def unpack(cls, packed: tuple) -> 'EventRecord':
+        event_type, src_path, is_directory, dest_path, queued_at = packed
+        return cls(EventType(event_type), src_path, is_directory, dest_path, queued_at)
+
+    @property
+    def src_path(self) -> str:
+        return os.path.join(self.src_dir, self.src_name)
+
+    @property
+    def dest_path(self) -> Optional[str]:
+        if self.dest_dir is None:
+            return None
+        return os.path.join(self.dest_dir, self.dest_name)
+
+    def __repr__(self) -> str:
+        return f"EventRecord({self.event_type.name}, {self.src_path!r}, is_directory={self.is_directory})"
@@ -1,54 +1,228 @@
 import json
-import logging.config
+import logging
+import os
 from pathlib import Path
 from typing import Union, Optional, List, Dict
-from urllib import parse
 import mimetypes
+import time
+from concurrent.futures import Future, wait
+
 import requests
-from requests import Response
 
 import settings
+from utilities import tracing
+from utilities.backlog import backlog
+from utilities.cache import TTLCache
+from utilities.decorators import traced
+from utilities.events import EventRecord, EventType
 from utilities.folders import find_folder, on_folder_created
 from utilities.funtions import get_path_after_keyword, validate_path
-from utilities.http_requests import post, delete, get, session, ends_with_slash, normalize_relative_url
+from utilities.lanes import Lane, upload_lane, upload_limiter
+from utilities.manifest import manifest, Fingerprint
+from utilities.metrics import metrics
+from utilities.singleflight import flights
+from utilities.status import sync_status
+from utilities.breaker import breaker, is_outage
+from utilities.http_requests import post, delete, make_request, clear_failure, last_failure
+from utilities.listing import fetch_page, list_files
 
-logging.config.dictConfig(settings.LOGGER)
 logger = logging.getLogger(__name__)
 
+# digests of the uploads whose reply was lost, the file may be stored already and is looked up before it is sent again
+unconfirmed = TTLCache(ttl=24 * 3600, max_entries=settings.FOLDER_CACHE_SIZE)
+
+# uploads queued on the upload lane by path, a move or delete of the file waits for its upload
+queued_uploads: Dict[str, Future] = dict()
+
+
+def track_upload(file_path: Path, future: Future):
+    key = os.fspath(file_path)
+    queued_uploads[key] = future
+
+    def forget(done: Future):
+        if queued_uploads.get(key) is done:
+            del queued_uploads[key]
+
+    future.add_done_callback(forget)
+
+
+def wait_for_upload(file_path: Path):
+    future: Optional[Future] = queued_uploads.get(os.fspath(file_path))
+    if future is not None:
+        logger.debug(f"Waiting for the upload of '{file_path}' queued before this event.")
+        wait([future])
+
+
+@traced
+def resolve_folder(file_path: Path) -> Optional[str]:
+    folder_pk = find_folder(file_path.parent)
+    if folder_pk:
+        return folder_pk
+    logger.error(f"Folder not found! pk = '{folder_pk}'")
+    # add this line to create the folder, syncthing issue
+    if not on_folder_created(file_path.parent):
+        return None
+    folder_pk = find_folder(file_path.parent)
+    if not folder_pk:
+        logger.error(f"Folder '{file_path.parent}' is still missing after creating it.")
+    return folder_pk
+
+
+def run_upload(event: EventRecord, file_path: Path, folder_pk: str, pending_fingerprint: Future) -> bool:
+    """Job of the upload lane: uploads the file, parking it when the storage API is down, and records the result."""
+    clear_failure()
+    result = backlog.guard(event, upload_file, file_path, folder_pk, pending_fingerprint)
+    if not breaker.saw_outage():
+        sync_status.finished(event.src_path, result, last_failure())
+    return result
+
+
+@traced
+def upload_file(file_path: Path, folder_pk: str, pending_fingerprint: Future) -> bool:
+    try:
+        with tracing.span('hash_wait'):
+            fingerprint: Fingerprint = pending_fingerprint.result()
+        # the created and modified events of a new file race each other, only one of them uploads this content
+        return flights.do(('upload', file_path.__str__(), fingerprint.digest), send_file, file_path, folder_pk,
+                          fingerprint)
+    except Exception as error:
+        logger.error(error)
+        return False
+
+
+def seed_folder(folder: Path, folder_pk: str):
+    """
+    Lists, once per folder, the files the server holds already before the first upload to it, so that an empty
+    manifest, e.g. on the first run, does not send every file again: a local file whose name is listed is taken as
+    uploaded, with its current fingerprint and the remote id.
+    """
+    if not manifest.is_seeded(folder):
+        flights.do(('seed', folder.__str__()), list_folder_files, folder, folder_pk)
+
+
+def list_folder_files(folder: Path, folder_pk: str):
+    if manifest.is_seeded(folder):
+        return
+    files: Dict[str, Fingerprint] = dict()
+    for record in list_files(dict(folder=folder_pk)):
+        path = folder.joinpath(record.file_name or '')
+        if record.file_name and path.__str__() not in manifest.files and path.is_file():
+            files[path.__str__()] = manifest.fingerprint(path)._replace(pk=str(record.id), synced_at=time.time())
+    manifest.seed(folder, files)
+    if files:
+        logger.info(f"Recorded {len(files)} files of '{folder}' the server holds already, they are not sent again.")
+
+
+def skip_unchanged(file_path: Path, fingerprint: Fingerprint) -> bool:
+    """True when this content of the file was uploaded already, which is then counted as a skipped upload."""
+    if not manifest.is_unchanged(file_path, fingerprint):
+        return False
+    logger.info(f"File {file_path.name} is unchanged since its last upload, skipping.")
+    manifest.skip(file_path, fingerprint)
+    metrics.add(file_path, 'uploads_skipped')
+    return True
+
+
+def record_upload(file_path: Path, fingerprint: Fingerprint, pk: Optional[str]):
+    unconfirmed.discard(file_path.__str__())
+    manifest.record(file_path, fingerprint._replace(pk=pk, synced_at=time.time()))
+    metrics.add(file_path, 'uploads')
+    metrics.add(file_path, 'uploaded_bytes', fingerprint.size)
 
-def create_file(file_path: Path, keyword: str = "mofreitas" ) -> bool:
+
+def stored_already(file_path: Path, folder_pk: str, fingerprint: Fingerprint) -> bool:
+    """
+    After an upload of this content whose reply was lost, looks the file up instead of sending it again. A remote file
+    of that name the manifest knows is the previous content of the file, any other is the one the lost upload stored.
+
+    Returns:
+        bool: True when the file was stored by the lost upload, which is then recorded as uploaded.
+    """
+    if unconfirmed.get(file_path.__str__()) != fingerprint.digest:
+        return False
+    known: Optional[Fingerprint] = manifest.files.get(file_path.__str__())
+    params: dict = dict(folder=folder_pk, file_name=file_path.stem)
+    results: List[Dict] = fetch_page('/storages/file/', params=params).get('results') or list()
+    unconfirmed.discard(file_path.__str__())
+    stored = [str(result.get('id')) for result in results if result.get('file_name', file_path.name) == file_path.name
+              and (known is None or str(result.get('id')) != known.pk)]
+    if not stored:
+        return False
+    logger.info(f"File {file_path.name} was stored by an upload whose reply was lost, not sending it again.")
+    record_upload(file_path, fingerprint, stored[-1])
+    return True
+
+
+def send_file(file_path: Path, folder_pk: str, fingerprint: Fingerprint) -> bool:
+    seed_folder(file_path.parent, folder_pk)
+    if skip_unchanged(file_path, fingerprint) or stored_already(file_path, folder_pk, fingerprint):
+        return True
+
+    with tracing.span('rate_limit', bytes=fingerprint.size):
+        upload_limiter.acquire(fingerprint.size)
+    with file_path.open('rb') as file:
+        mime_type, _ = mimetypes.guess_type(file_path.name)
+        files = {'file': (file_path.name, file, mime_type if mime_type else 'application/octet-stream')}
+        payload = {"folder": folder_pk}
+        try:
+            res = post(relative_url='/storages/file/', data=payload, files=files)
+        except requests.RequestException:
+            unconfirmed.put(file_path.__str__(), fingerprint.digest)
+            raise
+        if is_outage(res):
+            unconfirmed.put(file_path.__str__(), fingerprint.digest)
+        if res.status_code == 201:
+            logging.info(f"File {file_path.name} was successfully uploaded to the folder with ID {folder_pk}.")
+            record_upload(file_path, fingerprint, response_pk(res))
+            return True
+        else:
+            logging.error(
+                f"Failed to upload file {file_path.name} to the folder with ID {folder_pk}. "
+                f"Server responded with status code: {res.status_code}")
+            logger.error(res.text)
+            return False
+
+
+def response_pk(res) -> Optional[str]:
+    """The id the storage API gave to the uploaded file, None when the body does not carry one."""
+    try:
+        pk = res.json().get('id')
+    except (ValueError, AttributeError):
+        return None
+    return str(pk) if pk is not None else None
+
+
+def create_file(file_path: Path, keyword: Optional[str] = None, lane: Optional[Lane] = None) -> bool:
+    """
+    Uploads a file, creating its folder first when needed.
+
+    When ``lane`` is given, only the upload itself runs there: the folder is resolved on the calling thread, so a file
+    whose folder does not exist yet never holds an upload slot. In that case the result tells whether the upload was
+    queued.
+    """
     file_path = validate_path(file_path)
     # file_path = get_path_after_keyword(file_path, keyword)
     try:
-        folder_pk = find_folder(file_path.parent)
-        if not folder_pk:
-            logger.error(f"Folder not found! pk = '{folder_pk}'")
-            # add this line to create the folder, syncthing issue
-            on_folder_created(file_path.parent)
-            return create_file(file_path)
         if not file_path.is_file():
             logging.error(f"The path {file_path} does not point to a file.")
             return False
-
-        with file_path.open('rb') as file:
-            mime_type, _ = mimetypes.guess_type(file_path.name)
-            files = {'file': (file_path.name, file, mime_type if mime_type else 'application/octet-stream')}
-            payload = {"folder": folder_pk}
-            res = post(relative_url='/storages/file/', data=payload, files=files)
-            if res.status_code == 201:
-                logging.info(f"File {file_path.name} was successfully uploaded to the folder with ID {folder_pk}.")
-                return True
-            else:
-                logging.error(
-                    f"Failed to upload file {file_path.name} to the folder with ID {folder_pk}. "
-                    f"Server responded with status code: {res.status_code}")
-                logger.error(res.text)
-                return False
+        # hash the file while the folder is being resolved
+        pending_fingerprint: Future = manifest.fingerprint_async(file_path)
+        folder_pk = resolve_folder(file_path)
+        if not folder_pk:
+            return False
+        if lane is not None:
+            # an upload failing because the storage API went down is parked like any other event
+            event = EventRecord(EventType.CREATED, os.fspath(file_path))
+            track_upload(file_path, lane.submit(run_upload, event, file_path, folder_pk, pending_fingerprint))
+            return True
+        return upload_file(file_path, folder_pk, pending_fingerprint)
     except Exception as error:
         logger.error(error)
         return False
 
 
+@traced
 def patch_file(src_path: Path, dest_path: Path, **kwargs) -> bool:
     logger.info(f"Pathing file: {src_path}")
     if not dest_path.is_file():
@@ -60,11 +234,10 @@ def patch_file(src_path: Path, dest_path: Path, **kwargs) -> bool:
             return False
         payload = json.dumps(dict(file_name=dest_path.name))
         headers = {'Content-Type': 'application/json'}
-        url = parse.urljoin(ends_with_slash(settings.URL),
-                            normalize_relative_url(f'/storages/file/{pk}/update_file_name/'))
-        res = session.patch(url=url, data=payload, headers=headers)
+        res = make_request('PATCH', f'/storages/file/{pk}/update_file_name/', data=payload, headers=headers)
         if res.status_code == 200:
             logger.info(f"Successfully updated the filename for file with pk: {pk}")
+            manifest.move(src_path, dest_path)
             return True
         else:
             logger.error(f"Error: Unable to update the filename for file with pk: {pk}. Status code: {res.status_code}")
@@ -74,6 +247,7 @@ def patch_file(src_path: Path, dest_path: Path, **kwargs) -> bool:
         return False
 
 
+@traced
 def delete_file(path: Path) -> bool:
     logger.info(f"Deleting file: {path.name}")
     file_pk = find_file(path)
@@ -84,12 +258,14 @@ def delete_file(path: Path) -> bool:
     res = delete(relative_url='/storages/file/', pk=file_pk)
     if res.status_code == 204:
         logger.info(f"File '{path.name}' successfully deleted. Status Code '{res.status_code}'")
+        manifest.forget(path)
         return True
     else:
         logger.error(f"Deletion failed for file '{path}'.  Status Code '{res.status_code}'")
         return False
 
 
+@traced
 def find_file(file_path: Union[str, Path], **kwargs) -> Optional[str]:
     """
     This function attempts to locate a specific file based on the provided file path.
@@ -99,7 +275,7 @@ def find_file(file_path: Union[str, Path], **kwargs) -> Optional[str]:
     **kwargs: Arbitrary keyword arguments.
     - is_src_path (bool, optional): If True, the function will get the path after a specified keyword. Default is True.
     - keyword (str, optional): The keyword used to trim the original path if is_src_path is True. Default is
-    "mofreitas".
+    the keyword of the watch root of the path.
 
     Returns: Optional[str]: If a file is found, the function returns the file id. If no file is found or an error
     occurs, None is returned.
@@ -112,7 +288,7 @@ def find_file(file_path: Union[str, Path], **kwargs) -> Optional[str]:
     script that provides functionality for manipulating files within a storage system.
     """
     file_path = validate_path(file_path)
-    keyword: str = kwargs.get('keyword', "mofreitas")
+    keyword: Optional[str] = kwargs.get('keyword')
     file_path = get_path_after_keyword(file_path, keyword)
     folder_id = find_folder(file_path.parent, **kwargs)
     if folder_id is None:
@@ -121,46 +297,44 @@ def find_file(file_path: Union[str, Path], **kwargs) -> Optional[str]:
 
     try:
         params: dict = dict(folder=folder_id, file_name=file_path.stem)
-        response: Response = get(relative_url='/storages/file/', params=params)
-        if not response.status_code == 200:
-            msg: str = f"Error {response.status_code}: Unable to establish communication with the server."
-            logger.error(msg)
-            raise requests.RequestException(msg)
-        count = response.json().get('count')
-        results: List[Optional[Dict]] = response.json().get('results')
-        assert isinstance(count, int)
-        if count != 0 and results:
+        results: List[Dict] = fetch_page('/storages/file/', params=params).get('results')
+        if results:
             return results[0].get('id')
     except Exception as error:
         logger.error(f"Error: {error}")
     return None
 
 
-def on_file_created(src_path: Union[str, Path], keyword: str = 'mofreitas') -> bool:
+@traced
+def on_file_created(src_path: Union[str, Path], keyword: Optional[str] = None) -> bool:
     """
        Function to handle the process of creating a file in a directory structure.
-       The function assumes that the parent folder already exists.
+       The parent folder is resolved, or created, on the calling thread and the upload is queued on the upload lane.
 
        Args:
            src_path (Union[str, Path]): The source path of the file to be created.
-           keyword (str, optional): A keyword used to parse the src_path, default is "mofreitas".
+           keyword (str, optional): A keyword used to parse the src_path, default is the keyword of its watch root.
 
        Returns:
-           bool: True if the file is successfully created, False otherwise.
+           bool: True if the upload is queued, False otherwise.
 
        Raises:
            Any exceptions raised by the underlying functions (get_path_after_keyword, get_email, find_folder,
            create_file, file_already_exists) are not caught by this function.
        """
-    return create_file(file_path=src_path)
+    return create_file(file_path=src_path, lane=upload_lane)
 
 
-def on_file_updated(src_path: Union[str, Path], dest_path: Union[str, Path], keyword: str = "mofreitas") -> bool:
+@traced
+def on_file_updated(src_path: Union[str, Path], dest_path: Union[str, Path], keyword: Optional[str] = None) -> bool:
     src_path = validate_path(src_path)
     dest_path = validate_path(dest_path)
+    wait_for_upload(src_path)
     return patch_file(src_path=src_path, dest_path=dest_path)
 
 
+@traced
 def on_file_deleted(src_path: Union[str, Path]) -> bool:
     src_path = validate_path(src_path)
+    wait_for_upload(src_path)
     return delete_file(path=src_path)
@@ -1,21 +1,26 @@
 import json
-import logging.config
-import os
+import logging
 from pathlib import Path
-from typing import Union, Optional, List, Dict, Tuple
+from typing import Union, Optional, List, Dict, NamedTuple, Tuple
 
 import requests
 from requests import Response
 
 import settings
-from utilities.decorators import validate_on_folder_input
-from utilities.funtions import get_path_after_keyword, validate_path, get_email, get_budget_name
-from utilities.http_requests import post, patch, delete, get
+from utilities.breaker import breaker, is_outage
+from utilities.cache import folder_cache
+from utilities.decorators import validate_on_folder_input, traced
+from utilities.funtions import get_path_after_keyword, validate_path, get_email, get_budget_name, get_budget_path
+from utilities.http_requests import post, patch, delete
+from utilities.listing import fetch_page, list_folders
+from utilities.manifest import manifest
+from utilities.roots import root_for
+from utilities.singleflight import flights
 
-logging.config.dictConfig(settings.LOGGER)
 logger = logging.getLogger(__name__)
 
 
+@traced
 def create_folder(name: str, budget_id: str, email: str, parent: Optional[str] = None) -> Response:
     payload = json.dumps({
         "name": name,
@@ -26,9 +31,12 @@ def create_folder(name: str, budget_id: str, email: str, parent: Optional[str] =
     headers = {
         'Content-Type': 'application/json'
     }
-    return post(relative_url='/storages/folder/create_folder_with_email/', data=payload, headers=headers)
+    relative_url = '/storages/folder/create_folder_with_email/'
+    return flights.do((relative_url, email, budget_id, parent, name), post, relative_url=relative_url, data=payload,
+                      headers=headers)
 
 
+@traced
 def patch_folder(data: dict, pk: str, **kwargs):
     payload = json.dumps(data)
     headers = {
@@ -37,20 +45,7 @@ def patch_folder(data: dict, pk: str, **kwargs):
     return patch(relative_url='/storages/folder/', pk=pk, data=payload, headers=headers)
 
 
-def update_folder_name(old_path: Path, new_path: Path) -> bool:
-    folder_pk = find_folder(old_path)
-    if folder_pk is None:
-        return on_folder_created(old_path)
-    resp: Response = patch_folder(data=dict(name=new_path.name), pk=folder_pk)
-    if resp.status_code == 200:
-        logger.info(f"Successfully updated the folder '{new_path.name}'.")
-        return True
-    logger.error(f"Fail to update the folder '{old_path.name}' to '{new_path.name}' with pk '{folder_pk}'.")
-    if resp.content:
-        logger.error(resp.content)
-    return False
-
-
+@traced
 def delete_folder(path: Path):
     folder_pk = find_folder(path)
     if not folder_pk:
@@ -60,29 +55,19 @@ def delete_folder(path: Path):
     res = delete(relative_url='/storages/folder/', pk=folder_pk)
     if res.status_code == 204:
         logger.info(f"Folder '{path}' successfully deleted.")
+        # keep in-flight events for the deleted folder from creating it again
+        folder_cache.bury(path)
+        return True
     else:
         logger.error(f"Deletion failed for folder '{path}'.")
         return False
 
 
 def folder_already_exists(path: Union[str, Path], is_src_path: bool = True) -> bool:
-    if is_src_path:
-        path: Path = get_path_after_keyword(path)
-    try:
-        params = dict(path=path.__str__())
-        response: Response = get(relative_url='/storages/folder/', params=params)
-        if not response.status_code == 200:
-            msg: str = f"Error {response.status_code}: Unable to establish communication with the server."
-            logger.error(msg)
-            raise requests.RequestException(msg)
-        count = response.json().get('count')
-        assert isinstance(count, int)
-        return count != 0
-    except Exception as error:
-        logger.error(f"Error: {error}")
-    return False
+    return find_folder(path, is_src_path=is_src_path) is not None
 
 
+@traced
 def find_folder(path: Union[str, Path], **kwargs) -> Optional[str]:
     """
     This function attempts to locate a specific folder based on the provided path and optional keyword.
@@ -92,7 +77,7 @@ def find_folder(path: Union[str, Path], **kwargs) -> Optional[str]:
     **kwargs: Arbitrary keyword arguments.
     - is_src_path (bool, optional): If True, the function will get the path after a specified keyword. Default is True.
     - keyword (str, optional): The keyword used to trim the original path if is_src_path is True. Default is
-    "mofreitas".
+    the keyword of the watch root of the path.
 
     Returns: List[Optional[str]]: If a folder(s) is found, the function returns a list of folder IDs. If no folder is
     found or an error occurs, an empty list is returned.
@@ -105,32 +90,81 @@ def find_folder(path: Union[str, Path], **kwargs) -> Optional[str]:
     script that provides functionality for manipulating folders within a storage system.
     """
     is_src_path: bool = kwargs.get('is_src_path', True)
-    keyword: str = kwargs.get('keyword', "mofreitas")
+    keyword: Optional[str] = kwargs.get('keyword')
     if is_src_path:
         path: Path = get_path_after_keyword(path, keyword=keyword)
+    if path is None:
+        return None
+    known, pk = folder_cache.resolve(path)
+    if not known:
+        budget: Optional[Path] = get_budget_path(path)
+        # events of a budget being prefetched wait for the listing instead of looking up folders one by one
+        if budget is not None and flights.wait(('prefetch', budget.__str__())):
+            known, pk = folder_cache.resolve(path)
+    if known:
+        return pk
+    # a lookup sent before the latest folder creation may be stale, so it is not shared with later callers
+    return flights.do(('/storages/folder/', path.__str__(), folder_cache.generation), lookup_folder, path)
+
+
+@traced
+def lookup_folder(path: Path) -> Optional[str]:
+    generation: int = folder_cache.generation
     try:
         params: dict = dict(path=path.__str__())
-        response: Response = get(relative_url='/storages/folder/', params=params)
-        if not response.status_code == 200:
-            msg: str = f"Error {response.status_code}: Unable to establish communication with the server."
-            logger.error(msg)
-            raise requests.RequestException(msg)
-        count = response.json().get('count')
-        results: List[Optional[Dict]] = response.json().get('results')
-        assert isinstance(count, int)
-        if count != 0 and results:
+        results: List[Dict] = fetch_page('/storages/folder/', params=params).get('results')
+        if results:
+            folder_cache.put(path, results[0].get('id'))
             return results[0].get('id')
+        folder_cache.mark_missing(path, generation)
     except Exception as error:
         logger.error(f"Error: {error}")
     return None
 
 
+def prefetch_budget(src_path: Union[str, Path], keyword: Optional[str] = None) -> int:
+    """
+    Lists every remote folder of a budget into the folder cache, so the events that follow resolve their folders
+    locally. Lookups for the budget made while the listing runs wait for it.
+
+    Returns:
+        int: The number of folders cached.
+    """
+    budget: Path = get_path_after_keyword(src_path, keyword=keyword)
+    return flights.do(('prefetch', budget.__str__()), list_budget_folders, budget)
+
+
+@traced
+def list_budget_folders(budget: Path) -> int:
+    generation: int = folder_cache.generation
+    prefix: str = budget.__str__()
+    count = 0
+    complete = True
+    try:
+        for folder in list_folders({settings.PREFETCH_FILTER: prefix}):
+            path: Optional[str] = folder.path
+            if path is None:
+                complete = False
+            elif path == prefix or path.startswith(prefix + '/'):
+                folder_cache.put(path, folder.id)
+                count += 1
+    except Exception as error:
+        logger.error(f"Unable to prefetch the folders of '{prefix}': {error}")
+        return count
+    # only a complete listing proves that the folders it does not contain are missing
+    if complete:
+        folder_cache.mark_listed(budget, generation)
+    logger.info(f"Prefetched {count} folders of '{prefix}'.")
+    return count
+
+
+@traced
 def find_parent_folder(path: Union[str, Path], email: str, **kwargs) -> Optional[Tuple[Path, str]]:
     is_src_path: bool = kwargs.get('is_src_path', True)
     path: Path = validate_path(path)
-    reference_path = Path(settings.PATH_REFERENCE).joinpath(email)
+    reference_path = Path(root_for(path).reference).joinpath(email)
     if is_src_path:
-        keyword: str = kwargs.get('keyword', "mofreitas")
+        keyword: Optional[str] = kwargs.get('keyword')
         path: Path = get_path_after_keyword(path, keyword=keyword)
     parent: Optional[str] = find_folder(path.parent, is_src_path=False)
     if parent:
@@ -142,8 +176,9 @@ def find_parent_folder(path: Union[str, Path], email: str, **kwargs) -> Optional
             return find_parent_folder(path=path.parent, email=email, is_src_path=True)
 
 
+@traced
 @validate_on_folder_input
-def on_folder_deleted(src_path: Union[str, Path], keyword: str = "mofreitas") -> bool:
+def on_folder_deleted(src_path: Union[str, Path], keyword: Optional[str] = None) -> bool:
     """
     Function to handle the process of deleting a folder in a directory structure.
     If the folder does not exist, an error message is logged and the function returns False.
@@ -151,7 +186,7 @@ def on_folder_deleted(src_path: Union[str, Path], keyword: str = "mofreitas") ->
 
     Args:
         src_path (Union[str, Path]): The source path of the folder to be deleted.
-        keyword (str, optional): A keyword used to parse the src_path, default is "mofreitas".
+        keyword (str, optional): A keyword used to parse the src_path, default is the keyword of its watch root.
 
     Returns:
         bool: True if the folder is successfully deleted, False otherwise.
@@ -164,102 +199,121 @@ def on_folder_deleted(src_path: Union[str, Path], keyword: str = "mofreitas") ->
     return delete_folder(path)
 
 
-def update_folder(folder_targe_new_parent_pk: Optional[str], folder_target_old_path: str) -> bool:
-    folder_pk = find_folder(folder_target_old_path)
-    if folder_pk is None:
-        logger.error(f"Fail to find the folder '{folder_target_old_path}'.")
-        return False
-    data = dict(parent=folder_targe_new_parent_pk)
-    resp: Response = patch_folder(data=data, pk=folder_pk)
-    if resp.status_code == 200:
-        logger.info(f"Successfully updated the folder '{folder_pk}' to parent {folder_targe_new_parent_pk}.")
-        return True
-    logger.error(f"Fail to update the folder '{folder_pk}' to parent {folder_targe_new_parent_pk}.")
-    return False
+class MovePlan(NamedTuple):
+    """A folder move resolved once: the folder and the fields of its single PATCH, 'name', 'parent' and 'budget'."""
+    pk: str
+    data: dict
 
+    @property
+    def kind(self) -> str:
+        return ' and '.join(kind for field, kind in (('name', 'rename'), ('parent', 're-parent')) if field in self.data)
 
-def get_diverge_folder_path(old_path: Path, new_path: str) -> Path:
-    common_path = os.path.commonpath([old_path, new_path])
-    diverging_folder_name = Path(os.path.relpath(new_path, common_path)).parts[0]
-    diverging_folder_path = os.path.join(common_path, diverging_folder_name)
-    return Path(diverging_folder_path)
 
+@traced
+def plan_folder_move(old_path: Path, new_path: Path, dest_path: Union[str, Path], email: str,
+                     keyword: Optional[str] = None) -> Optional[MovePlan]:
+    """
+    Resolves the source folder and, when it changes parent, the destination parent, at most one lookup each and none
+    when the folder cache knows them. A destination parent missing remotely is created once, with its missing
+    ancestors. A folder moved right under the tenant folder becomes a budget folder, without a parent. A folder that
+    ends up in another budget, or a budget folder renamed, gets the name of its new budget, as on its creation.
 
-# noinspection PyUnresolvedReferences
+    Args:
+        old_path (Path): The remote path of the folder.
+        new_path (Path): Its remote path after the move.
+        dest_path (Union[str, Path]): The local destination, to create the destination parent from.
+        email (str): The tenant of both paths.
+        keyword (str, optional): A keyword used to parse the dest_path, default is the keyword of its watch root.
+
+    Returns:
+        Optional[MovePlan]: The plan, or None when the source folder is not known remotely or the destination parent
+        could not be created.
+    """
+    folder_pk = find_folder(old_path, is_src_path=False)
+    if folder_pk is None:
+        return None
+    data = dict()
+    if old_path.name != new_path.name:
+        data['name'] = new_path.name
+    tenant = Path(root_for(dest_path).reference).joinpath(email)
+    budget = new_path.relative_to(tenant).parts[0]
+    if budget != old_path.relative_to(tenant).parts[0]:
+        data['budget'] = budget
+    if old_path.parent != new_path.parent:
+        if new_path.parent == tenant:
+            data['parent'] = None
+        else:
+            parent_pk = find_folder(new_path.parent, is_src_path=False)
+            if parent_pk is None:
+                logger.info(f"The destination folder '{new_path.parent}' is missing, creating it.")
+                if not on_folder_created(src_path=validate_path(dest_path).parent, keyword=keyword):
+                    return None
+                parent_pk = find_folder(new_path.parent, is_src_path=False)
+                if parent_pk is None:
+                    return None
+            data['parent'] = parent_pk
+    return MovePlan(folder_pk, data)
+
+
+@traced
 @validate_on_folder_input
-def on_folder_updated(src_path: Union[str, Path], dest_path: Union[str, Path], keyword: str = "mofreitas") -> bool:
+def on_folder_updated(src_path: Union[str, Path], dest_path: Union[str, Path], keyword: Optional[str] = None) -> bool:
     """
-    Function to handle the process of updating a folder's name in a directory structure. If the parent folder or the
-    target folder does not exist, it falls back to the on_folder_created function to create the necessary folders.
+    Function to handle the renaming and moving of a folder. Source and destination are resolved once by
+    plan_folder_move, then the folder is renamed and/or re-parented by a single PATCH. A folder that is not known
+    remotely is created at its destination instead, like a new one.
+
+    At most a lookup of the source, a lookup of the destination parent, the creation of the destination parent when
+    it is missing, and the PATCH are sent, whatever the move: nothing is retried or recursed into.
 
     Args:
         src_path (Union[str, Path]): The source path of the folder to be updated.
         dest_path (Union[str, Path]): THe destination path.
-        keyword (str, optional): A keyword used to parse the src_path, default is "mofreitas".
-
+        keyword (str, optional): A keyword used to parse the src_path, default is the keyword of its watch root.
 
     Returns:
-        bool: True if the folder name is successfully updated or the necessary folders are created, False otherwise.
-
-    Raises:
-        Any exceptions raised by the underlying functions (get_path_after_keyword, get_email, find_parent_folder,
-        folder_already_exists, on_folder_created, update_name) are not caught by this function.
+        bool: True if the folder is renamed and/or moved, or created at its destination, False otherwise.
     """
-    old_path: Path = get_path_after_keyword(path=src_path, keyword=keyword)
-    new_path: Path = get_path_after_keyword(path=dest_path, keyword=keyword)
+    old_path: Optional[Path] = get_path_after_keyword(path=src_path, keyword=keyword)
+    new_path: Optional[Path] = get_path_after_keyword(path=dest_path, keyword=keyword)
+    if old_path is None or new_path is None:
+        return False
+    if old_path == new_path:
+        return True
     email = get_email(src_path)
-    new_parent_path_and_id = find_parent_folder(path=new_path, keyword=keyword, email=email)
-    old_parent_path_and_id = find_parent_folder(path=old_path, keyword=keyword, email=email)
-
-    # If parent does not exist or the folder itself does not exist, create the folder(s)
-    if old_parent_path_and_id is None or not folder_already_exists(old_path):
-        if Path(settings.PATH_REFERENCE).joinpath(email) == old_path.parent and new_parent_path_and_id is not None:
-            success: bool = update_folder(folder_targe_new_parent_pk=new_parent_path_and_id[1],
-                                          folder_target_old_path=old_path.__str__())
-            if success:
-                logger.error(f"As the directory has been moved and the old path is not valid the system "
-                             f"will try to delete the folder '{old_path.name}'")
-                delete_folder(old_path)
-                return True
-            else:
-                logger.error(f"Fail to update the folder '{error}'.")
-                return False
-        success = on_folder_created(src_path=old_path)
-        if not success:
-            logger.error(f"It's impossible to sync folder '{new_parent_path_and_id[0].name}'")
-        return on_folder_updated(src_path=old_path, dest_path=new_path)
-
-    if new_parent_path_and_id is None or not folder_already_exists(new_parent_path_and_id[0]):
-        on_folder_created(src_path=new_parent_path_and_id[0])
-        return on_folder_updated(src_path=old_path, dest_path=new_path)
-
-    try:
-        if os.path.commonpath([old_path, new_path]) != new_path.parent.__str__():
-            diverging_folder = Path(os.path.relpath(new_path, os.path.commonpath([old_path, new_path]))).parts[0]
-            new_parent_path_and_id = find_parent_folder(path=Path(os.path.join(new_path.parent, diverging_folder)),
-                                                        keyword=keyword, email=email)
-            if new_parent_path_and_id is None or not folder_already_exists(new_parent_path_and_id[0]):
-                success = on_folder_created(src_path=new_parent_path_and_id[0])
-                if not success:
-                    logger.error(f"It's impossible to sync folder '{new_parent_path_and_id[0].name}'")
-                    return False
-                return on_folder_updated(src_path=old_path, dest_path=new_path)
-            return update_folder(folder_targe_new_parent_pk=new_parent_path_and_id[1],
-                                 folder_target_old_path=old_path.__str__())
-        else:
-            name_changed = old_path.name != new_path.name
-            logger.info(f"name_changed: '{name_changed}'.")
-            if name_changed:
-                logger.info(f"Trying to update just the folder name '{old_path.name}' to '{new_path.name}' ")
-                return update_folder_name(old_path, new_path)
-
-    except Exception as error:
-        logger.error(f"Fail to update the folder '{error}'.")
-    return False
+    if get_email(dest_path) != email:
+        logger.error(f"Unable to move the folder '{old_path}' to another tenant: '{new_path}'.")
+        return False
+    plan: Optional[MovePlan] = plan_folder_move(old_path, new_path, dest_path, email, keyword=keyword)
+    if plan is None:
+        # the source lookup is cached by now
+        if find_folder(old_path, is_src_path=False) is not None:
+            logger.error(f"Unable to create the destination of the folder '{old_path}': '{new_path.parent}'.")
+            return False
+        # never synced, its files are uploaded by the scan of the destination
+        logger.info(f"Folder '{old_path}' is not known remotely, creating '{new_path}' instead.")
+        return on_folder_created(src_path=dest_path, keyword=keyword)
+
+    resp: Response = patch_folder(data=plan.data, pk=plan.pk)
+    if resp.status_code != 200:
+        logger.error(f"Fail to {plan.kind} the folder '{old_path}' to '{new_path}' with pk '{plan.pk}'."
+                     f" Status code: {resp.status_code}")
+        if resp.content:
+            logger.error(resp.content)
+        return False
+    logger.info(f"Successfully applied the {plan.kind} of the folder '{old_path}' to '{new_path}'.")
+    # the ids cached under the old path are stale, and the new path is no longer missing
+    folder_cache.forget_tree(old_path)
+    folder_cache.invalidate(new_path)
+    folder_cache.put(new_path, plan.pk)
+    # the files keep their remote ids and content, they must not be taken as new at their new paths
+    manifest.move_tree(validate_path(src_path), validate_path(dest_path))
+    return True
 
 
+@traced
 @validate_on_folder_input
-def on_folder_created(src_path: Union[str, Path], keyword: str = "mofreitas") -> bool:
+def on_folder_created(src_path: Union[str, Path], keyword: Optional[str] = None) -> bool:
     """
     Function to handle the process of creating a folder in a directory structure.
     If the parent folder does not exist, it generates a directory with an undefined parent entity.
@@ -267,7 +321,7 @@ def on_folder_created(src_path: Union[str, Path], keyword: str = "mofreitas") ->
 
     Args:
         src_path (Union[str, Path]): The source path of the folder to be created.
-        keyword (str, optional): A keyword used to parse the src_path, default is "mofreitas".
+        keyword (str, optional): A keyword used to parse the src_path, default is the keyword of its watch root.
 
     Returns:
         bool: True if the necessary folders are successfully created, False otherwise.
@@ -277,37 +331,92 @@ def on_folder_created(src_path: Union[str, Path], keyword: str = "mofreitas") ->
         create_folder, folder_already_exists) are not caught by this function.
     """
     path: Path = get_path_after_keyword(path=src_path, keyword=keyword)
+    # concurrent events under the same new folder share a single creation
+    return flights.do(('create_folder_with_email', path.__str__()), create_folder_tree, src_path, path, keyword)
+
+
+def create_missing_folder(path: Path, budget: str, email: str, parent: Optional[str]) -> Optional[str]:
+    """
+    Creates the folder and caches its id, unless an event racing with this one created it since it was looked up.
+    Callers run it in a single flight per path, so the check and the creation are never interleaved.
+
+    Returns:
+        Optional[str]: The id of the folder, or None when it could not be created.
+    """
+    known, pk = folder_cache.resolve(path)
+    if pk:
+        return pk
+    try:
+        resp: Response = create_folder(name=path.name, budget_id=budget, email=email, parent=parent)
+    except requests.RequestException:
+        # the folder may have been created before the reply was lost, the next attempt looks it up first
+        folder_cache.mark_uncertain(path)
+        raise
+    if resp.status_code != 201:
+        if is_outage(resp):
+            folder_cache.mark_uncertain(path)
+        logger.error(f"Error encountered while attempting to create the folder"
+                     f" '{path.name}'. {f'CONTENT: {resp.content}' if len(resp.content) < 500 else f'OK: {resp.ok}'}")
+        return None
+    logger.info(f"Successfully created the folder '{path.name}'.")
+    folder_cache.put(path, resp.json().get('id'))
+    folder_cache.invalidate(path)
+    return resp.json().get('id')
+
+
+@traced
+def create_folder_tree(src_path: Union[str, Path], path: Path, keyword: Optional[str] = None) -> bool:
+    if folder_cache.is_buried(path):
+        if not validate_path(src_path).is_dir():
+            logger.info(f"Folder '{path}' was recently deleted by the watcher, it will not be created again.")
+            return False
+        # deleted, then created again locally: not an event still in flight for the deleted folder
+        logger.info(f"Folder '{path}' was recently deleted but exists again locally, creating it again.")
+        folder_cache.unbury(path)
+    if folder_cache.has_failed(path):
+        logger.info(f"Creating the folder '{path}' failed recently, skipping.")
+        return False
     email = get_email(src_path)
     budget = get_budget_name(src_path)
     parent_path_and_id = find_parent_folder(path=path, keyword=keyword, email=email)
+    if breaker.saw_outage():
+        # a lookup that failed does not prove the folders missing, the parked event creates them once replayed
+        return False
 
     if parent_path_and_id is None:
         logger.info(f"System has been unable to identify a valid parent directory. It will now endeavor to generate"
                     f" a directory with an undefined parent entity.")
-        name = path.parts[path.parts.index(email) + 1]
-        resp: Response = create_folder(name=name, budget_id=budget, parent=None, email=email)
-        if resp.status_code == 201:
-            logger.info(f"Successfully created the folder '{name}'.")
-            return on_folder_created(src_path, keyword)
-        else:
-            logger.error(f"Error encountered while attempting to create the folder"
-                         f" '{name}'. {f'CONTENT: {resp.content}' if len(resp.content) < 500 else f'OK: {resp.ok}'}")
+        budget_path = Path(*path.parts[:path.parts.index(email) + 2])
+        budget_pk = flights.do(('create', budget_path.__str__()), create_missing_folder, budget_path, budget, email,
+                               None)
+        if not budget_pk:
+            mark_failed(path)
             return False
+        if path == budget_path:
+            return True
+        # the folders below the budget are created from it, the tenant folder above it never exists remotely
+        parent_path_and_id = (budget_path, budget_pk)
 
         # Create list of paths starting from parent to child
-    paths_to_create = [parent_path_and_id[0] / part for part in path.relative_to(parent_path_and_id[0]).parts]
+    relative_parts = path.relative_to(parent_path_and_id[0]).parts
+    paths_to_create = [parent_path_and_id[0].joinpath(*relative_parts[:index + 1])
+                       for index in range(len(relative_parts))]
 
+    parent_pk: str = parent_path_and_id[1]
     for current_path in paths_to_create:
-        if not folder_already_exists(current_path):
-            resp: Response = create_folder(name=current_path.name, budget_id=budget, email=email,
-                                           parent=parent_path_and_id[1])
-            if resp.status_code == 201:
-                logger.info(f"Successfully created the folder '{current_path.name}'.")
-                # update parent_path_and_id for the new parent
-                parent_path_and_id = (current_path, resp.json().get('id'))
-            else:
-                logger.error(
-                    f"Error encountered while attempting to create the folder '{current_path.name}'. {resp.text}")
-                return False
+        folder_pk = find_folder(current_path, is_src_path=False)
+        if folder_pk is None and not breaker.saw_outage():
+            folder_pk = flights.do(('create', current_path.__str__()), create_missing_folder, current_path, budget,
+                                   email, parent_pk)
+        parent_pk = folder_pk
+        if parent_pk is None:
+            mark_failed(path)
+            return False
 
     return True
+
+
+def mark_failed(path: Path):
+    # an event that failed because the storage API is down is parked, and must not be refused when it is replayed
+    if not breaker.saw_outage():
+        folder_cache.mark_failed(path)
@@ -3,6 +3,8 @@ import re
 from pathlib import Path
 from typing import Union, Optional
 
+from utilities.roots import root_for
+
 logger = logging.getLogger(__name__)
 
 
@@ -12,8 +14,10 @@ def validate_path(path: Union[str, Path]) -> Path:
     return path.resolve()
 
 
-def get_path_after_keyword(path: Union[str, Path], keyword: str = "mofreitas") -> Optional[Path]:
+def get_path_after_keyword(path: Union[str, Path], keyword: Optional[str] = None) -> Optional[Path]:
+    """The remote path of a local path, from the keyword of its watch root on, e.g. 'mofreitas/clientes/...'."""
     try:
+        keyword = keyword or root_for(path).keyword
         path = validate_path(path)
         path = Path(*path.parts[path.parts.index(keyword):])
         logger.info(f"Extracted the Path: {path}")
@@ -23,16 +27,37 @@ def get_path_after_keyword(path: Union[str, Path], keyword: str = "mofreitas") -
                      f"reference path. {error}")
 
 
-def get_email(path: Union[str, Path], keyword: str = "clientes") -> str:
+def get_email(path: Union[str, Path], keyword: Optional[str] = None) -> str:
+    keyword = keyword or root_for(path).tenants
     path = validate_path(path)
     return path.parts[path.parts.index(keyword) + 1]
 
 
-def get_budget_name(path: Union[str, Path], keyword: str = "clientes") -> str:
+def get_budget_name(path: Union[str, Path], keyword: Optional[str] = None) -> str:
+    keyword = keyword or root_for(path).tenants
     path = validate_path(path)
     return path.parts[path.parts.index(keyword) + 2]
 
 
+def get_budget_path(path: Union[str, Path], keyword: Optional[str] = None) -> Optional[Path]:
+    """Returns the path up to the budget folder, e.g. 'mofreitas/clientes/<email>/<budget>', or None."""
+    keyword = keyword or root_for(path).tenants
+    parts = Path(path).parts
+    if keyword not in parts or len(parts) < parts.index(keyword) + 3:
+        return None
+    return Path(*parts[:parts.index(keyword) + 3])
+
+
+def tenant_key(path: str, keyword: Optional[str] = None) -> str:
+    """Returns the 'clientes/<email>' prefix of a path, or an empty string for paths outside of any tenant."""
+    keyword = keyword or root_for(path).tenants
+    parts = Path(path).parts
+    if keyword not in parts or len(parts) < parts.index(keyword) + 2:
+        return ''
+    index = parts.index(keyword)
+    return f"{parts[index]}/{parts[index + 1]}"
+
+
 def verify(source_path: Path, reference: str = 'Lists_and_Tags') -> bool:
     """
         Verifies if the given source_path contains the specified reference directory
@@ -1,12 +1,19 @@
 import functools
 import logging.config
-import os
+import threading
 from pathlib import Path
 from queue import Queue
-from typing import Union
-
-from utilities.funtions import validate_path
-from watchdog.events import FileSystemEvent, FileModifiedEvent, FileCreatedEvent
+from typing import Optional, Union
+
+from utilities import folders
+from utilities.control import pauses
+from utilities.funtions import validate_path, get_budget_path
+from utilities.metrics import metrics
+from utilities.roots import root_for
+from utilities.status import sync_status
+from utilities.walker import walker, ScanCheckpoint
+from utilities.events import EventRecord, EventType
+from watchdog.events import FileSystemEvent, FileCreatedEvent
 from watchdog.events import FileSystemEventHandler
 
 import settings
@@ -16,20 +23,22 @@ logger = logging.getLogger(__name__)
 
 class EventHandler(FileSystemEventHandler):
     def __init__(self, event_queue: Queue, delayed_scan_queue: Queue, directories_in_queue: Union[Queue, set, list],
-                 process_and_scan: bool = True, *args, **kwargs):
+                 process_and_scan: bool = True, prefetch: bool = settings.PREFETCH_BUDGETS, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.event_queue = event_queue
         self.delayed_scan_queue = delayed_scan_queue
         self.directories_in_queue = directories_in_queue
         self.process_and_scan = process_and_scan
+        self.prefetch = prefetch
+        self.seen_budgets = set()
         logger.info(f"------------- FILE FINDER INITIALIZED -------------")
 
     @staticmethod
-    @functools.cache
+    @functools.lru_cache(maxsize=settings.PATH_CACHE_SIZE)
     def parse_path(path: str) -> Path:
         return Path(path).resolve()
 
-    @functools.cache
+    @functools.lru_cache(maxsize=settings.PATH_CACHE_SIZE)
     def is_valid_path(self, path: Path) -> bool:
         """
                 Verifies if the given source_path contains the specified reference directory
@@ -48,17 +57,22 @@ class EventHandler(FileSystemEventHandler):
         path = validate_path(path)
         if path.is_dir():
             return False
-        if settings.KEY_PATH not in path.parts:
+        keyword: str = root_for(path).keyword
+        if keyword not in path.parts:
             return False
-        current_path = Path(*path.parts[path.parts.index(settings.KEY_PATH):])
+        current_path = Path(*path.parts[path.parts.index(keyword):])
         while current_path != current_path.parent:  # Stop when reaching the root directory
-            if current_path.name == settings.KEY_PATH:
+            if current_path.name == keyword:
                 return True
             current_path = current_path.parent
         return False
 
-    def add_to_event_queue(self, event: FileSystemEvent, event_type: str):
-        self.event_queue.put((event, event_type))
+    def add_to_event_queue(self, record: EventRecord):
+        if pauses.hold(record):
+            return
+        metrics.add(record.src_path, 'events')
+        sync_status.started(record.src_path, record.queued_at)
+        self.event_queue.put(record)
 
     def add_to_dir_queue(self, path: Path):
         if not path.is_dir():
@@ -67,35 +81,43 @@ class EventHandler(FileSystemEventHandler):
             self.directories_in_queue.add(path)
             self.delayed_scan_queue.put(path)
 
-    def add_to_queue(self, event: FileSystemEvent, event_type: str) -> None:
+    def prefetch_budget(self, path: Path):
+        """Starts listing the remote folders of a budget the first time one of its events is seen."""
+        budget: Optional[Path] = get_budget_path(path)
+        if budget is None or budget in self.seen_budgets:
+            return
+        self.seen_budgets.add(budget)
+        logger.info(f"First event for budget '{budget}', prefetching its folders.")
+        threading.Thread(target=folders.prefetch_budget, args=(budget,), daemon=True).start()
+
+    def add_to_queue(self, event: FileSystemEvent, event_type: EventType) -> None:
         file_path: Path = self.parse_path(event.src_path)
         dir_path = file_path.parent
         if self.is_valid_path(file_path):
-            logger.info(f"'{event_type.upper()}' event triggered for 'file': {event.src_path}")
+            logger.info(f"'{event_type.name}' event triggered for 'file': {event.src_path}")
+            if self.prefetch:
+                self.prefetch_budget(file_path)
             self.add_to_dir_queue(dir_path)
             if self.process_and_scan:
-                self.add_to_event_queue(event, event_type)
+                self.add_to_event_queue(EventRecord.from_event(event, event_type))
 
     def on_created(self, event: FileCreatedEvent):
-        self.add_to_queue(event, 'created')
+        self.add_to_queue(event, EventType.CREATED)
 
     def on_modified(self, event: FileSystemEvent):
-        self.add_to_queue(event, 'modified')
+        self.add_to_queue(event, EventType.MODIFIED)
 
     def on_moved(self, event):
-        self.add_to_queue(event, 'moved')
+        self.add_to_queue(event, EventType.MOVED)
 
     def on_deleted(self, event):
-        self.add_to_queue(event, 'deleted')
+        self.add_to_queue(event, EventType.DELETED)
 
-    def scan_directory(self, directory):
+    def scan_directory(self, directory, checkpoint: Optional[ScanCheckpoint] = None):
         logger.info(f"Scanning directory: {directory}")
-        for root, dirs, files in os.walk(directory):
-            for file in files:
-                path = Path(os.path.join(root, file))
-                logger.info(f"Found file: ... {path.parent}/{path.name}")
-                event = FileModifiedEvent(path)
-                if event.event_type == 'deleted':
-                    continue
-                if not path.__str__().endswith('tmp') and not path.__str__().startswith('syncthing'):
-                    self.add_to_event_queue(event, event_type=event.event_type)
+        found = 0
+        for entry in walker.walk(directory, checkpoint=checkpoint):
+            logger.debug(f"Found file: ... {entry.path}")
+            self.add_to_event_queue(EventRecord(EventType.MODIFIED, entry.path))
+            found += 1
+        logger.info(f"Scanned directory: {directory}, {found} files queued.")
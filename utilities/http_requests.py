@@ -1,26 +1,44 @@
 import logging.config
-
+import threading
+from typing import Optional
 from urllib import parse
 
 import requests
 from requests import Response
+from requests.adapters import HTTPAdapter
 
 import settings
 from client import oauth
+from utilities import tracing
+from utilities.breaker import breaker, is_outage, CircuitOpenError
 
 logger = logging.getLogger(__name__)
 
+# one pool of connections for every watch root and worker
 session = requests.Session()
 session.auth = oauth
+session.mount('http://', HTTPAdapter(pool_maxsize=settings.HTTP_POOL_SIZE))
+session.mount('https://', HTTPAdapter(pool_maxsize=settings.HTTP_POOL_SIZE))
+
+# last failed request of the current thread, the reason reported when its job fails
+_local = threading.local()
+
+
+def last_failure() -> Optional[str]:
+    return getattr(_local, 'failure', None)
+
+
+def clear_failure():
+    _local.failure = None
 
 
 def test_connection() -> bool:
     try:
-        response = session.get(ends_with_slash(settings.URL))
+        response = send('GET', ends_with_slash(settings.URL))
         response.raise_for_status()  # raise an exception if the status code is not 200
         logger.info('Connection succeeded.')
         return True
-    except requests.exceptions.HTTPError as err:
+    except requests.exceptions.RequestException as err:
         logger.error(f'Connection failed: {err}')
         return False
 
@@ -43,7 +61,34 @@ def make_request(method: str, relative_url: str, pk: str = None, params=None, **
     url = parse.urljoin(ends_with_slash(settings.URL), normalize_relative_url(relative_url))
     if pk:
         url += ends_with_slash(pk.__str__())
-    return session.request(method, url, params=params, **kwargs)
+    return send(method, url, params=params, **kwargs)
+
+
+def send(method: str, url: str, params=None, **kwargs) -> Response:
+    """
+    Sends a request to an absolute url, such as the 'next' link of a paginated response.
+
+    Every request goes through the circuit breaker: while the storage API is down ``CircuitOpenError`` is raised
+    without waiting for a timeout.
+    """
+    if not breaker.allow():
+        _local.failure = f"{method} {parse.urlsplit(url).path}: the circuit is open, the storage API is down"
+        raise CircuitOpenError(f"Circuit open, not sending {method} {url}.")
+    kwargs.setdefault('timeout', settings.REQUEST_TIMEOUT)
+    with tracing.span('http', method=method, path=parse.urlsplit(url).path) as span:
+        try:
+            response = session.request(method, url, params=params, **kwargs)
+        except Exception as error:
+            breaker.record(is_outage(error=error))
+            _local.failure = f"{method} {parse.urlsplit(url).path}: {type(error).__name__}: {error}"
+            raise
+        breaker.record(is_outage(response))
+        if response.status_code >= 400:
+            _local.failure = f"{method} {parse.urlsplit(url).path}: HTTP {response.status_code} {response.text[:200]}"
+        if span is not None:
+            span.set(status=response.status_code, bytes_sent=int(response.request.headers.get('Content-Length') or 0),
+                     bytes_received=len(response.content))
+    return response
 
 
 def get(relative_url, params=None) -> Response:
@@ -0,0 +1,176 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, Hashable, List
+
+import settings
+from utilities import tracing
+
+logger = logging.getLogger(__name__)
+
+# Sentinel object for termination
+sentinel = object()
+
+
+class RateLimiter:
+    """
+    Token bucket limiting the number of bytes per second. A rate of 0 disables the limit.
+
+    A caller may take more than the bucket holds; the bucket then goes into debt and later callers wait until it is
+    paid back, so the average rate is honoured even for files larger than one second of budget.
+    """
+
+    def __init__(self, rate: int):
+        self.rate = rate
+        self._allowance = float(rate)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate: int):
+        with self._lock:
+            self.rate = rate
+            self._allowance = min(self._allowance, float(rate))
+
+    def acquire(self, amount: int):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(float(self.rate), self._allowance + (now - self._last) * self.rate)
+            self._last = now
+            self._allowance -= amount
+            wait = -self._allowance / self.rate if self._allowance < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+
+
+class Lane:
+    """
+    A fixed group of worker threads fed by a bounded queue.
+
+    ``submit`` blocks once ``max_pending`` jobs are waiting, which pushes back on whoever feeds the lane instead of
+    letting the backlog grow without limit. ``resize`` changes the number of workers of a running lane.
+
+    Jobs submitted with ``submit_ordered`` and the same key run one at a time, in the order they were submitted, on
+    whichever worker is free; jobs of different keys still run concurrently.
+    """
+
+    def __init__(self, name: str, workers: int, max_pending: int = 0):
+        self.name = name
+        self.workers = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._threads: List[threading.Thread] = list()
+        self._lock = threading.Lock()
+        self._retiring = 0
+        self._spawned = 0
+        # ordered jobs: the next sequence number of every key, the one to run next, and the ones dequeued too early
+        self._submitted: Dict[Hashable, int] = dict()
+        self._next: Dict[Hashable, int] = dict()
+        self._early: Dict[Hashable, Dict[int, tuple]] = dict()
+        self._ordering = threading.Lock()
+        self.resize(workers)
+
+    def resize(self, workers: int):
+        """Starts workers, or lets the extra ones exit once they are done with their current job."""
+        if workers < 1:
+            raise ValueError(f"A lane needs at least one worker, not {workers}.")
+        with self._lock:
+            alive = len(self._threads) - self._retiring
+            # workers about to retire are kept rather than replaced
+            kept = min(self._retiring, max(workers - alive, 0))
+            self._retiring -= kept
+            alive += kept
+            for _ in range(workers - alive):
+                thread = threading.Thread(target=self._work, name=f"{self.name}-lane-{self._spawned}", daemon=True)
+                self._spawned += 1
+                thread.start()
+                self._threads.append(thread)
+            self._retiring += max(alive - workers, 0)
+            self.workers = workers
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        future = Future()
+        # the job continues the trace of the event that submitted it
+        self._queue.put((future, tracing.current(), fn, args, kwargs))
+        return future
+
+    def submit_ordered(self, key: Hashable, fn: Callable, *args, **kwargs) -> Future:
+        """Like ``submit``, but the job starts only once the jobs submitted before it with the same key are done."""
+        future = Future()
+        with self._ordering:
+            sequence = self._submitted.get(key, 0)
+            self._submitted[key] = sequence + 1
+            self._next.setdefault(key, 0)
+        self._queue.put((future, tracing.current(), fn, args, kwargs, key, sequence))
+        return future
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def shutdown(self):
+        threads = list(self._threads)
+        for _ in threads:
+            self._queue.put(sentinel)
+        for thread in threads:
+            thread.join()
+
+    def _retire(self) -> bool:
+        with self._lock:
+            if not self._retiring:
+                return False
+            self._retiring -= 1
+            self._threads.remove(threading.current_thread())
+            return True
+
+    def _work(self):
+        while not self._retire():
+            try:
+                # idle workers wake up now and then, in case the lane shrank
+                job = self._queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            if job is sentinel:
+                break
+            if len(job) == 5:
+                self._run(*job)
+            else:
+                self._run_ordered(job)
+
+    def _run(self, future: Future, span, fn: Callable, args: tuple, kwargs: dict):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            with tracing.attach(span):
+                future.set_result(fn(*args, **kwargs))
+        except BaseException as error:
+            logger.error(f"Job {getattr(fn, '__name__', fn)} failed on the {self.name} lane: {error}")
+            future.set_exception(error)
+
+    def _run_ordered(self, job: tuple):
+        key, sequence = job[5:]
+        with self._ordering:
+            if sequence != self._next[key]:
+                # an earlier job of the key is still queued or running, whoever runs it runs this one next
+                self._early.setdefault(key, dict())[sequence] = job
+                return
+        while job is not None:
+            self._run(*job[:5])
+            with self._ordering:
+                sequence += 1
+                self._next[key] = sequence
+                job = self._early.get(key, dict()).pop(sequence, None)
+                if job is None and self._submitted[key] == sequence:
+                    # nothing left for the key, its state is dropped until it is used again
+                    del self._submitted[key], self._next[key]
+                    self._early.pop(key, None)
+
+
+# Latency bound: folder lookups, folder creation, renames and deletes.
+metadata_lane = Lane('metadata', settings.METADATA_WORKERS, max_pending=settings.LANE_MAX_PENDING)
+
+# Bandwidth bound: file uploads only.
+upload_lane = Lane('upload', settings.UPLOAD_WORKERS, max_pending=settings.LANE_MAX_PENDING)
+
+upload_limiter = RateLimiter(settings.UPLOAD_RATE_LIMIT)
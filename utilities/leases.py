@@ -0,0 +1,231 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+import settings
+from utilities.events import EventRecord
+from utilities.manifest import manifest
+from utilities.shards import shard_of
+from utilities.status import sync_status
+
+logger = logging.getLogger(__name__)
+
+
+def read_json(path: Path) -> Optional[dict]:
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(path: Path, content: dict):
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(content))
+    os.replace(tmp, path)
+
+
+class Leases:
+    """
+    Partitions the tenants between several watchers sharing WATCHING_DIR, through lease files in ``directory``.
+
+    Tenants ('clientes/<email>') are hashed into ``shards`` shards, as in utilities/shards.py, and a watcher only
+    processes the events of the shards it holds a lease on. Every ``interval`` seconds a watcher writes its node file,
+    renews its leases and claims free or expired ones until it holds its fair share of the shards among the live
+    nodes; above its share it removes the files of the extra leases, which another node claims on its next tick. A
+    node that died stops renewing, so its shards are taken over within ``ttl`` seconds.
+
+    Only an ``O_EXCL`` creation grants a lease. An expired lease is first renamed aside, which a single node can do,
+    and checked again before the new lease is created, so two nodes never both hold a shard, provided their clocks
+    agree to well within ``ttl``. A lease is renewed in place only while it has more than a third of ``ttl`` to run,
+    checked after reading it, so a node paused between the read and the write cannot overwrite the lease of a node
+    that took the shard over meanwhile; closer to its expiry, it is claimed again like a free one.
+
+    On taking a shard over, the node adopts the manifest entries of the previous holder (when its manifest file is
+    readable, e.g. DATA_DIR on the shared volume) and calls the ``on_acquire`` listeners, e.g. to rescan the tenants
+    of the shard for what changed while no one held it.
+    """
+
+    def __init__(self, directory: Union[str, Path], node: str, shards: int = 64, ttl: float = 30,
+                 interval: float = 5):
+        self.directory = Path(directory)
+        self.node = node
+        self.shards = shards
+        self.ttl = ttl
+        self.interval = interval
+        self.margin = ttl / 3
+        self.held: Dict[int, float] = dict()
+        self.live_nodes: List[str] = list()
+        self.skipped = 0
+        self.on_acquire: List[Callable[[int], None]] = list()
+        self._lock = threading.Lock()
+
+    def lease_path(self, shard: int) -> Path:
+        return self.directory.joinpath(f"shard-{shard}.lease")
+
+    def owns(self, path: str) -> bool:
+        """True when the event of ``path`` is this node's to process."""
+        return shard_of(path, self.shards) in self.held
+
+    def start(self):
+        """Claims this node's share before returning, so the events seen from now on are partitioned."""
+        self.directory.joinpath('nodes').mkdir(parents=True, exist_ok=True)
+        self.tick()
+        threading.Thread(target=self._run, name='leases', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.tick()
+            except OSError as error:
+                logger.error(f"Unable to renew the leases in '{self.directory}': {error}")
+
+    def tick(self):
+        with self._lock:
+            now = time.time()
+            # the manifest travels with the leases, it must be on disk before another node may take one over
+            manifest.save()
+            write_json(self.directory.joinpath('nodes', f"{self.node}.json"),
+                       dict(node=self.node, heartbeat=now, held=sorted(self.held)))
+            self.live_nodes = self.read_live_nodes(now)
+            target = math.ceil(self.shards / max(len(self.live_nodes), 1))
+            for shard in list(self.held):
+                self.renew(shard)
+            extra = sorted(self.held)[target:]
+            if extra:
+                logger.info(f"Releasing {len(extra)} shards to rebalance over {len(self.live_nodes)} nodes: {extra}")
+                for shard in extra:
+                    self.release(shard)
+            for shard in range(self.shards):
+                if len(self.held) >= target:
+                    break
+                if shard not in self.held:
+                    self.claim(shard, now)
+
+    def read_live_nodes(self, now: float) -> List[str]:
+        live = list()
+        for path in self.directory.joinpath('nodes').glob('*.json'):
+            content = read_json(path)
+            if content and now - content.get('heartbeat', 0) < self.ttl:
+                live.append(content['node'])
+        return sorted(live)
+
+    def content(self, now: float) -> dict:
+        return dict(node=self.node, expires_at=now + self.ttl, manifest=os.fspath(manifest.path.resolve()))
+
+    def renew(self, shard: int):
+        path = self.lease_path(shard)
+        current = read_json(path)
+        if current is None or current.get('node') != self.node:
+            logger.error(f"Lost the lease on shard {shard}, its events are left to the node holding it now.")
+            del self.held[shard]
+            return
+        # the clock is read after the lease: however long this node was paused, the lease is still its own for
+        # another margin seconds when it is written
+        now = time.time()
+        if now >= self.held[shard] - self.margin:
+            logger.warning(f"The lease on shard {shard} is too close to its expiry to renew, claiming it again.")
+            del self.held[shard]
+            return
+        content = self.content(now)
+        write_json(path, content)
+        self.held[shard] = content['expires_at']
+
+    def release(self, shard: int):
+        """Gives up a held shard: its lease file is removed, so that another node may claim it at once."""
+        del self.held[shard]
+        try:
+            os.remove(self.lease_path(shard))
+        except FileNotFoundError:
+            pass
+
+    def claim(self, shard: int, now: float) -> bool:
+        path = self.lease_path(shard)
+        previous = read_json(path)
+        if previous is not None:
+            # a lease of this node name is from before a restart and can be taken back at once
+            if previous.get('node') != self.node and previous.get('expires_at', 0) > now:
+                return False
+            stale = path.with_name(f".{path.name}.{self.node}.stale")
+            try:
+                os.rename(path, stale)
+            except FileNotFoundError:
+                return False
+            previous = read_json(stale)
+            if previous and previous.get('node') != self.node and previous.get('expires_at', 0) > now:
+                # renewed between the two reads, put it back
+                try:
+                    os.link(stale, path)
+                except FileExistsError:
+                    pass
+                os.remove(stale)
+                return False
+            os.remove(stale)
+        content = self.content(now)
+        try:
+            with os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644), 'w') as file:
+                json.dump(content, file)
+        except FileExistsError:
+            return False
+        self.held[shard] = content['expires_at']
+        logger.info(f"Acquired the lease on shard {shard}" + (f" from {previous.get('node')}." if previous else "."))
+        self.acquired(shard, previous)
+        return True
+
+    def acquired(self, shard: int, previous: Optional[dict]):
+        source = previous.get('manifest') if previous else None
+        if source and source != os.fspath(manifest.path.resolve()) and Path(source).is_file():
+            manifest.adopt(source, lambda path: shard_of(path, self.shards) == shard)
+        for listener in self.on_acquire:
+            try:
+                listener(shard)
+            except Exception as error:
+                logger.error(f"Listener of shard {shard} failed: {error}")
+
+    def owned(self, dispatch: Callable[[EventRecord], object]) -> Callable[[EventRecord], object]:
+        """Wraps the dispatch of the backlog: parked events of a shard handed over since are left to its new holder."""
+        def dispatch_owned(event: EventRecord):
+            if self.owns(event.src_path):
+                return dispatch(event)
+            sync_status.discard(event.src_path)
+            self.skipped += 1
+
+        return dispatch_owned
+
+    def tenants(self, root: Union[str, Path], shard: int) -> List[Path]:
+        """The tenant folders of ``root`` ('.../clientes') that belong to ``shard``."""
+        root = Path(root)
+        if not root.is_dir():
+            return list()
+        return [entry for entry in root.iterdir()
+                if entry.is_dir() and shard_of(os.fspath(entry), self.shards) == shard]
+
+    def status(self) -> dict:
+        return dict(node=self.node, held=sorted(self.held), live_nodes=self.live_nodes, skipped=self.skipped)
+
+
+class OwnedEvents:
+    """Event sink passing on the events of the shards this node holds, in front of the queue of the engine."""
+
+    def __init__(self, events, leases: Leases):
+        self.events = events
+        self.leases = leases
+
+    def put(self, event: EventRecord):
+        if self.leases.owns(event.src_path):
+            self.events.put(event)
+        else:
+            sync_status.discard(event.src_path)
+            self.leases.skipped += 1
+
+    def qsize(self) -> int:
+        return self.events.qsize()
+
+
+leases = Leases(settings.LEASE_DIR, node=settings.NODE_NAME, shards=settings.LEASE_SHARDS, ttl=settings.LEASE_TTL,
+                interval=settings.LEASE_INTERVAL)
@@ -0,0 +1,129 @@
+import logging
+import math
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque, Dict, Iterator, NamedTuple, Optional
+from urllib import parse
+
+import requests
+from requests import Response
+
+import settings
+from utilities.http_requests import get, send
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=max(settings.LISTING_PREFETCH, 1), thread_name_prefix='listing')
+
+
+class FolderRecord(NamedTuple):
+    id: str
+    name: Optional[str]
+    path: Optional[str]
+    parent: Optional[str]
+
+    @classmethod
+    def from_result(cls, result: Dict) -> 'FolderRecord':
+        return cls(result.get('id'), result.get('name'), result.get('path'), result.get('parent'))
+
+
+class FileRecord(NamedTuple):
+    id: str
+    file_name: Optional[str]
+    folder: Optional[str]
+
+    @classmethod
+    def from_result(cls, result: Dict) -> 'FileRecord':
+        return cls(result.get('id'), result.get('file_name'), result.get('folder'))
+
+
+def read_page(response: Response) -> Dict:
+    if not response.status_code == 200:
+        msg: str = f"Error {response.status_code}: Unable to establish communication with the server."
+        logger.error(msg)
+        raise requests.RequestException(msg)
+    return response.json()
+
+
+def fetch_page(relative_url: str, params: Optional[dict] = None) -> Dict:
+    return read_page(get(relative_url=relative_url, params=params))
+
+
+def fetch_url(url: str) -> Dict:
+    return read_page(send('GET', url))
+
+
+def page_urls(next_url: str, count: int, page_size: int) -> Optional[Iterator[str]]:
+    """
+    Builds the urls of every remaining page from the first 'next' link, for page number and limit/offset pagination.
+    Returns None for other schemes (e.g. cursors), which can only be followed one page at a time.
+    """
+    parts = parse.urlsplit(next_url)
+    query = dict(parse.parse_qsl(parts.query))
+
+    def build(**changes) -> str:
+        return parse.urlunsplit(parts._replace(query=parse.urlencode({**query, **changes})))
+
+    if 'page' in query:
+        first = int(query['page'])
+        last = math.ceil(count / page_size)
+        return (build(page=page) for page in range(first, last + 1))
+    if 'offset' in query:
+        first, limit = int(query['offset']), int(query.get('limit', page_size))
+        return (build(offset=offset) for offset in range(first, count, limit))
+    return None
+
+
+def iterate(relative_url: str, params: Optional[dict] = None, record: Callable[[Dict], object] = dict,
+            prefetch: int = 0) -> Iterator:
+    """
+    Streams every result of a paginated endpoint, following the 'next' links.
+
+    Args:
+        relative_url (str): The endpoint, e.g. '/storages/folder/'.
+        params (Optional[dict]): Filters of the first request; the 'next' links carry them on.
+        record (Callable[[Dict], object]): Converts each result, e.g. ``FolderRecord.from_result``.
+        prefetch (int): Pages fetched ahead concurrently. Only one page is held per request in flight, so memory does
+            not grow with the size of the listing.
+
+    Yields:
+        Each result converted by ``record``.
+    """
+    content = fetch_page(relative_url, params=params)
+    results = content.get('results') or list()
+    next_url: Optional[str] = content.get('next')
+    urls = page_urls(next_url, content.get('count') or 0, len(results)) if next_url and prefetch and results else None
+    for result in results:
+        yield record(result)
+
+    if urls is None:
+        while next_url:
+            content = fetch_url(next_url)
+            for result in content.get('results') or list():
+                yield record(result)
+            next_url = content.get('next')
+        return
+
+    in_flight: Deque[Future] = deque()
+    try:
+        for url in urls:
+            in_flight.append(_executor.submit(fetch_url, url))
+            if len(in_flight) <= prefetch:
+                continue
+            for result in in_flight.popleft().result().get('results') or list():
+                yield record(result)
+        while in_flight:
+            for result in in_flight.popleft().result().get('results') or list():
+                yield record(result)
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+
+def list_folders(params: dict) -> Iterator[FolderRecord]:
+    return iterate('/storages/folder/', params=params, record=FolderRecord.from_result,
+                   prefetch=settings.LISTING_PREFETCH)
+
+
+def list_files(params: dict) -> Iterator[FileRecord]:
+    return iterate('/storages/file/', params=params, record=FileRecord.from_result, prefetch=settings.LISTING_PREFETCH)
@@ -0,0 +1,253 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, NamedTuple, Optional, Set, Union
+
+import settings
+from utilities.startup import startup
+
+logger = logging.getLogger(__name__)
+
+
+class Fingerprint(NamedTuple):
+    size: int
+    mtime_ns: int
+    inode: int
+    digest: str
+    # id of the file on the server and time of the upload, once uploaded
+    pk: Optional[str] = None
+    synced_at: float = 0
+
+    def same_stat(self, other: 'Fingerprint') -> bool:
+        return (self.size, self.mtime_ns, self.inode) == (other.size, other.mtime_ns, other.inode)
+
+
+class Manifest:
+    """
+    Local record of the fingerprint of every file at its last successful upload.
+
+    Fingerprints are computed on a small thread pool so hashing overlaps with the folder lookups of the same upload.
+    When size, mtime and inode are unchanged the stored digest is reused without reading the file again.
+
+    The manifest of the previous run is read in the background (``start_loading``), so the daemon arms its observer
+    meanwhile; the calls that read or change the entries wait for it, and start it when nothing did.
+    """
+
+    def __init__(self, path: Union[str, Path], workers: int = 2, chunk_size: int = 1024 * 1024,
+                 save_every: int = 100):
+        self.path = Path(path)
+        self.chunk_size = chunk_size
+        self.save_every = save_every
+        self.files: Dict[str, Fingerprint] = dict()
+        # folders whose files already on the server were recorded, see ``seed``
+        self.seeded: Set[str] = set()
+        self.bytes_saved = 0
+        self.uploads_skipped = 0
+        self._lock = threading.Lock()
+        self._dirty = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hasher')
+        self.loaded = threading.Event()
+        self._loader: Optional[threading.Thread] = None
+
+    def start_loading(self):
+        with self._lock:
+            if self._loader is None:
+                self._loader = threading.Thread(target=self.load, name='manifest-load', daemon=True)
+                self._loader.start()
+
+    def wait_loaded(self):
+        if not self.loaded.is_set():
+            self.start_loading()
+            self.loaded.wait()
+
+    def load(self):
+        try:
+            self._load()
+        finally:
+            self.loaded.set()
+            startup.reached('manifest_loaded')
+
+    def _load(self):
+        if not self.path.is_file():
+            return
+        try:
+            content = json.loads(self.path.read_text())
+            files = {path: Fingerprint(*values) for path, values in content.get('files', dict()).items()}
+        except (ValueError, TypeError) as error:
+            logger.error(f"Unable to load the manifest '{self.path}': {error}")
+            return
+        with self._lock:
+            self.files = files
+            self.seeded = set(content.get('seeded', list()))
+            self.bytes_saved = content.get('bytes_saved', 0)
+            self.uploads_skipped = content.get('uploads_skipped', 0)
+        logger.info(f"Loaded {len(files)} entries from the manifest '{self.path}'.")
+
+    def adopt(self, path: Union[str, Path], accept: Callable[[str], bool]) -> int:
+        """
+        Copies the entries of another manifest for which ``accept`` holds, e.g. a worker process starting from the
+        files of its tenants in the manifest of the single-process engines.
+
+        Returns:
+            int: The number of entries copied.
+        """
+        self.wait_loaded()
+        try:
+            content = json.loads(Path(path).read_text())
+            files = {path: Fingerprint(*values) for path, values in content.get('files', dict()).items()
+                     if accept(path)}
+            seeded = {folder for folder in content.get('seeded', list()) if accept(folder)}
+        except (OSError, ValueError, TypeError) as error:
+            logger.error(f"Unable to adopt the manifest '{path}': {error}")
+            return 0
+        with self._lock:
+            self.files.update(files)
+            self.seeded.update(seeded)
+            self._dirty += len(files)
+        logger.info(f"Adopted {len(files)} entries from the manifest '{path}'.")
+        return len(files)
+
+    def save(self):
+        self.wait_loaded()
+        with self._lock:
+            if not self._dirty:
+                return
+            content = dict(files=self.files, seeded=sorted(self.seeded), bytes_saved=self.bytes_saved,
+                           uploads_skipped=self.uploads_skipped)
+            data = json.dumps(content)
+            self._dirty = 0
+        tmp = self.path.with_suffix('.tmp')
+        try:
+            tmp.write_text(data)
+            os.replace(tmp, self.path)
+        except OSError as error:
+            logger.error(f"Unable to save the manifest '{self.path}': {error}")
+
+    def hash_file(self, path: Path) -> str:
+        digest = hashlib.sha256()
+        buffer = bytearray(self.chunk_size)
+        view = memoryview(buffer)
+        with path.open('rb', buffering=0) as file:
+            while True:
+                size = file.readinto(buffer)
+                if not size:
+                    break
+                digest.update(view[:size])
+        return digest.hexdigest()
+
+    def fingerprint(self, path: Union[str, Path]) -> Fingerprint:
+        path = Path(path)
+        stat = path.stat()
+        self.wait_loaded()
+        known = self.files.get(path.__str__())
+        if known is not None and (known.size, known.mtime_ns, known.inode) == (stat.st_size, stat.st_mtime_ns,
+                                                                               stat.st_ino):
+            return known
+        return Fingerprint(stat.st_size, stat.st_mtime_ns, stat.st_ino, self.hash_file(path))
+
+    def refresh(self, path: Union[str, Path], fingerprint: Fingerprint) -> Fingerprint:
+        """The fingerprint, taken again when the file changed since, e.g. while the file was being written."""
+        path = Path(path)
+        stat = path.stat()
+        current = Fingerprint(stat.st_size, stat.st_mtime_ns, stat.st_ino, fingerprint.digest)
+        if current.same_stat(fingerprint):
+            return fingerprint
+        return current._replace(digest=self.hash_file(path))
+
+    def fingerprint_async(self, path: Union[str, Path]) -> 'Future[Fingerprint]':
+        return self._executor.submit(self.fingerprint, path)
+
+    def is_unchanged(self, path: Union[str, Path], fingerprint: Fingerprint) -> bool:
+        self.wait_loaded()
+        known: Optional[Fingerprint] = self.files.get(path.__str__())
+        return known is not None and known.size == fingerprint.size and known.digest == fingerprint.digest
+
+    def record(self, path: Union[str, Path], fingerprint: Fingerprint):
+        self.wait_loaded()
+        with self._lock:
+            self.files[path.__str__()] = fingerprint
+            self._dirty += 1
+        self._save_if_needed()
+
+    def is_seeded(self, folder: Union[str, Path]) -> bool:
+        self.wait_loaded()
+        return folder.__str__() in self.seeded
+
+    def seed(self, folder: Union[str, Path], files: Dict[str, Fingerprint]):
+        """
+        Records the files of ``folder`` the server holds already, e.g. on the first run, when the manifest is empty and
+        every file would otherwise look new. The entries recorded since, by uploads, are kept.
+        """
+        self.wait_loaded()
+        with self._lock:
+            for path, fingerprint in files.items():
+                self.files.setdefault(path, fingerprint)
+            self.seeded.add(folder.__str__())
+            self._dirty += len(files) + 1
+        self._save_if_needed()
+
+    def skip(self, path: Union[str, Path], fingerprint: Fingerprint):
+        self.wait_loaded()
+        with self._lock:
+            known = self.files[path.__str__()]
+            if not known.same_stat(fingerprint):
+                self.files[path.__str__()] = fingerprint._replace(pk=known.pk, synced_at=known.synced_at)
+            self.bytes_saved += fingerprint.size
+            self.uploads_skipped += 1
+            self._dirty += 1
+        self._save_if_needed()
+
+    def forget(self, path: Union[str, Path]):
+        self.wait_loaded()
+        with self._lock:
+            if self.files.pop(path.__str__(), None) is not None:
+                self._dirty += 1
+
+    def move(self, src_path: Union[str, Path], dest_path: Union[str, Path]):
+        self.wait_loaded()
+        with self._lock:
+            fingerprint = self.files.pop(src_path.__str__(), None)
+            if fingerprint is not None:
+                self.files[dest_path.__str__()] = fingerprint
+                self._dirty += 1
+
+    def move_tree(self, src_dir: Union[str, Path], dest_dir: Union[str, Path]) -> int:
+        """
+        Moves the entries of the files below ``src_dir``, and its seeded folders, below ``dest_dir``, e.g. once a
+        folder move is applied remotely, so that its files are not taken as new at their new paths.
+
+        Returns:
+            int: The number of file entries moved.
+        """
+        src, dest = src_dir.__str__(), dest_dir.__str__()
+        self.wait_loaded()
+        with self._lock:
+            moved = [path for path in self.files if path.startswith(src + os.sep)]
+            for path in moved:
+                self.files[dest + path[len(src):]] = self.files.pop(path)
+            folders = [folder for folder in self.seeded if folder == src or folder.startswith(src + os.sep)]
+            for folder in folders:
+                self.seeded.discard(folder)
+                self.seeded.add(dest + folder[len(src):])
+            self._dirty += len(moved) + len(folders)
+        self._save_if_needed()
+        return len(moved)
+
+    def report(self) -> dict:
+        return dict(files=len(self.files), uploads_skipped=self.uploads_skipped, bytes_saved=self.bytes_saved)
+
+    def _save_if_needed(self):
+        if self._dirty >= self.save_every:
+            self.save()
+            logger.info(f"Manifest saved: {self.report()}")
+
+
+manifest = Manifest(settings.for_shard(settings.MANIFEST_FILE), workers=settings.HASH_WORKERS,
+                    chunk_size=settings.HASH_CHUNK_SIZE, save_every=settings.MANIFEST_SAVE_EVERY)
+
+atexit.register(manifest.save)
@@ -0,0 +1,29 @@
+import threading
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Union
+
+from utilities.roots import root_for
+
+
+class Metrics:
+    """
+    Counters kept per watch root. The roots share the HTTP session, the workers and the caches, so a root's share
+    of the work is only visible here, e.g. the events and uploads of one company on a daemon serving several.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Counter] = defaultdict(Counter)
+
+    def add(self, path: Union[str, Path], name: str, amount: int = 1):
+        root = root_for(path).name
+        with self._lock:
+            self._counters[root][name] += amount
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {root: dict(counter) for root, counter in self._counters.items()}
+
+
+metrics = Metrics()
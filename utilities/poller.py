@@ -0,0 +1,376 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
+
+from watchdog.events import (DirCreatedEvent, DirDeletedEvent, DirMovedEvent, FileCreatedEvent, FileDeletedEvent,
+                             FileModifiedEvent, FileMovedEvent, FileSystemEventHandler)
+
+import settings
+from utilities.walker import is_ignored
+
+logger = logging.getLogger(__name__)
+
+# (dev, inode, size, mtime_ns) of a file, (dev, inode, mtime_ns) of a directory
+FileStat = Tuple[int, int, int, int]
+DirStat = Tuple[int, int, int]
+
+
+class DirectoryState:
+    __slots__ = ('stat', 'files', 'dirs', 'changed_at', 'phase')
+
+    def __init__(self, path: str, stat: DirStat, files: Dict[str, FileStat], dirs: Set[str], changed_at: float = 0):
+        self.stat = stat
+        self.files = files
+        self.dirs = dirs
+        self.changed_at = changed_at
+        # spreads the cold directories over the polls instead of checking them all in the same one
+        self.phase = zlib.crc32(path.encode())
+
+
+class PollIndex:
+    """
+    Persistent index of a watched tree, polled for changes where inotify events never fire, e.g. NFS or SMB mounts.
+
+    watchdog's PollingObserver stats every file of the tree at every interval. Here a poll stats the directories
+    first: a created, deleted or renamed entry changes the mtime of its directory, and only changed directories are
+    listed and their files stat'ed. A file rewritten in place leaves its directory unchanged, so the files are also
+    verified: at every poll in the hot directories (changed in the last ``hot_seconds``, and their parents), and
+    every ``verify_every`` polls in the cold ones, whose own mtime is checked every ``cold_every`` polls.
+
+    Deletions and creations of the same (dev, inode) within a poll are reported as moves. An entry that disappeared
+    without showing up elsewhere may have moved to a directory not due in this poll: its parent directories and the
+    subdirectories of the two closest are checked at once, moves further away are found by the sweep of every
+    directory made every ``sweep_interval`` seconds. The index is saved to ``path``, so a restart reports what changed while the watcher
+    was down instead of walking the tree silently again.
+    """
+
+    def __init__(self, root: Union[str, Path], path: Union[str, Path], hot_seconds: float = 300, cold_every: int = 15,
+                 verify_every: int = 150, save_interval: float = 60, sweep_interval: float = 600):
+        self.root = os.fspath(root)
+        self.path = Path(path)
+        self.hot_seconds = hot_seconds
+        self.cold_every = max(cold_every, 1)
+        self.verify_every = max(verify_every, 1)
+        self.save_interval = save_interval
+        self.sweep_interval = sweep_interval
+        self.swept_at = time.time()
+        self.dirs: Dict[str, DirectoryState] = dict()
+        self.stats = 0
+        self.saved_at = 0.0
+        self._dirty = False
+
+    @classmethod
+    def for_root(cls, root: Union[str, Path]) -> 'PollIndex':
+        name = hashlib.sha1(os.fspath(root).encode()).hexdigest()[:12]
+        return cls(root, settings.DATA_DIR.joinpath(f"poll-{name}.json"), hot_seconds=settings.POLL_HOT_SECONDS,
+                   cold_every=settings.POLL_COLD_EVERY, verify_every=settings.POLL_VERIFY_EVERY,
+                   sweep_interval=settings.POLL_SWEEP_INTERVAL)
+
+    @property
+    def files(self) -> int:
+        return sum(len(state.files) for state in self.dirs.values())
+
+    def load(self) -> bool:
+        if not self.path.is_file():
+            return False
+        try:
+            content = json.loads(self.path.read_text())
+            dirs = {path: DirectoryState(path, tuple(stat), {name: tuple(values) for name, values in files.items()},
+                                         set(subdirs), changed_at)
+                    for path, (stat, files, subdirs, changed_at) in content['dirs'].items()}
+        except (ValueError, TypeError, KeyError) as error:
+            logger.error(f"Unable to load the poll index '{self.path}': {error}")
+            return False
+        if content.get('root') != self.root:
+            return False
+        self.dirs = dirs
+        logger.info(f"Loaded the poll index of '{self.root}': {len(dirs)} directories, {self.files} files.")
+        return True
+
+    def save(self):
+        content = dict(root=self.root, dirs={path: [state.stat, state.files, sorted(state.dirs), state.changed_at]
+                                             for path, state in self.dirs.items()})
+        tmp = self.path.with_suffix('.tmp')
+        try:
+            tmp.write_text(json.dumps(content))
+            os.replace(tmp, self.path)
+        except OSError as error:
+            logger.error(f"Unable to save the poll index '{self.path}': {error}")
+            return
+        self.saved_at = time.time()
+        self._dirty = False
+
+    def build(self):
+        """Indexes the whole tree without reporting anything, when there is no saved index to compare with."""
+        started, self.stats = time.time(), 0
+        self.index_tree(self.root, None)
+        self.save()
+        logger.info(f"Indexed '{self.root}' for polling: {len(self.dirs)} directories, {self.files} files, "
+                    f"{self.stats} stats in {time.time() - started:.1f}s.")
+
+    def list_directory(self, path: str) -> Tuple[Dict[str, FileStat], Set[str]]:
+        files, dirs = dict(), set()
+        with os.scandir(path) as iterator:
+            self.stats += 1
+            for entry in iterator:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.add(entry.name)
+                    elif entry.is_file(follow_symlinks=False) and not is_ignored(entry.name):
+                        stat = entry.stat(follow_symlinks=False)
+                        self.stats += 1
+                        files[entry.name] = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+                except OSError as error:
+                    logger.error(f"Unable to inspect '{entry.path}': {error}")
+        return files, dirs
+
+    def stat_directory(self, path: str) -> DirStat:
+        stat = os.stat(path)
+        self.stats += 1
+        return stat.st_dev, stat.st_ino, stat.st_mtime_ns
+
+    def index_tree(self, top: str, handler: Optional[FileSystemEventHandler], changed_at: float = 0) -> int:
+        """
+        Adds the tree under ``top`` to the index, reporting its directories and files as created to ``handler``.
+
+        Returns:
+            int: The number of events reported.
+        """
+        stack, events = [top], 0
+        while stack:
+            path = stack.pop()
+            try:
+                stat = self.stat_directory(path)
+                files, dirs = self.list_directory(path)
+            except OSError as error:
+                logger.error(f"Unable to index directory '{path}': {error}")
+                continue
+            self.dirs[path] = DirectoryState(path, stat, files, dirs, changed_at)
+            self._dirty = True
+            if handler is not None:
+                if path != top:
+                    handler.dispatch(DirCreatedEvent(path))
+                    events += 1
+                for name in files:
+                    handler.dispatch(FileCreatedEvent(os.path.join(path, name)))
+                events += len(files)
+            stack.extend(os.path.join(path, name) for name in dirs)
+        return events
+
+    def drop_tree(self, top: str):
+        for path in [path for path in self.dirs if path == top or path.startswith(top + os.sep)]:
+            del self.dirs[path]
+
+    def move_tree(self, src: str, dest: str):
+        for path in [path for path in self.dirs if path == src or path.startswith(src + os.sep)]:
+            self.dirs[dest + path[len(src):]] = self.dirs.pop(path)
+
+    def heat(self, path: str, now: float):
+        """Marks a changed directory and its parents hot, so new entries next to it are found at the next poll."""
+        while path in self.dirs:
+            self.dirs[path].changed_at = now
+            if path == self.root:
+                break
+            path = os.path.dirname(path)
+
+    def nearby(self, paths: List[str]) -> Set[str]:
+        """The indexed parent directories of the paths up to the root, and the subdirectories of the two closest."""
+        found: Set[str] = set()
+        for path in paths:
+            parent, level = os.path.dirname(path), 0
+            while parent in self.dirs:
+                found.add(parent)
+                if level < 2:
+                    found.update(os.path.join(parent, name) for name in self.dirs[parent].dirs)
+                if parent == self.root:
+                    break
+                parent, level = os.path.dirname(parent), level + 1
+        return found
+
+    def poll(self, number: int, handler: FileSystemEventHandler, full: bool = False,
+             select: Optional[Callable[[str], bool]] = None) -> dict:
+        """
+        Reports the changes since the previous poll to ``handler``.
+
+        Args:
+            number: The number of the poll, which decides the cold directories checked in this one.
+            handler: Receives watchdog events, like from an observer.
+            full: Checks the mtime of every directory, e.g. on the first poll after a restart. Implied once
+                ``sweep_interval`` seconds passed since the previous sweep.
+            select: Limits the poll to the directories it holds for, e.g. the ones no inotify watch covers.
+
+        Returns:
+            dict: The directories checked and listed, the stats made and the events reported.
+        """
+        now, started, self.stats = time.time(), time.monotonic(), 0
+        sweep = now - self.swept_at >= self.sweep_interval
+        if sweep or (full and select is None):
+            self.swept_at = now
+        full = full or sweep
+        created: Dict[Tuple[int, int], Tuple[str, bool]] = dict()
+        deleted: Dict[Tuple[int, int], Tuple[str, bool]] = dict()
+        refreshed: Set[str] = set()
+        checked = events = 0
+
+        def refresh(path: str, state: DirectoryState, stat: DirStat):
+            nonlocal events
+            refreshed.add(path)
+            try:
+                files, dirs = self.list_directory(path)
+            except OSError as error:
+                logger.error(f"Unable to list directory '{path}': {error}")
+                return
+            for name in state.files.keys() - files.keys():
+                deleted[state.files[name][:2]] = (os.path.join(path, name), False)
+            for name, values in files.items():
+                previous = state.files.get(name)
+                if previous is None:
+                    created[values[:2]] = (os.path.join(path, name), False)
+                elif previous != values:
+                    handler.dispatch(FileModifiedEvent(os.path.join(path, name)))
+                    events += 1
+            for name in state.dirs - dirs:
+                child = self.dirs.get(os.path.join(path, name))
+                if child is not None:
+                    deleted[child.stat[:2]] = (os.path.join(path, name), True)
+            for name in dirs - state.dirs:
+                try:
+                    created[self.stat_directory(os.path.join(path, name))[:2]] = (os.path.join(path, name), True)
+                except OSError:
+                    continue
+            if (files, dirs) != (state.files, state.dirs):
+                self.heat(path, now)
+                self._dirty = True
+            state.stat, state.files, state.dirs = stat, files, dirs
+
+        def check(path: str, due: bool):
+            nonlocal checked
+            state = self.dirs.get(path)
+            if state is None or path in refreshed or path in visited or (select is not None and not select(path)):
+                return
+            hot = now - state.changed_at < self.hot_seconds
+            if not (due or hot or (number + state.phase) % self.cold_every == 0):
+                return
+            visited.add(path)
+            checked += 1
+            try:
+                stat = self.stat_directory(path)
+            except FileNotFoundError:
+                # removed: listing the parent reports it, even when the parent itself is not due in this poll
+                parent = os.path.dirname(path)
+                if path != self.root and parent in self.dirs and parent not in refreshed and (
+                        select is None or select(parent)):
+                    try:
+                        refresh(parent, self.dirs[parent], self.stat_directory(parent))
+                    except OSError:
+                        pass
+                return
+            except OSError as error:
+                logger.error(f"Unable to poll directory '{path}': {error}")
+                return
+            if stat != state.stat or hot or (number + state.phase) % self.verify_every == 0:
+                refresh(path, state, stat)
+
+        visited: Set[str] = set()
+        for path in list(self.dirs):
+            check(path, full)
+        if deleted.keys() - created.keys() and not full:
+            # what disappeared may have been moved to a directory nearby not due in this poll, which then changed too
+            for path in self.nearby([deleted[key][0] for key in deleted.keys() - created.keys()]):
+                check(path, True)
+
+        for key in created.keys() & deleted.keys():
+            (src, is_directory), (dest, _) = deleted.pop(key), created.pop(key)
+            if is_directory:
+                self.move_tree(src, dest)
+                handler.dispatch(DirMovedEvent(src, dest))
+            else:
+                handler.dispatch(FileMovedEvent(src, dest))
+            events += 1
+        for src, is_directory in deleted.values():
+            if is_directory:
+                self.drop_tree(src)
+                handler.dispatch(DirDeletedEvent(src))
+            else:
+                handler.dispatch(FileDeletedEvent(src))
+            events += 1
+        for dest, is_directory in created.values():
+            if is_directory:
+                handler.dispatch(DirCreatedEvent(dest))
+                # hot, a directory being copied in gets more files soon
+                events += 1 + self.index_tree(dest, handler, changed_at=now)
+            else:
+                handler.dispatch(FileCreatedEvent(dest))
+                events += 1
+
+        if self._dirty and time.time() - self.saved_at >= self.save_interval:
+            self.save()
+        return dict(checked=checked, listed=len(refreshed), stats=self.stats, events=events,
+                    seconds=round(time.monotonic() - started, 3))
+
+
+class IndexedObserver:
+    """
+    Observer polling a ``PollIndex`` per scheduled root every ``interval`` seconds, with the ``schedule``, ``start``,
+    ``stop`` and ``join`` of watchdog's observers so main.py can use either. The cost of every poll, in stats, is
+    logged every ``report_every`` polls and kept for the diagnostics dump.
+    """
+
+    def __init__(self, interval: float = 2, report_every: int = 30):
+        self.interval = interval
+        self.report_every = report_every
+        self.indexes: List[Tuple[PollIndex, FileSystemEventHandler]] = list()
+        self.polls = 0
+        self.last: Dict[str, dict] = dict()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='poller', daemon=True)
+
+    def schedule(self, event_handler: FileSystemEventHandler, path: Union[str, Path], recursive: bool = True):
+        self.indexes.append((PollIndex.for_root(Path(path).resolve()), event_handler))
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        # a saved index is compared with the tree at once, a new one is built without reporting anything
+        restored = {index.root: index.load() for index, _ in self.indexes}
+        for index, _ in self.indexes:
+            if not restored[index.root]:
+                index.build()
+        totals = dict(stats=0, events=0, seconds=0.0)
+        while not self._stopping.is_set():
+            for index, handler in self.indexes:
+                try:
+                    report = index.poll(self.polls, handler, full=restored.pop(index.root, False))
+                except Exception as error:
+                    logger.error(f"Poll of '{index.root}' failed: {error}")
+                    continue
+                self.last[index.root] = report
+                for key in totals:
+                    totals[key] += report[key]
+                logger.debug(f"Polled '{index.root}': {report}")
+            self.polls += 1
+            if self.polls % self.report_every == 0:
+                logger.info(f"Last {self.report_every} polls: {totals['stats'] / self.report_every:.0f} stats and "
+                            f"{totals['seconds'] / self.report_every:.3f}s per poll, {totals['events']} events, "
+                            f"{sum(len(index.dirs) for index, _ in self.indexes)} directories indexed.")
+                totals = dict(stats=0, events=0, seconds=0.0)
+            self._stopping.wait(self.interval)
+        for index, _ in self.indexes:
+            index.save()
+
+    def stop(self):
+        self._stopping.set()
+
+    def join(self, timeout: Optional[float] = None):
+        self._thread.join(timeout)
+
+    def status(self) -> dict:
+        return dict(polls=self.polls, interval=self.interval, last=self.last,
+                    directories={index.root: len(index.dirs) for index, _ in self.indexes})
@@ -0,0 +1,76 @@
+import functools
+import logging
+import os
+from pathlib import Path
+from typing import List, NamedTuple, Union
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+
+class WatchRoot(NamedTuple):
+    """
+    A watched directory and how its paths map to remote paths.
+
+    ``keyword`` is the part of the local paths the remote paths start at, e.g. 'mofreitas' for
+    '/home/app/media/public/mofreitas/clientes/<email>/...', and ``reference`` the remote folder holding the tenants,
+    e.g. 'mofreitas/clientes/'.
+    """
+    name: str
+    path: Path
+    keyword: str
+    reference: str
+
+    @property
+    def tenants(self) -> str:
+        """Name of the directory holding the tenants, e.g. 'clientes'."""
+        return Path(self.reference).name
+
+    @property
+    def tenants_dir(self) -> Path:
+        return self.path.joinpath(*Path(self.reference).relative_to(self.keyword).parts)
+
+
+def load_roots(config: List[dict]) -> List[WatchRoot]:
+    roots = list()
+    for entry in config:
+        path = Path(entry['path']).resolve()
+        keyword = entry.get('keyword') or path.name
+        reference = entry.get('reference') or f"{keyword}/clientes/"
+        roots.append(WatchRoot(entry.get('name') or keyword, path, keyword, reference))
+    return roots
+
+
+roots: List[WatchRoot] = load_roots(settings.WATCH_ROOTS)
+
+# longest first, so a root nested in another one wins for its own paths
+_by_depth = sorted(roots, key=lambda root: len(root.path.parts), reverse=True)
+
+
+@functools.lru_cache(maxsize=settings.PATH_CACHE_SIZE)
+def _root_for(path: str) -> WatchRoot:
+    for root in _by_depth:
+        directory = os.fspath(root.path)
+        if path == directory or path.startswith(directory + os.sep):
+            return root
+    # remote paths, e.g. 'mofreitas/clientes/...', are told apart by their keyword
+    parts = Path(path).parts
+    for root in roots:
+        if root.keyword in parts:
+            return root
+    return roots[0]
+
+
+def root_for(path: Union[str, Path]) -> WatchRoot:
+    """The root a local path is watched under, or the root whose keyword a remote path starts with."""
+    return _root_for(os.fspath(path))
+
+
+def resolve(path: Union[str, Path]) -> Path:
+    """An absolute path as is, a relative one, e.g. 'clientes/<email>/<budget>', under the first root that has it."""
+    path = Path(path)
+    if not path.is_absolute():
+        candidates = [root.path.joinpath(path) for root in roots]
+        path = next((candidate for candidate in candidates if candidate.exists()), candidates[0])
+    return path.resolve()
@@ -0,0 +1,236 @@
+import json
+import logging.config
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import settings
+from utilities import diagnostics, folders, lanes, task
+from utilities.backlog import backlog
+from utilities.events import EventRecord
+from utilities.funtions import get_budget_path, tenant_key
+from utilities.manifest import manifest
+
+logger = logging.getLogger(__name__)
+
+# Counters each worker process keeps in shared memory, next to a heartbeat timestamp.
+FIELDS = ('received', 'processed', 'failed', 'parked', 'backlog', 'heartbeat')
+
+# Seconds between the heartbeats of a worker process; a worker silent for ten heartbeats is reported as stalled.
+HEARTBEAT_INTERVAL = 1.0
+
+# Serialises the start of the worker processes, which inherit the SHARD environment variable.
+_spawn_lock = threading.Lock()
+
+
+def shard_of(path: str, shards: int) -> int:
+    """Stable across processes and restarts, unlike ``hash``, so a tenant always lands on the same worker."""
+    return zlib.crc32(tenant_key(path).encode()) % shards
+
+
+class ShardStats:
+    """The ``FIELDS`` of every worker process, in a shared array written by the worker and read by the watcher."""
+
+    def __init__(self, context, shards: int):
+        self.values = context.Array('d', shards * len(FIELDS))
+
+    def add(self, index: int, field: str, amount: float = 1):
+        with self.values.get_lock():
+            self.values[index * len(FIELDS) + FIELDS.index(field)] += amount
+
+    def set(self, index: int, field: str, value: float):
+        self.values[index * len(FIELDS) + FIELDS.index(field)] = value
+
+    def read(self, index: int) -> Dict[str, float]:
+        with self.values.get_lock():
+            return dict(zip(FIELDS, self.values[index * len(FIELDS):(index + 1) * len(FIELDS)]))
+
+
+def run_shard(index: int, shards: int, inbox, stats: ShardStats, logging_config: Optional[dict]):
+    """
+    Entry point of a worker process: runs the threaded engine, lanes and backlog included, on the events of its
+    tenants. Events arrive packed (``EventRecord.pack``) and are dispatched in the order they were routed; the
+    metadata lane runs the events of a tenant in that order (``Lane.submit_ordered``).
+    """
+    # the watcher stops the workers through their inbox, a Ctrl-C in the terminal must not interrupt them first
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # settings.LOGGER of the worker itself, not of the watcher: it logs to a file of its own
+    logging.config.dictConfig(logging_config or settings.LOGGER)
+    manifest.start_loading()
+    shared_manifest = Path(settings.MANIFEST_FILE)
+    if not manifest.path.exists() and shared_manifest.is_file():
+        manifest.adopt(shared_manifest, lambda path: shard_of(path, shards) == index)
+    backlog.start(task.submit_event)
+
+    def beat():
+        while True:
+            stats.set(index, 'parked', backlog.parked_total)
+            stats.set(index, 'backlog', len(backlog))
+            stats.set(index, 'heartbeat', time.time())
+            time.sleep(HEARTBEAT_INTERVAL)
+
+    def done(future):
+        failed = future.exception() is not None or not future.result()
+        stats.add(index, 'failed' if failed else 'processed')
+
+    threading.Thread(target=beat, name='heartbeat', daemon=True).start()
+    logger.info(f"Worker process {index} of {shards} started, pid {os.getpid()}.")
+    seen_budgets = set()
+    while True:
+        packed = inbox.get()
+        if packed is None:
+            break
+        event = EventRecord.unpack(packed)
+        stats.add(index, 'received')
+        budget: Optional[Path] = get_budget_path(event.src_path)
+        if settings.PREFETCH_BUDGETS and budget is not None and budget not in seen_budgets:
+            seen_budgets.add(budget)
+            threading.Thread(target=folders.prefetch_budget, args=(budget,), daemon=True).start()
+        future = task.dispatch_event(event)
+        if future is not None:
+            future.add_done_callback(done)
+
+    lanes.metadata_lane.shutdown()
+    lanes.upload_lane.shutdown()
+    manifest.save()
+    logger.info(f"Worker process {index} stopped.")
+
+
+class ShardPool:
+    """
+    Routes the events of the watcher to ``shards`` worker processes by a stable hash of their tenant.
+
+    Path handling, hashing and JSON work then run on as many GILs as there are workers, while every event of a
+    tenant is still handled by the same worker, whose metadata lane runs them in the order they were seen. Workers
+    keep their own manifest, backlog, token cache and log file (``settings.for_shard``). Each one reports its counters
+    and a heartbeat in shared memory; a monitor thread logs the throughput of every worker and restarts the ones that
+    died.
+
+    ``put`` blocks once a worker has ``max_pending`` events waiting, like ``Lane.submit``. ``logging_config`` replaces
+    the ``settings.LOGGER`` of the workers.
+    """
+
+    def __init__(self, shards: int, max_pending: int = 0, interval: float = 30,
+                 logging_config: Optional[dict] = None):
+        self.shards = shards
+        self.interval = interval
+        self.logging_config = logging_config
+        # spawned, not forked: the watcher already runs threads (lanes, hashers, observer) a fork would copy mid-work
+        self._context = multiprocessing.get_context('spawn')
+        self.inboxes = [self._context.Queue(maxsize=max_pending) for _ in range(shards)]
+        self.stats = ShardStats(self._context, shards)
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * shards
+        self.rates = [0.0] * shards
+        self.restarts = 0
+        self._stopping = threading.Event()
+
+    def start(self):
+        for index in range(self.shards):
+            self._spawn(index)
+        self.route_backlog()
+        threading.Thread(target=self._monitor, name='shard-monitor', daemon=True).start()
+        logger.info(f"Routing events to {self.shards} worker processes.")
+
+    def _spawn(self, index: int):
+        process = self._context.Process(target=run_shard, name=f"shard-{index}", daemon=True,
+                                        args=(index, self.shards, self.inboxes[index], self.stats, self.logging_config))
+        with _spawn_lock:
+            os.environ[settings.parse_env('SHARD')] = str(index)
+            try:
+                process.start()
+            finally:
+                del os.environ[settings.parse_env('SHARD')]
+        counters = self.stats.read(index)
+        # the events a dead worker received but never finished are lost with it, they must not stay pending
+        self.stats.set(index, 'received', counters['processed'] + counters['failed'])
+        self.stats.set(index, 'heartbeat', time.time())
+        self.processes[index] = process
+
+    def route_backlog(self):
+        """Hands the events parked by a single-process run to the workers of their tenants."""
+        for path in (backlog.draining_path, backlog.path):
+            if not path.is_file():
+                continue
+            routed = 0
+            with path.open() as file:
+                for line in file:
+                    try:
+                        self.put(EventRecord.from_dict(json.loads(line)))
+                        routed += 1
+                    except (ValueError, KeyError) as error:
+                        logger.error(f"Dropping unreadable parked event {line!r}: {error}")
+            os.remove(path)
+            logger.info(f"Routed {routed} parked events from '{path}' to the worker processes.")
+
+    def put(self, event: EventRecord):
+        """Called from the watchdog and scan threads, like ``Queue.put`` for the threaded engine."""
+        self.inboxes[shard_of(event.src_path, self.shards)].put(event.pack())
+
+    def inbox_size(self, index: int) -> int:
+        try:
+            return self.inboxes[index].qsize()
+        except NotImplementedError:
+            # macOS has no sem_getvalue
+            return 0
+
+    def qsize(self) -> int:
+        """Events not handled yet: waiting in an inbox, running in a worker or parked in its backlog."""
+        pending = 0
+        for index in range(self.shards):
+            counters = self.stats.read(index)
+            pending += self.inbox_size(index) + counters['backlog']
+            pending += counters['received'] - counters['processed'] - counters['failed']
+        return int(pending)
+
+    @property
+    def parked_total(self) -> int:
+        return int(sum(self.stats.read(index)['parked'] for index in range(self.shards)))
+
+    def status(self) -> List[dict]:
+        status = list()
+        for index, process in enumerate(self.processes):
+            counters = self.stats.read(index)
+            heartbeat = counters.pop('heartbeat')
+            status.append(dict(shard=index, pid=process.pid if process else None,
+                               alive=bool(process and process.is_alive()), inbox=self.inbox_size(index),
+                               events_per_second=round(self.rates[index], 2),
+                               heartbeat_age=round(time.time() - heartbeat, 1),
+                               **{field: int(value) for field, value in counters.items()}))
+        return status
+
+    def register_gauges(self):
+        diagnostics.register_gauge('shards', self.status)
+        diagnostics.register_gauge('shard_restarts', lambda: self.restarts)
+
+    def _monitor(self):
+        last = [0.0] * self.shards
+        while not self._stopping.wait(self.interval):
+            for index, process in enumerate(self.processes):
+                counters = self.stats.read(index)
+                done = counters['processed'] + counters['failed']
+                self.rates[index] = (done - last[index]) / self.interval
+                last[index] = done
+                if not process.is_alive():
+                    logger.error(f"Worker process {index} (pid {process.pid}) exited with code {process.exitcode},"
+                                 f" restarting it.")
+                    self.restarts += 1
+                    self._spawn(index)
+                elif time.time() - counters['heartbeat'] > 10 * HEARTBEAT_INTERVAL:
+                    logger.warning(f"Worker process {index} (pid {process.pid}) has not sent a heartbeat for "
+                                   f"{time.time() - counters['heartbeat']:.0f}s.")
+            logger.info('Worker processes: ' + ', '.join(
+                f"#{index} {self.rates[index]:.1f} events/s, {self.inbox_size(index)} queued"
+                for index in range(self.shards)))
+
+    def stop(self):
+        """Lets every worker finish the events already routed to it, then waits for it to exit."""
+        self._stopping.set()
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for process in self.processes:
+            process.join()
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from utilities.breaker import breaker
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    __slots__ = ('owner', 'done', 'result', 'error', 'outage', 'waiters')
+
+    def __init__(self, owner: int):
+        self.owner = owner
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.outage = False
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key: the first caller runs the function and every caller that arrives
+    while it is in flight waits for it and receives the same result (or exception).
+
+    A call made again by the thread that owns the in-flight call (recursion) runs directly instead of waiting for
+    itself. The breaker tracks outages per thread, so the waiters also see the outage their shared call ran into.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = dict()
+        self.shared = 0
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None and call.owner != threading.get_ident():
+                call.waiters += 1
+                self.shared += 1
+            elif call is None:
+                call = self._calls[key] = _Call(threading.get_ident())
+            else:
+                call = None
+
+        if call is None:
+            return fn(*args, **kwargs)
+
+        if call.owner != threading.get_ident():
+            call.done.wait()
+            if call.outage:
+                breaker.mark_outage()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        outage = breaker.saw_outage()
+        breaker.clear_outage()
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            call.outage = breaker.saw_outage()
+            if outage:
+                breaker.mark_outage()
+            with self._lock:
+                del self._calls[key]
+            if call.waiters:
+                logger.debug(f"Shared the result of {key} with {call.waiters} concurrent caller(s).")
+            call.done.set()
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    def wait(self, key: Hashable) -> bool:
+        """Waits for the call in flight for ``key``, if any, without starting one. Returns True if it waited."""
+        call = self._calls.get(key)
+        if call is None or call.owner == threading.get_ident():
+            return False
+        call.done.wait()
+        return True
+
+
+flights = SingleFlight()
+
+
+class AsyncSingleFlight:
+    """
+    ``SingleFlight`` for coroutines of one event loop: callers awaiting a key that is in flight await the same
+    result. Unlike threads, a coroutine never waits for its own call, so there is no reentrancy to handle.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = dict()
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable, *args, **kwargs) -> Any:
+        call = self._calls.get(key)
+        if call is not None:
+            self.shared += 1
+            return await asyncio.shield(call)
+        call = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn(*args, **kwargs)
+            call.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            call.cancel()
+            raise
+        except BaseException as error:
+            call.set_exception(error)
+            # marks the exception as retrieved when nobody else was waiting for it
+            call.exception()
+            raise
+        finally:
+            del self._calls[key]
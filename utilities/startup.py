@@ -0,0 +1,48 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def process_age() -> Optional[float]:
+    """Seconds since the process was started, from /proc on Linux, None elsewhere."""
+    try:
+        with open('/proc/self/stat') as file:
+            # the command name may hold spaces, the fields after it do not
+            fields = file.read().rpartition(')')[2].split()
+        started = int(fields[19]) / os.sysconf('SC_CLK_TCK')
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - started
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class Startup:
+    """
+    Milestones of the start of the daemon, in seconds since the process started, each logged the first time it is
+    reached: e.g. 'first_watch' once the observer is armed, 'first_sync' once an event is synced.
+    """
+
+    def __init__(self):
+        age = process_age()
+        # falls back to the import of this module, early in main.py
+        self.started = time.monotonic() - (age or 0)
+        self.milestones: Dict[str, float] = dict()
+        self._lock = threading.Lock()
+
+    def reached(self, name: str):
+        if name in self.milestones:
+            return
+        with self._lock:
+            if name in self.milestones:
+                return
+            self.milestones[name] = round(time.monotonic() - self.started, 3)
+        logger.info(f"Startup: '{name}' reached after {self.milestones[name]:.2f}s.")
+
+    def status(self) -> Dict[str, float]:
+        return dict(self.milestones)
+
+
+startup = Startup()
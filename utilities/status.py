@@ -0,0 +1,233 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Set, Tuple
+from urllib import parse
+
+from utilities.cache import folder_cache
+from utilities.funtions import get_path_after_keyword
+from utilities.manifest import manifest
+from utilities.roots import resolve
+from utilities.startup import startup
+
+logger = logging.getLogger(__name__)
+
+
+def ancestors(path: str):
+    """The directories above ``path``, nearest first, up to the filesystem root."""
+    end = path.rfind(os.sep)
+    while end > 0:
+        yield path[:end]
+        end = path.rfind(os.sep, 0, end)
+    yield os.sep
+
+
+class SyncStatus:
+    """
+    Events accepted by the handler and not synced yet, and the last failure of every path, for the status API.
+
+    Every pending event counts in each directory above its path, so the pending events under a prefix are one lookup
+    away, and the directories keep the pending paths right in them and their subdirectories holding some, so a
+    listing under a prefix only visits where something is pending. Paths are kept in the order their oldest pending
+    event arrived, the first one gives the age of the oldest pending event. An event is pending from the moment it is
+    queued until its upload (or folder operation) succeeded or failed; events parked during an outage stay pending.
+    """
+
+    def __init__(self, max_failures: int = 10000):
+        self.enabled = True
+        self.max_failures = max_failures
+        # path -> (events pending, arrival of the oldest one), oldest first
+        self.pending: 'OrderedDict[str, Tuple[int, float]]' = OrderedDict()
+        self.events = 0
+        self.counts: Dict[str, int] = dict()
+        self.files_in: Dict[str, Set[str]] = dict()
+        self.subdirs: Dict[str, Set[str]] = dict()
+        # path -> last failure, oldest first
+        self.failures: 'OrderedDict[str, dict]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def started(self, path: str, queued_at: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            count, first = self.pending.get(path, (0, queued_at))
+            self.pending[path] = (count + 1, first)
+            self.events += 1
+            if not count:
+                self.files_in.setdefault(os.path.dirname(path), set()).add(path)
+            # the directory that had nothing pending yet, linked to its parent
+            child = None
+            for directory in ancestors(path):
+                count = self.counts.get(directory, 0)
+                self.counts[directory] = count + 1
+                if child is not None:
+                    self.subdirs.setdefault(directory, set()).add(child)
+                child = None if count else directory
+
+    def discard(self, path: str):
+        """The event is not this process's to sync anymore, e.g. its tenant was handed to another watcher."""
+        if not self.enabled:
+            return
+        with self._lock:
+            entry = self.pending.get(path)
+            if entry is None:
+                return
+            count, first = entry
+            if count > 1:
+                self.pending[path] = (count - 1, first)
+            else:
+                del self.pending[path]
+                directory = os.path.dirname(path)
+                self.files_in[directory].discard(path)
+                if not self.files_in[directory]:
+                    del self.files_in[directory]
+            self.events -= 1
+            # the directory that has nothing pending anymore, unlinked from its parent
+            child = None
+            for directory in ancestors(path):
+                if child is not None:
+                    self.subdirs[directory].discard(child)
+                    if not self.subdirs[directory]:
+                        del self.subdirs[directory]
+                self.counts[directory] -= 1
+                if self.counts[directory]:
+                    child = None
+                else:
+                    del self.counts[directory]
+                    child = directory
+
+    def finished(self, path: str, succeeded: bool, reason: Optional[str] = None):
+        if succeeded:
+            startup.reached('first_sync')
+        if not self.enabled:
+            return
+        self.discard(path)
+        with self._lock:
+            if succeeded:
+                self.failures.pop(path, None)
+                return
+            self.failures[path] = dict(path=path, failed_at=time.time(), reason=reason or 'failed, see the log')
+            self.failures.move_to_end(path)
+            while len(self.failures) > self.max_failures:
+                self.failures.popitem(last=False)
+
+    def summary(self) -> dict:
+        with self._lock:
+            oldest = next(iter(self.pending.items()), None)
+            return dict(enabled=self.enabled, pending_events=self.events, pending_paths=len(self.pending),
+                        oldest_path=oldest[0] if oldest else None,
+                        oldest_age=round(time.time() - oldest[1][1], 3) if oldest else None,
+                        failures=len(self.failures))
+
+    def under(self, prefix: str, limit: int = 100) -> dict:
+        """The pending events under ``prefix``, and up to ``limit`` of their paths with their age."""
+        now = time.time()
+        with self._lock:
+            if prefix in self.pending:
+                count, first = self.pending[prefix]
+                return dict(prefix=prefix, pending_events=count, paths=[dict(path=prefix, events=count,
+                                                                               age=round(now - first, 3))])
+            paths: List[dict] = list()
+            stack = [prefix]
+            while stack and len(paths) < limit:
+                directory = stack.pop()
+                for path in self.files_in.get(directory, ()):
+                    count, first = self.pending[path]
+                    paths.append(dict(path=path, events=count, age=round(now - first, 3)))
+                    if len(paths) >= limit:
+                        break
+                stack.extend(self.subdirs.get(directory, ()))
+            return dict(prefix=prefix, pending_events=self.counts.get(prefix, 0), paths=paths)
+
+    def path(self, path: str) -> dict:
+        """Whether ``path`` is pending, when it was last synced, its server pk and its last failure."""
+        with self._lock:
+            count, first = self.pending.get(path, (0, None))
+            failure = self.failures.get(path)
+        content = dict(path=path, pending_events=count, pending_since=first, failure=failure)
+        fingerprint = manifest.files.get(path)
+        if fingerprint is not None:
+            content.update(pk=fingerprint.pk, synced_at=fingerprint.synced_at or None, size=fingerprint.size,
+                           digest=fingerprint.digest)
+        else:
+            # folders are known by their remote path, when they were looked up or created recently
+            remote = get_path_after_keyword(path)
+            known, pk = folder_cache.resolve(remote) if remote is not None else (False, None)
+            if known:
+                content.update(pk=pk, folder=True)
+        return content
+
+    def failed(self, prefix: str = '', limit: int = 100) -> List[dict]:
+        """The last failures under ``prefix``, newest first."""
+        under = prefix.rstrip(os.sep) + os.sep
+        with self._lock:
+            failures = list()
+            for path, failure in reversed(self.failures.items()):
+                if not prefix or path == prefix or path.startswith(under):
+                    failures.append(failure)
+                    if len(failures) >= limit:
+                        break
+            return failures
+
+
+sync_status = SyncStatus()
+
+
+class StatusRequestHandler(BaseHTTPRequestHandler):
+    """
+    Read-only routes, paths absolute or relative to a watch root:
+
+    - ``/summary``: pending events and paths, the oldest pending event and its age, the number of failures.
+    - ``/pending?prefix=clientes/<email>&limit=100``: the pending events under a prefix.
+    - ``/path?path=clientes/<email>/<budget>/file.pdf``: pending, last sync time, server pk and last failure.
+    - ``/failed?prefix=...&limit=100``: the last failures and their reasons, newest first.
+    """
+
+    def do_GET(self):
+        url = parse.urlsplit(self.path)
+        query = dict(parse.parse_qsl(url.query))
+        try:
+            limit = int(query.get('limit', 100))
+            if url.path == '/summary':
+                content = sync_status.summary()
+            elif url.path == '/pending':
+                content = sync_status.under(self.local_path(query.get('prefix', '')), limit)
+            elif url.path == '/path':
+                content = sync_status.path(self.local_path(query['path']))
+            elif url.path == '/failed':
+                prefix = query.get('prefix')
+                content = sync_status.failed(self.local_path(prefix) if prefix else '', limit)
+            else:
+                return self.reply(404, dict(error=f"Unknown route '{url.path}'."))
+        except (KeyError, ValueError) as error:
+            return self.reply(400, dict(error=f"{type(error).__name__}: {error}"))
+        self.reply(200, content)
+
+    @staticmethod
+    def local_path(path: str) -> str:
+        return os.fspath(resolve(path)) if path else os.sep
+
+    def reply(self, status: int, content):
+        body = json.dumps(content, default=str).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"Status API: {format % args}")
+
+
+def serve(address: str) -> ThreadingHTTPServer:
+    """Serves the status API on ``address`` ('host:port'), meant for localhost."""
+    host, _, port = address.rpartition(':')
+    server = ThreadingHTTPServer((host or '127.0.0.1', int(port)), StatusRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='status-api', daemon=True).start()
+    logger.info(f"Status API listening on http://{host or '127.0.0.1'}:{server.server_address[1]}/summary")
+    return server
@@ -1,25 +1,83 @@
 import logging.config
 import os.path
+import time
+from concurrent.futures import Future
+from typing import Optional
 
-from watchdog.events import FileSystemEvent
-
-from utilities import folders, files
+from utilities import folders, files, tracing
+from utilities.backlog import backlog
+from utilities.breaker import breaker
+from utilities.events import EventRecord, EventType
+from utilities.funtions import tenant_key
+from utilities.http_requests import clear_failure, last_failure
+from utilities.lanes import metadata_lane
+from utilities.metrics import metrics
+from utilities.status import sync_status
 
 logger = logging.getLogger(__name__)
 
 
-def process_event(event: FileSystemEvent, event_type: str):
-    if event_type == 'created':
-        logger.info(f"Event 'created' triggered for {'folder' if event.is_directory else 'file'}: {event.src_path}")
+def dispatch_event(event: EventRecord) -> Optional[Future]:
+    """
+    Hands the event to the metadata lane. File uploads are passed on to the upload lane once their folder is known.
+    The events of a tenant run one at a time, in the order they were seen: a move never runs before the creation of
+    its folder, nor a delete before it.
+
+    While the storage API is down, or older events are still parked, the event is parked in the backlog instead.
+    """
+    if backlog.should_park():
+        backlog.park(event)
+        return None
+    return submit_event(event)
+
+
+def submit_event(event: EventRecord) -> Future:
+    return metadata_lane.submit_ordered(tenant_key(event.src_path), run_event, event)
+
+
+def run_event(event: EventRecord) -> bool:
+    """
+    Job of the metadata lane: processes the event, parking it when the storage API is down, and records how it went
+    in the sync status. A file whose upload was queued stays pending until the upload is done.
+    """
+    clear_failure()
+    try:
+        result = backlog.guard(event, process_event, event)
+    except Exception as error:
+        sync_status.finished(event.src_path, False, f"{type(error).__name__}: {error}")
+        raise
+    uploading = result and not event.is_directory and event.event_type in (EventType.CREATED, EventType.MODIFIED)
+    if not breaker.saw_outage() and not uploading:
+        sync_status.finished(event.src_path, result, last_failure())
+    return result
+
+
+def process_event(event: EventRecord) -> bool:
+    with tracing.start_trace('event', type=event.event_type.name, directory=event.is_directory,
+                             path=event.src_path) as root:
+        tracing.record('queue_wait', event.queued_at, time.time())
+        result = handle_event(event)
+        metrics.add(event.src_path, 'succeeded' if result else 'failed')
+        if root is not None:
+            root.set(result=bool(result))
+        return result
+
+
+def handle_event(event: EventRecord) -> bool:
+    event_type = event.event_type
+    # modified files carry no dest_path; they are uploaded again and the manifest drops unchanged content
+    if event_type == EventType.CREATED or (event_type == EventType.MODIFIED and not event.is_directory):
+        logger.info(f"Event '{event_type.name.lower()}' triggered for {'folder' if event.is_directory else 'file'}:"
+                    f" {event.src_path}")
         if event.is_directory:
             result: bool = folders.on_folder_created(src_path=event.src_path)
             status = 'succeeded' if result else 'failed'
             logger.info(f"Post folder '{os.path.basename(event.src_path)}' {status}.")
         else:
             logger.info(f"Posting file '{os.path.basename(event.src_path)}'....")
-            files.on_file_created(src_path=event.src_path)
+            result: bool = files.on_file_created(src_path=event.src_path)
 
-    elif event_type == 'moved' or event_type == 'modified':
+    elif event_type == EventType.MOVED:
         logger.info(f"Event 'moved' triggered for {'folder' if event.is_directory else 'file'}: {event.src_path}"
                     f" to {event.dest_path}")
         if event.is_directory:
@@ -30,7 +88,7 @@ def process_event(event: FileSystemEvent, event_type: str):
         logger.info(f"Moving {'folder' if event.is_directory else 'file'} '{os.path.basename(event.src_path)}'"
                     f" {status}.")
 
-    elif event_type == 'deleted':
+    elif event_type == EventType.DELETED:
         logger.info(f"Event 'deleted' triggered for {'folder' if event.is_directory else 'file'}: {event.src_path}")
         if event.is_directory:
             result: bool = folders.on_folder_deleted(src_path=event.src_path)
@@ -39,3 +97,6 @@ def process_event(event: FileSystemEvent, event_type: str):
         status = 'succeeded' if result else 'failed'
         logger.info(f"Deleting {'folder' if event.is_directory else 'file'} '{os.path.basename(event.src_path)}'"
                     f" {status}.")
+    else:
+        result = True
+    return result
@@ -0,0 +1,144 @@
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional, Union
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class Span:
+    """
+    A timed step of an event: the whole event, its queue wait, a folders/files function or an HTTP request.
+
+    Spans of one event share a ``trace_id`` and point to their parent, each one is written as a JSON line when it
+    ends, so spans finishing on another thread (an upload on the upload lane) still join their event.
+    """
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'start', 'duration', 'attrs', '_started')
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None, **attrs):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.duration: Optional[float] = None
+        self.attrs = attrs
+        self._started = time.perf_counter()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def end(self):
+        self.duration = time.perf_counter() - self._started
+        exporter.export(self)
+
+    def to_dict(self) -> dict:
+        return dict(name=self.name, trace=self.trace_id, span=self.span_id, parent=self.parent_id, start=self.start,
+                    duration=self.duration, **self.attrs)
+
+
+class Exporter:
+    """Appends finished spans to a JSON lines file from a background thread, rotating it at ``max_bytes``."""
+
+    def __init__(self, path: Union[str, Path], max_bytes: int):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._write, name='tracing', daemon=True)
+                    self._thread.start()
+        self._queue.put(span)
+
+    def _write(self):
+        while True:
+            lines: List[str] = [json.dumps(self._queue.get().to_dict(), default=str)]
+            while not self._queue.empty() and len(lines) < 1000:
+                lines.append(json.dumps(self._queue.get().to_dict(), default=str))
+            try:
+                if self.path.is_file() and self.path.stat().st_size > self.max_bytes:
+                    os.replace(self.path, self.path.with_suffix(self.path.suffix + '.1'))
+                with self.path.open('a') as file:
+                    file.write('\n'.join(lines) + '\n')
+            except OSError as error:
+                logger.error(f"Unable to write {len(lines)} spans to '{self.path}': {error}")
+
+
+exporter = Exporter(settings.for_shard(settings.TRACE_FILE), max_bytes=settings.TRACE_MAX_BYTES)
+
+
+def current() -> Optional[Span]:
+    return getattr(_local, 'span', None)
+
+
+@contextmanager
+def attach(parent: Optional[Span]) -> Iterator[None]:
+    """Continues the trace of ``parent`` on this thread, e.g. for a job handed to another lane."""
+    previous = current()
+    _local.span = parent
+    try:
+        yield
+    finally:
+        _local.span = previous
+
+
+@contextmanager
+def start_trace(name: str, sample_rate: Optional[float] = None, **attrs) -> Iterator[Optional[Span]]:
+    """
+    Starts the root span of an event, for a ``sample_rate`` fraction of the events. The others are not traced at all:
+    ``span`` is then a no-op for everything they call.
+    """
+    rate = settings.TRACE_SAMPLE_RATE if sample_rate is None else sample_rate
+    if rate <= 0 or random.random() >= rate:
+        with attach(None):
+            yield None
+        return
+    root = Span(name, trace_id=f"{random.getrandbits(64):016x}", **attrs)
+    with attach(root):
+        try:
+            yield root
+        finally:
+            root.end()
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Optional[Span]]:
+    parent = current()
+    if parent is None:
+        yield None
+        return
+    child = Span(name, parent.trace_id, parent.span_id, **attrs)
+    _local.span = child
+    try:
+        yield child
+    except BaseException as error:
+        child.set(error=type(error).__name__)
+        raise
+    finally:
+        _local.span = parent
+        child.end()
+
+
+def record(name: str, start: float, end: float, **attrs):
+    """Records a step that already happened, such as the time an event waited in the queues."""
+    parent = current()
+    if parent is None:
+        return
+    child = Span(name, parent.trace_id, parent.span_id, **attrs)
+    child.start, child.duration = start, max(end - start, 0.0)
+    exporter.export(child)
@@ -0,0 +1,256 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Union
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+# Sentinel object for termination
+sentinel = object()
+
+
+def is_ignored(name: str) -> bool:
+    """Temporary files written by syncthing and editors are never synced."""
+    return name.endswith('tmp') or name.startswith('syncthing') or name.startswith('.syncthing')
+
+
+def outermost(paths: List[str]) -> List[str]:
+    """The paths that are not under another one of them: walking those covers all of them, each once."""
+    unique = set(paths)
+    return sorted(path for path in unique if not any(os.fspath(parent) in unique for parent in Path(path).parents))
+
+
+class ScanCheckpoint:
+    """
+    Progress of a long scan, saved to disk so a restart resumes where the previous run stopped.
+
+    The checkpoint holds the frontier (directories not fully scanned yet), the last emitted entry and the subtrees
+    that were completely scanned, with the time they completed. Completed subtrees are skipped for ``freshness``
+    seconds. Once a subtree completes, the records of its children are dropped, so a finished scan leaves a single
+    record for its root.
+    """
+
+    def __init__(self, root: Union[str, Path], path: Union[str, Path], every: int = 1000, freshness: int = 21600):
+        self.root = os.fspath(root)
+        self.path = Path(path)
+        self.every = every
+        self.freshness = freshness
+        self.frontier: List[str] = list()
+        self.last_entry: Optional[str] = None
+        self.completed: Dict[str, float] = dict()
+        self.load()
+
+    @classmethod
+    def for_root(cls, root: Union[str, Path]) -> 'ScanCheckpoint':
+        name = hashlib.sha1(os.fspath(root).encode()).hexdigest()[:12]
+        return cls(root, settings.DATA_DIR.joinpath(f"scan-{name}.json"), every=settings.SCAN_CHECKPOINT_EVERY,
+                   freshness=settings.SCAN_FRESHNESS)
+
+    def load(self):
+        if not self.path.is_file():
+            return
+        try:
+            content = json.loads(self.path.read_text())
+        except ValueError as error:
+            logger.error(f"Unable to load the scan checkpoint '{self.path}': {error}")
+            return
+        now = time.time()
+        # checkpoints saved before the frontier was reduced may hold a directory and its subdirectories
+        self.frontier = outermost(content.get('frontier', list()))
+        self.last_entry = content.get('last_entry')
+        self.completed = {path: at for path, at in content.get('completed', dict()).items()
+                          if now - at < self.freshness}
+
+    def save(self, frontier: List[str], last_entry: Optional[str]):
+        self.frontier, self.last_entry = frontier, last_entry
+        content = dict(root=self.root, frontier=frontier, last_entry=last_entry, completed=dict(self.completed))
+        tmp = self.path.with_suffix('.tmp')
+        try:
+            tmp.write_text(json.dumps(content))
+            os.replace(tmp, self.path)
+        except OSError as error:
+            logger.error(f"Unable to save the scan checkpoint '{self.path}': {error}")
+
+    @property
+    def unfinished(self) -> bool:
+        return bool(self.frontier)
+
+    def is_fresh(self, path: str) -> bool:
+        completed_at = self.completed.get(path)
+        return completed_at is not None and time.time() - completed_at < self.freshness
+
+    def mark_completed(self, path: str, children: List[str]):
+        for child in children:
+            self.completed.pop(child, None)
+        self.completed[path] = time.time()
+
+
+class TreeWalker:
+    """
+    Walks a directory tree with ``os.scandir`` and yields the ``os.DirEntry`` of every file.
+
+    Subdirectories are scanned concurrently by ``workers`` threads, which hides the per-directory latency of network
+    filesystems. Entries are streamed through a queue holding at most ``max_pending`` items, so memory stays bounded
+    however large the tree is; the workers wait while the consumer catches up.
+
+    With a ``ScanCheckpoint`` the walk starts from the saved frontier when the previous run did not finish, skips
+    fresh completed subtrees and saves its progress every ``checkpoint.every`` entries.
+    """
+
+    def __init__(self, workers: int = 8, max_pending: int = 10000):
+        self.workers = workers
+        self.max_pending = max_pending
+
+    def walk(self, root: Union[str, Path], checkpoint: Optional[ScanCheckpoint] = None) -> Iterator[os.DirEntry]:
+        results: queue.Queue = queue.Queue(maxsize=self.max_pending)
+        stop = threading.Event()
+        lock = threading.Lock()
+        # directories not done yet: the frontier. A directory is done once it is scanned and the consumer received
+        # all of its entries, so entries still in the queue are not lost when the walk is interrupted.
+        active: Set[str] = set()
+        scanned: Set[str] = set()
+        unconsumed: Dict[str, int] = dict()
+        parents: Dict[str, Optional[str]] = dict()
+        # 1 for the directory itself plus one per subdirectory whose subtree is not complete
+        outstanding: Dict[str, int] = dict()
+        completed_children: Dict[str, List[str]] = dict()
+        # keeps the walk from finishing before every start point is submitted
+        starting = [True]
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='walker')
+
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def submit(path: str, parent: Optional[str]) -> bool:
+            if stop.is_set():
+                return False
+            if checkpoint is not None and checkpoint.is_fresh(path):
+                logger.debug(f"Skipping '{path}', it was completely scanned recently.")
+                return False
+            with lock:
+                if path in outstanding:
+                    # already reached from another start point
+                    return False
+                active.add(path)
+                parents[path] = parent
+                outstanding[path] = 1
+                if parent is not None:
+                    outstanding[parent] += 1
+            executor.submit(scan, path)
+            return True
+
+        def complete(path: Optional[str]):
+            # walks up while subtrees become complete
+            while path is not None:
+                outstanding[path] -= 1
+                if outstanding[path]:
+                    return
+                del outstanding[path]
+                parent = parents.pop(path)
+                children = completed_children.pop(path, list())
+                if checkpoint is not None:
+                    checkpoint.mark_completed(path, children)
+                if parent is not None:
+                    completed_children.setdefault(parent, list()).append(path)
+                path = parent
+
+        def done(path: str) -> bool:
+            # called with the lock held, tells whether the whole walk is finished
+            if path in scanned and not unconsumed.get(path):
+                scanned.discard(path)
+                unconsumed.pop(path, None)
+                active.discard(path)
+                complete(path)
+            return not outstanding and not starting[0]
+
+        def scan(path: str):
+            try:
+                with os.scandir(path) as iterator:
+                    for entry in iterator:
+                        if stop.is_set():
+                            return
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                submit(entry.path, path)
+                            elif entry.is_file(follow_symlinks=False) and not is_ignored(entry.name):
+                                with lock:
+                                    unconsumed[path] = unconsumed.get(path, 0) + 1
+                                if not put((path, entry)):
+                                    return
+                        except OSError as error:
+                            logger.error(f"Unable to inspect '{entry.path}': {error}")
+            except OSError as error:
+                logger.error(f"Unable to scan directory '{path}': {error}")
+            with lock:
+                scanned.add(path)
+                finished = done(path)
+            if finished:
+                put(sentinel)
+
+        start_points = [os.fspath(root)]
+        if checkpoint is not None and checkpoint.unfinished:
+            start_points = checkpoint.frontier
+            logger.info(f"Resuming the scan of '{root}' from {len(start_points)} directories, last entry was "
+                        f"'{checkpoint.last_entry}'.")
+        submitted = [submit(path, None) for path in start_points]
+        if not any(submitted):
+            logger.info(f"Skipping the scan of '{root}', it was completely scanned recently.")
+            executor.shutdown(wait=False)
+            return
+        with lock:
+            starting[0] = False
+            finished = not outstanding
+        if finished:
+            put(sentinel)
+
+        emitted = 0
+        last_entry: Optional[str] = None
+        exhausted = False
+        try:
+            while True:
+                item = results.get()
+                if item is sentinel:
+                    break
+                directory, entry = item
+                yield entry
+                emitted += 1
+                last_entry = entry.path
+                with lock:
+                    unconsumed[directory] -= 1
+                    finished = done(directory)
+                if checkpoint is not None and emitted % checkpoint.every == 0:
+                    with lock:
+                        frontier = outermost(list(active))
+                    checkpoint.save(frontier, last_entry)
+                if finished:
+                    break
+            exhausted = True
+        finally:
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            if checkpoint is not None:
+                with lock:
+                    frontier = outermost(list(active))
+                    complete_walk = exhausted and not outstanding
+                if complete_walk:
+                    # everything outside the frontier of a resumed walk was walked by the runs before it, so the root
+                    # is complete once the whole frontier is
+                    checkpoint.mark_completed(os.fspath(root), list(checkpoint.completed))
+                checkpoint.save(frontier, last_entry)
+
+
+walker = TreeWalker(workers=settings.SCAN_WORKERS, max_pending=settings.SCAN_MAX_PENDING)
@@ -0,0 +1,384 @@
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Union
+
+from watchdog.events import (DirCreatedEvent, DirDeletedEvent, DirMovedEvent, FileCreatedEvent, FileDeletedEvent,
+                             FileModifiedEvent, FileMovedEvent, FileSystemEvent, FileSystemEventHandler)
+from watchdog.observers import inotify_c
+from watchdog.observers.inotify_c import Inotify, InotifyEvent
+
+from utilities.poller import PollIndex
+from utilities.roots import WatchRoot, root_for
+
+logger = logging.getLogger(__name__)
+
+
+class InotifyWatches:
+    """
+    The inotify instance of a watch root, the only place that reaches into watchdog's inotify wrapper, which is not
+    part of its public API. Besides the public methods of ``Inotify`` and the properties of ``InotifyEvent``, removing
+    a watch uses private members: ``read_events`` expects the bookkeeping of a watch to be there until the IN_IGNORED
+    event the kernel sends for it, so only the kernel watch is removed, through ``inotify_rm_watch``.
+
+    Written against watchdog 2.3.0, as pinned in requirements.txt. Everything used here is checked when the instance
+    is created, i.e. when the observer starts, so another version lacking it fails then, not on the first removal.
+    """
+
+    methods = ('add_watch', 'read_events', 'clear_move_records', 'close', '_raise_error')
+    members = ('_lock', '_inotify_fd', '_wd_for_path')
+    event_properties = ('src_path', 'cookie', 'is_directory', 'is_moved_from', 'is_moved_to', 'is_create',
+                        'is_delete', 'is_modify', 'is_attrib')
+
+    def __init__(self, path: bytes):
+        self.inotify = Inotify(path, recursive=False)
+        missing = [f"Inotify.{name}" for name in self.methods if not callable(getattr(Inotify, name, None))]
+        missing += [f"Inotify().{name}" for name in self.members if not hasattr(self.inotify, name)]
+        missing += [f"InotifyEvent.{name}" for name in self.event_properties if not hasattr(InotifyEvent, name)]
+        if not callable(getattr(inotify_c, 'inotify_rm_watch', None)):
+            missing.append('inotify_c.inotify_rm_watch')
+        if missing:
+            self.inotify.close()
+            raise RuntimeError(f"The installed watchdog lacks {', '.join(missing)}, which the 'lazy' observer uses; "
+                               f"install the version of requirements.txt or another OBSERVER.")
+
+    def add_watch(self, path: bytes):
+        self.inotify.add_watch(path)
+
+    def remove_watch(self, path: bytes):
+        inotify = self.inotify
+        with inotify._lock:
+            if inotify_c.inotify_rm_watch(inotify._inotify_fd, inotify._wd_for_path[path]) == -1:
+                Inotify._raise_error()
+
+    def read_events(self) -> List[InotifyEvent]:
+        return self.inotify.read_events()
+
+    def clear_move_records(self):
+        self.inotify.clear_move_records()
+
+    def close(self):
+        self.inotify.close()
+
+
+def translate(event: InotifyEvent, moves: Dict[int, InotifyEvent]) -> Optional[FileSystemEvent]:
+    """The watchdog event of an inotify event, like watchdog's emitter; ``moves`` pairs IN_MOVED_FROM/TO by cookie."""
+    path = os.fsdecode(event.src_path)
+    if event.is_moved_from:
+        moves[event.cookie] = event
+        return None
+    if event.is_moved_to:
+        source = moves.pop(event.cookie, None)
+        if source is None:
+            # moved in from a directory no watch covers
+            return DirCreatedEvent(path) if event.is_directory else FileCreatedEvent(path)
+        src_path = os.fsdecode(source.src_path)
+        return DirMovedEvent(src_path, path) if event.is_directory else FileMovedEvent(src_path, path)
+    if event.is_create:
+        return DirCreatedEvent(path) if event.is_directory else FileCreatedEvent(path)
+    if event.is_delete:
+        return DirDeletedEvent(path) if event.is_directory else FileDeletedEvent(path)
+    if (event.is_modify or event.is_attrib) and not event.is_directory:
+        return FileModifiedEvent(path)
+    return None
+
+
+class ActivityRecorder(FileSystemEventHandler):
+    """Passes the events found by polling on to the handler and records the budgets they happened in."""
+
+    def __init__(self, lazy_root: 'LazyRoot'):
+        super().__init__()
+        self.lazy_root = lazy_root
+        self.budgets: Set[str] = set()
+
+    def dispatch(self, event: FileSystemEvent):
+        self.lazy_root.handler.dispatch(event)
+        budget = self.lazy_root.budget_of(os.fsdecode(getattr(event, 'dest_path', None) or event.src_path))
+        if budget is not None:
+            self.budgets.add(budget)
+
+
+class LazyRoot:
+    """
+    The inotify watches of a watch root: every directory down to the budgets ('clientes/<email>/<budget>') is watched
+    on its own, the subtrees of the budgets only while they are active. The rest is polled through ``index``.
+    """
+
+    def __init__(self, root: WatchRoot, handler: FileSystemEventHandler):
+        self.root = root
+        self.handler = handler
+        self.recorder = ActivityRecorder(self)
+        self.index = PollIndex.for_root(root.path)
+        self.ready = False
+        self.inotify: Optional[InotifyWatches] = None
+        self.watched: Set[str] = set()
+        # budget -> time of its last event, for the budgets whose whole subtree is watched
+        self.deep: Dict[str, float] = dict()
+        self.expired = 0
+        self.armed_in = 0.0
+        self.lock = threading.RLock()
+
+    def level(self, path: str) -> Optional[int]:
+        """0 for the tenants directory, 1 for a tenant, 2 for a budget and more below it, None outside of them."""
+        tenants_dir = os.fspath(self.root.tenants_dir)
+        if path == tenants_dir:
+            return 0
+        if not path.startswith(tenants_dir + os.sep):
+            return None
+        return path[len(tenants_dir) + 1:].count(os.sep) + 1
+
+    def budget_of(self, path: str) -> Optional[str]:
+        level = self.level(path)
+        if level is None or level < 2:
+            return None
+        return path.rsplit(os.sep, level - 2)[0] if level > 2 else path
+
+    def add_watch(self, path: str) -> bool:
+        try:
+            self.inotify.add_watch(os.fsencode(path))
+        except FileNotFoundError:
+            # removed since its event, the event of its removal follows
+            return False
+        except OSError as error:
+            logger.error(f"Unable to watch '{path}': {error}")
+            return False
+        self.watched.add(path)
+        return True
+
+    def remove_watch(self, path: str):
+        self.watched.discard(path)
+        try:
+            self.inotify.remove_watch(os.fsencode(path))
+        except (KeyError, OSError):
+            # the kernel already dropped the watch of a removed directory
+            pass
+
+    def subdirectories(self, path: str) -> List[str]:
+        try:
+            with os.scandir(path) as iterator:
+                return [entry.path for entry in iterator if entry.is_dir(follow_symlinks=False)]
+        except OSError as error:
+            logger.error(f"Unable to list directory '{path}': {error}")
+            return list()
+
+    def arm(self):
+        """Watches the root, the tenants directory, every tenant and every budget, not what is below the budgets."""
+        started = time.monotonic()
+        self.inotify = InotifyWatches(os.fsencode(self.root.path))
+        self.watched.add(os.fspath(self.root.path))
+        tenants_dir = os.fspath(self.root.tenants_dir)
+        if os.path.isdir(tenants_dir) and tenants_dir not in self.watched:
+            self.add_watch(tenants_dir)
+        for tenant in self.subdirectories(tenants_dir):
+            self.arm_tenant(tenant)
+        self.armed_in = time.monotonic() - started
+        logger.info(f"Armed {len(self.watched)} watches on '{self.root.path}' in {self.armed_in:.2f}s.")
+
+    def arm_tenant(self, tenant: str):
+        if self.add_watch(tenant):
+            for budget in self.subdirectories(tenant):
+                self.add_watch(budget)
+
+    def promote(self, budget: str, now: float):
+        """Watches the whole subtree of an active budget, then reports what changed in it before the watches."""
+        if budget in self.deep:
+            self.deep[budget] = now
+            return
+        self.deep[budget] = now
+        if budget not in self.watched and not self.add_watch(budget):
+            return
+        for directory, subdirectories, _ in os.walk(budget):
+            for name in subdirectories:
+                self.add_watch(os.path.join(directory, name))
+        logger.debug(f"Budget '{budget}' is active, watching its subtree: {len(self.watched)} watches.")
+        if not self.ready:
+            return
+        if budget in self.index.dirs:
+            under = budget + os.sep
+            self.index.poll(0, self.handler, full=True, select=lambda path: path == budget or path.startswith(under))
+        else:
+            # new budget, whatever is in it already was written before its watches
+            self.index.index_tree(budget, self.handler, changed_at=now)
+
+    def poll(self, number: int, full: bool = False) -> dict:
+        """Polls the directories no watch covers; the budgets where it finds changes become active."""
+        with self.lock:
+            report = self.index.poll(number, self.recorder, full=full, select=lambda path: path not in self.watched)
+            now = time.time()
+            for budget in self.recorder.budgets:
+                if os.path.isdir(budget):
+                    self.promote(budget, now)
+            self.recorder.budgets.clear()
+        return report
+
+    def expire(self, idle_seconds: float, now: float):
+        for budget, active_at in list(self.deep.items()):
+            if now - active_at < idle_seconds:
+                continue
+            # index the subtree first: what changes until the watches are removed is reported by inotify still
+            if self.ready:
+                self.index.drop_tree(budget)
+                self.index.index_tree(budget, None)
+            under = budget + os.sep
+            for path in [path for path in self.watched if path.startswith(under)]:
+                self.remove_watch(path)
+            del self.deep[budget]
+            self.expired += 1
+            logger.debug(f"Budget '{budget}' is idle, back to polling its subtree.")
+
+    def forget(self, top: str):
+        """Drops the watches and the index entries of a removed or moved directory."""
+        under = top + os.sep
+        for path in [path for path in self.watched if path == top or path.startswith(under)]:
+            self.remove_watch(path)
+        for budget in [budget for budget in self.deep if budget == top or budget.startswith(under)]:
+            del self.deep[budget]
+        if self.ready:
+            self.index.drop_tree(top)
+
+    def on_event(self, event: FileSystemEvent, now: float):
+        """Keeps the watches in line with the tree; every event of a budget makes it active."""
+        path = os.fsdecode(getattr(event, 'dest_path', None) or event.src_path)
+        if isinstance(event, (DirDeletedEvent, DirMovedEvent)):
+            self.forget(os.fsdecode(event.src_path))
+        if isinstance(event, DirMovedEvent):
+            # inotify moved the watch of the directory itself to its destination, which is armed again below if needed
+            self.remove_watch(path)
+        level = self.level(path)
+        if event.is_directory and isinstance(event, (DirCreatedEvent, DirMovedEvent)):
+            if level == 0 and path not in self.watched:
+                self.add_watch(path)
+            elif level == 1:
+                self.arm_tenant(path)
+        budget = self.budget_of(path)
+        if budget is not None and os.path.isdir(budget):
+            self.promote(budget, now)
+
+    def read(self, stopping: threading.Event):
+        moves: Dict[int, InotifyEvent] = dict()
+        while not stopping.is_set():
+            try:
+                inotify_events = self.inotify.read_events()
+            except OSError:
+                if stopping.is_set():
+                    # the observer closed the descriptor this thread was reading, to stop it
+                    return
+                raise
+            now = time.time()
+            for inotify_event in inotify_events:
+                event = translate(inotify_event, moves)
+                if event is None:
+                    continue
+                self.handler.dispatch(event)
+                with self.lock:
+                    self.on_event(event, now)
+            # sources whose destination was not seen in the same read left the watched directories
+            for source in moves.values():
+                path = os.fsdecode(source.src_path)
+                event = DirDeletedEvent(path) if source.is_directory else FileDeletedEvent(path)
+                self.handler.dispatch(event)
+                with self.lock:
+                    self.on_event(event, now)
+            moves.clear()
+            self.inotify.clear_move_records()
+
+    @property
+    def deep_watches(self) -> int:
+        return sum(1 for path in self.watched if self.budget_of(path) in self.deep and path not in self.deep)
+
+    def status(self) -> dict:
+        return dict(watches=len(self.watched), deep_watches=self.deep_watches, active_budgets=len(self.deep),
+                    expired=self.expired, directories=len(self.index.dirs), armed_in=round(self.armed_in, 3))
+
+
+class LazyObserver:
+    """
+    Observer for trees too large to watch whole: a recursive inotify watch needs one kernel watch per directory
+    (``max_user_watches``) and walks the tree before the first event.
+
+    Here only the root, the tenants directory, the tenants and the budgets are watched at start. A budget with an
+    event gets watches on its whole subtree, which it keeps until it has been idle for ``idle_seconds``. Below the
+    budgets, the inactive subtrees are covered by polling directory mtimes every ``interval`` seconds, through the
+    same persistent index as the 'polling' observer; a change found there makes the budget active too. Every root
+    uses a single inotify instance, unlike watchdog's observer which opens one (and a thread) per scheduled watch.
+    It has the ``schedule``, ``start``, ``stop`` and ``join`` of watchdog's observers.
+    """
+
+    def __init__(self, interval: float = 2, idle_seconds: float = 600, report_every: int = 30):
+        self.interval = interval
+        self.idle_seconds = idle_seconds
+        self.report_every = report_every
+        self.roots: List[LazyRoot] = list()
+        self.polls = 0
+        self.started_in = 0.0
+        self.last: Dict[str, dict] = dict()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = list()
+
+    def schedule(self, event_handler: FileSystemEventHandler, path: Union[str, Path], recursive: bool = True):
+        self.roots.append(LazyRoot(root_for(Path(path).resolve()), event_handler))
+
+    def start(self):
+        started = time.monotonic()
+        for lazy_root in self.roots:
+            lazy_root.arm()
+            self._threads.append(threading.Thread(target=lazy_root.read, args=(self._stopping,),
+                                                  name=f"inotify-{lazy_root.root.name}", daemon=True))
+        self._threads.append(threading.Thread(target=self._run, name='lazy-poller', daemon=True))
+        for thread in self._threads:
+            thread.start()
+        self.started_in = time.monotonic() - started
+        logger.info(f"Watching {len(self.roots)} roots with {sum(len(root.watched) for root in self.roots)} watches, "
+                    f"armed in {self.started_in:.2f}s.")
+
+    def _run(self):
+        # the index of the cold subtrees is loaded or built after the watches are armed, events flow meanwhile
+        restored = dict()
+        for lazy_root in self.roots:
+            started = time.monotonic()
+            restored[lazy_root.root.name] = lazy_root.index.load()
+            if not restored[lazy_root.root.name]:
+                lazy_root.index.build()
+            lazy_root.ready = True
+            logger.info(f"Polling index of '{lazy_root.root.path}' ready in {time.monotonic() - started:.1f}s: "
+                        f"{len(lazy_root.watched)} of {len(lazy_root.index.dirs)} directories watched.")
+        stats = 0
+        while not self._stopping.wait(self.interval):
+            now = time.time()
+            for lazy_root in self.roots:
+                try:
+                    report = lazy_root.poll(self.polls, full=restored.pop(lazy_root.root.name, False))
+                    with lazy_root.lock:
+                        lazy_root.expire(self.idle_seconds, now)
+                except Exception as error:
+                    logger.error(f"Poll of '{lazy_root.root.path}' failed: {error}")
+                    continue
+                self.last[lazy_root.root.name] = dict(report, **lazy_root.status())
+                stats += report['stats']
+            self.polls += 1
+            if self.polls % self.report_every == 0:
+                logger.info('Watches: ' + ', '.join(
+                    f"{root.root.name} {len(root.watched)} ({len(root.deep)} active budgets)" for root in self.roots)
+                    + f"; {stats / self.report_every:.0f} stats per poll of the cold subtrees.")
+                stats = 0
+        for lazy_root in self.roots:
+            if lazy_root.ready:
+                lazy_root.index.save()
+
+    def stop(self):
+        self._stopping.set()
+        for lazy_root in self.roots:
+            if lazy_root.inotify is not None:
+                # wakes the reader blocked on the inotify descriptor
+                lazy_root.inotify.close()
+
+    def join(self, timeout: Optional[float] = None):
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def status(self) -> dict:
+        return dict(polls=self.polls, started_in=round(self.started_in, 3),
+                    roots={lazy_root.root.name: self.last.get(lazy_root.root.name, lazy_root.status())
+                           for lazy_root in self.roots})